@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+from datetime import datetime
+from hashlib import blake2b
+from typing import TYPE_CHECKING
+
+import logger
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("ad_history")
+
+
+class AdHistory:
+    """Records how known ads change over time from the list and detail pages that are downloaded anyway.
+
+    Only the fields that changed since the last observation are stored. Unchanged fields of a delta row are NULL. The
+    state an observation is compared with is the saved ad folded with its earlier deltas, queried once per ad and then
+    kept in memory for the session.
+    """
+    FIELDS = ("price", "status", "deactivates", "description_hash")
+
+    GET_HISTORY_QUERY: str = "SELECT ad_id, price_value, status, deactivates, description_hash FROM ad_history " \
+                             "WHERE source = %s AND ad_id IN ({}) ORDER BY ad_id, observed_at, primary_id"
+    SAVE_HISTORY_QUERY: str = "INSERT INTO ad_history(source, ad_id, observed_at, price_value, status, deactivates, " \
+                              "description_hash) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+
+    def __init__(self, connection: MySQLConnection, source: str, state_query: str):
+        """
+        :param connection:
+        :param source: source name
+        :param state_query: query with an IN placeholder '{}' for ad ids that returns the saved (ad_id, price_value,
+         status, deactivates, description) of each ad
+        """
+        self._BATCH_SIZE = 100
+        self._connection = connection
+        self._source = source
+        self._state_query = state_query
+        self._state = {}
+        self._delta_tuple_list = []
+        self._total_saved = 0
+
+    def observe(self, observations: dict):
+        """compares observed ads with their last known state and queues the changes
+
+        :param observations: dict of ad id -> dict with any of the keys price, status, deactivates, description
+        """
+        if len(observations) == 0:
+            return
+        self._load_state([ad_id for ad_id in observations if ad_id not in self._state])
+        observed_at = datetime.now().replace(microsecond=0)
+        for ad_id, observed in observations.items():
+            if ad_id not in self._state:
+                continue
+            delta = self._get_delta(self._state[ad_id], self._get_fields(observed))
+            if delta is None:
+                continue
+            self._delta_tuple_list.append((self._source, ad_id, observed_at) + delta)
+            logger.info(f"{self._source} ad {ad_id} changed: {delta}")
+        if len(self._delta_tuple_list) >= self._BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self._delta_tuple_list) == 0:
+            return
+        with self._connection.cursor() as cursor:
+            cursor.executemany(AdHistory.SAVE_HISTORY_QUERY, self._delta_tuple_list)
+            self._connection.commit()
+        self._total_saved += len(self._delta_tuple_list)
+        logger.info(f"Saved {len(self._delta_tuple_list)} history rows. Total saved: {self._total_saved}")
+        self._delta_tuple_list.clear()
+
+    def _get_delta(self, state: dict, observed: dict):
+        """updates the state and returns the changed fields as a tuple in FIELDS order, None when nothing changed"""
+        changed = False
+        delta = []
+        for field in AdHistory.FIELDS:
+            value = observed.get(field)
+            if value is None or value == state.get(field):
+                delta.append(None)
+                continue
+            state[field] = value
+            delta.append(value)
+            changed = True
+        return tuple(delta) if changed else None
+
+    def _get_fields(self, observed: dict) -> dict:
+        fields = {key: observed[key] for key in ("price", "status", "deactivates") if key in observed}
+        if observed.get("description") is not None:
+            fields["description_hash"] = self._hash(observed["description"])
+        return fields
+
+    def _load_state(self, ad_ids: list):
+        if len(ad_ids) == 0:
+            return
+        placeholders = ", ".join(["%s"] * len(ad_ids))
+        with self._connection.cursor() as cursor:
+            cursor.execute(self._state_query.format(placeholders), ad_ids)
+            for ad_id, price, status, deactivates, description in cursor.fetchall():
+                self._state[ad_id] = {"price": price, "status": status, "deactivates": deactivates,
+                                      "description_hash": self._hash(description) if description is not None else None}
+            cursor.execute(AdHistory.GET_HISTORY_QUERY.format(placeholders), [self._source] + ad_ids)
+            for row in cursor.fetchall():
+                state = self._state.setdefault(row[0], {})
+                # deltas are ordered by time, the latest non null value of each field wins
+                for field, value in zip(AdHistory.FIELDS, row[1:]):
+                    if value is not None:
+                        state[field] = value
+
+    def _hash(self, text: str) -> bytes:
+        return blake2b(text.encode("utf-8"), digest_size=8).digest()
@@ -1,6 +1,6 @@
 import argparse
 
-from time import perf_counter
+from time import perf_counter, sleep
 from mysql.connector import connect, Error
 
 argument_parser = argparse.ArgumentParser(allow_abbrev=False)
@@ -8,11 +8,40 @@ argument_parser.add_argument("-L", "--limit", metavar="integer",
                              type=int, help="limit the amount of ads fetched, 0 fetches all ads, cannot be negative")
 argument_parser.add_argument("-N", "--new", action="store_true",
                              help="only fetch latest ads relative to local latest ad")
+argument_parser.add_argument("-A", "--adaptive", action="store_true",
+                             help="keep running and poll each source for new ads when its learnt posting rate "
+                                  "expects about a page of new ads")
+argument_parser.add_argument("-P", "--profile", metavar="directory", nargs="?", const="profiles",
+                             help="profile each agent run and write pstats and collapsed stack files per source to "
+                                  "directory (default profiles)")
+argument_parser.add_argument("-M", "--memtrace", action="store_true",
+                             help="trace memory allocations of each agent run and log the peak and the top allocation "
+                                  "sites per phase")
+argument_parser.add_argument("-R", "--request-budget", metavar="integer", type=int,
+                             help="total requests of the run, split across the sources by their learnt yield. Sets "
+                                  "the fetch limit of every source")
+argument_parser.add_argument("-T", "--time-budget", metavar="seconds", type=int,
+                             help="total duration of the run in seconds, split across the sources like -R")
+argument_parser.add_argument("--plan", action="store_true",
+                             help="log the estimated requests and duration of the run per source and the limits of "
+                                  "the budget, then exit without fetching anything")
 arguments = argument_parser.parse_args()
 _limit = arguments.limit
 _new = arguments.new
+_adaptive = arguments.adaptive
+_profile_dir = arguments.profile
+_memtrace = arguments.memtrace
+_request_budget = arguments.request_budget
+_time_budget = arguments.time_budget
+_plan = arguments.plan
 if _limit is not None and _limit < 0:
     argument_parser.error("limit cannot be negative")
+if _request_budget is not None and _time_budget is not None:
+    argument_parser.error("use either a request budget or a time budget")
+if (_request_budget is not None and _request_budget <= 0) or (_time_budget is not None and _time_budget <= 0):
+    argument_parser.error("budget must be a positive number")
+if _adaptive and (_request_budget is not None or _time_budget is not None):
+    argument_parser.error("adaptive polling sets the limits from the posting rate, a budget cannot be used with it")
 
 
 
@@ -22,6 +51,18 @@ import logger
 from fetcher import Fetcher
 from sources.agent_factory import AgentFactory
 from configuration import AppConfig
+from scheduler import PollScheduler
+from run_planner import RunPlanner
+from proxy_pool import Proxy, ProxyPool
+from dedupe import DedupeIndex
+from alerts import SearchAlerts
+from sellers import SellerIndex
+from search_index import SearchIndex
+from freshness import FreshnessMetric
+from raw_archive import BlobStore, RawArchive
+from event_sink import EventPublisher, JsonlSink, UnixSocketSink, KafkaSink, make_kafka_producer
+from profiler import Profiler, PhaseProfiler, MemoryTracer, ProfilerGroup
+from schema_migrator import SchemaMigrator
 
 logger = logger.get_logger("Main")
 
@@ -34,26 +75,127 @@ config.set_fetch_type(_new)
 db_config = config.get_db_config()
 sources = config.get_sources()
 
+scheduler_config = config.get_scheduler_config()
+scheduler = PollScheduler(scheduler_config["history_file"], scheduler_config["min_interval"],
+                          scheduler_config["max_interval"], scheduler_config["default_interval"])
+pool_config = config.get_proxy_pool_config()
+# requests per second of the pool when every proxy sends as fast as its wait allows
+proxy_waits = [proxy["wait_seconds"] for proxy in pool_config["proxies"]]
+planner = RunPlanner(config.get_planner_config()["history_file"],
+                     0.0 if min(proxy_waits) <= 0 else 1 / sum(1 / wait for wait in proxy_waits))
+if _plan or _request_budget is not None or _time_budget is not None:
+    estimates = [planner.estimate(source, scheduler) for source in sources]
+    if _request_budget is not None or _time_budget is not None:
+        planner.allocate(estimates, _request_budget, _time_budget)
+        for source, estimate in zip(sources, estimates):
+            source["FETCH_LIMIT"] = estimate["plan_limit"]
+    RunPlanner.log_plan(estimates)
+    if _plan:
+        exit(0)
+
 try:
     connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
 except Error as err:
     logger.critical(err)
     exit(1)
 
+pending_migrations = SchemaMigrator(connection).get_pending()
+if len(pending_migrations) > 0:
+    logger.warning(f"{len(pending_migrations)} database migrations are not applied. Run migrate.py")
+
 headers = config.get_request_headers()
 logger.info(f"User set request headers {headers}")
-wait_seconds = config.get_wait_seconds()
+proxy_pool = ProxyPool([Proxy(proxy["name"], proxy["proxies"], proxy["wait_seconds"]) for proxy in pool_config["proxies"]],
+                       pool_config["strategy"], pool_config["max_errors"], pool_config["evict_seconds"])
+logger.info(f"Sending requests through {len(proxy_pool)} proxies ({pool_config['strategy']})")
 
-fetcher = Fetcher(headers=headers, wait_seconds=wait_seconds)
-agentFactory = AgentFactory(connection, fetcher)
+fetcher = Fetcher(headers=headers, proxy_pool=proxy_pool)
+freshness_metric = FreshnessMetric(config.get_freshness_config()["late_seconds"])
+storage_hooks = [freshness_metric]
+if config.is_dedupe_enabled():
+    storage_hooks.append(DedupeIndex())
+if config.is_alerts_enabled():
+    storage_hooks.append(SearchAlerts(connection))
+sellers_config = config.get_sellers_config()
+if sellers_config["enabled"]:
+    storage_hooks.append(SellerIndex(sellers_config["dealer_ads"]))
+search_config = config.get_search_config()
+if search_config["enabled"]:
+    storage_hooks.append(SearchIndex(search_config["path"], search_config["synonyms"]))
+    logger.info(f"Indexing saved ads for search in {search_config['path']}")
+archive = None
+archive_config = config.get_archive_config()
+if archive_config["enabled"]:
+    archive = RawArchive(connection, BlobStore(archive_config["directory"], archive_config["level"]))
+    storage_hooks.append(archive)
+    logger.info(f"Archiving fetched detail pages in {archive_config['directory']}")
+events_config = config.get_events_config()
+if events_config["enabled"]:
+    if events_config["sink"] == "unix":
+        event_sink = UnixSocketSink(events_config["socket"], events_config["compression"])
+    elif events_config["sink"] == "kafka":
+        event_sink = KafkaSink(make_kafka_producer(events_config["kafka_servers"], events_config["compression"],
+                                                   events_config["linger_ms"]), events_config["topic"])
+    else:
+        event_sink = JsonlSink(events_config["path"], events_config["compression"])
+    storage_hooks.append(EventPublisher(event_sink, events_config["buffer_size"], events_config["batch_size"],
+                                        events_config["linger_ms"] / 1000, events_config["block_seconds"]))
+    logger.info(f"Publishing saved ads to the {events_config['sink']} event sink")
+profilers = []
+if _memtrace:
+    profilers.append(MemoryTracer())
+if _profile_dir is not None:
+    profilers.append(PhaseProfiler(_profile_dir))
+profiler = ProfilerGroup(profilers) if len(profilers) > 1 else profilers[0] if len(profilers) == 1 else Profiler()
+agentFactory = AgentFactory(connection, fetcher, scheduler, storage_hooks, config, profiler, archive,
+                            scheduler_config["feed_yield_file"])
 
-try:
-    for source in sources:
+
+def run_agent(source: dict):
+    profiler.start(source["NAME"])
+    requests_before = fetcher.get_request_count()
+    run_start = perf_counter()
+    try:
         agent = agentFactory.make_agent(source)
         agent.run()
-    logger.info(f"Total requests: {fetcher.get_request_count()}")
-    logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
+        freshness_metric.finish_run(source["NAME"])
+        # profiling and tracing slow the run down, its duration says nothing about the next one
+        if len(profilers) == 0:
+            planner.record_run(source["NAME"], fetcher.get_request_count() - requests_before,
+                               perf_counter() - run_start, agent.get_run_stats())
+    finally:
+        profiler.stop()
+
+
+try:
+    if _adaptive and len(sources) > 0:
+        logger.info("Adaptive polling. Only new ads are fetched, limits are set by the scheduler")
+        configured_limits = {source["NAME"]: source["FETCH_LIMIT"] for source in sources}
+        # polls until the user aborts
+        while True:
+            for source in sources:
+                if not scheduler.is_due(source["NAME"]):
+                    continue
+                limit = scheduler.get_fetch_limit(source["NAME"])
+                source["FETCH_TYPE"] = "new"
+                source["FETCH_LIMIT"] = limit if limit is not None else configured_limits[source["NAME"]]
+                run_agent(source)
+            wait = min(scheduler.get_seconds_until_due(source["NAME"]) for source in sources)
+            logger.info(f"Total requests: {fetcher.get_request_count()}. Next poll in {wait:0.0f} seconds")
+            sleep(wait)
+    else:
+        for source in sources:
+            run_agent(source)
+        logger.info(f"Total requests: {fetcher.get_request_count()}")
+        proxy_pool.log_stats()
+        stream_stats = fetcher.get_stream_stats()
+        if stream_stats["received"] > 0:
+            logger.info(f"Streamed {stream_stats['received']} bytes, saved {stream_stats['saved']} bytes")
+        logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
 except KeyboardInterrupt as exc:
     logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
     logger.warning("User abort. Exiting...")
     exit(0)
+finally:
+    for hook in storage_hooks:
+        hook.close()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import math
+import time
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING
+
+import logger
+from storage_hook import StorageHook
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("alerts")
+
+_ANY = None
+
+
+def normalise_term(value):
+    """lower case make, model or location with single spaces, None when empty"""
+    if value is None:
+        return None
+    value = " ".join(str(value).lower().split())
+    return value if value != "" else None
+
+
+class IntervalTree:
+    """Static centered interval tree. stab(point) returns the items of the intervals that contain the point in
+    O(log n + k) for k items. Bounds are inclusive, -inf and inf for open intervals.
+    """
+
+    def __init__(self, intervals: list):
+        """
+        :param intervals: list of tuples (low, high, item)
+        """
+        self._root = IntervalTree._build(intervals)
+
+    @staticmethod
+    def _build(intervals: list):
+        if len(intervals) == 0:
+            return None
+        finite = sorted(bound for low, high, _ in intervals for bound in (low, high) if not math.isinf(bound))
+        center = finite[len(finite) // 2] if len(finite) > 0 else 0
+        left, right, overlapping = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                overlapping.append(interval)
+        by_low = sorted(overlapping, key=lambda interval: interval[0])
+        by_high = sorted(overlapping, key=lambda interval: interval[1])
+        # (center, lows, items by low, highs, items by high, left, right)
+        return (center, [interval[0] for interval in by_low], [interval[2] for interval in by_low],
+                [interval[1] for interval in by_high], [interval[2] for interval in by_high],
+                IntervalTree._build(left), IntervalTree._build(right))
+
+    def stab(self, point) -> list:
+        items = []
+        node = self._root
+        while node is not None:
+            center, lows, low_items, highs, high_items, left, right = node
+            if point < center:
+                # overlapping intervals end at or after center, they contain point when they start before it
+                items.extend(low_items[:bisect_right(lows, point)])
+                node = left
+            elif point > center:
+                items.extend(high_items[bisect_left(highs, point):])
+                node = right
+            else:
+                items.extend(low_items)
+                break
+        return items
+
+
+class _SearchGroup:
+    """saved searches with the same make, model and location, indexed by their year and price ranges"""
+
+    def __init__(self):
+        self._ranges = []
+        self._yom = None
+        self._price = None
+        self._any_yom = set()
+        self._any_price = set()
+
+    def add(self, search_id: int, yom_min, yom_max, price_max):
+        self._ranges.append((search_id, yom_min, yom_max, price_max))
+
+    def build(self):
+        self._yom = IntervalTree([(yom_min if yom_min is not None else -math.inf,
+                                   yom_max if yom_max is not None else math.inf, search_id)
+                                  for search_id, yom_min, yom_max, _ in self._ranges])
+        self._price = IntervalTree([(-math.inf, price_max if price_max is not None else math.inf, search_id)
+                                    for search_id, _, _, price_max in self._ranges])
+        self._any_yom = {search_id for search_id, yom_min, yom_max, _ in self._ranges
+                         if yom_min is None and yom_max is None}
+        self._any_price = {search_id for search_id, _, _, price_max in self._ranges if price_max is None}
+        self._ranges = None
+
+    def match(self, yom, price) -> set:
+        # an ad without a year or price only matches searches that do not restrict it
+        yom_matches = self._yom.stab(yom) if yom is not None else self._any_yom
+        price_matches = self._price.stab(price) if price is not None else self._any_price
+        return set(yom_matches).intersection(price_matches)
+
+
+class SavedSearchIndex:
+    """Finds the saved searches an ad matches without looking at the other searches.
+
+    Searches are grouped in an inverted index by their (make, model, location), where a search that does not restrict a
+    field is filed under None for it. An ad looks up the 8 groups its own make, model and location can be in, and each
+    group answers the year and price conditions with an interval tree per range. The cost of an ad depends on the
+    searches that share its make, model or location, not on the number of saved searches.
+    """
+
+    def __init__(self, searches: list):
+        """
+        :param searches: list of tuples (search_id, make, model, location, yom_min, yom_max, price_max). None does not
+         restrict a field
+        """
+        self._groups = {}
+        self._size = 0
+        for search_id, make, model, location, yom_min, yom_max, price_max in searches:
+            key = (normalise_term(make), normalise_term(model), normalise_term(location))
+            if key == (_ANY, _ANY, _ANY) and yom_min is None and yom_max is None and price_max is None:
+                logger.warning(f"Saved search {search_id} does not restrict any field, skipping it")
+                continue
+            if key not in self._groups:
+                self._groups[key] = _SearchGroup()
+            self._groups[key].add(search_id, yom_min, yom_max, price_max)
+            self._size += 1
+        for group in self._groups.values():
+            group.build()
+
+    def __len__(self):
+        return self._size
+
+    def match(self, record: dict) -> set:
+        """ids of the searches the ad matches
+
+        :param record: storage hook record of the ad. See StorageHook
+        """
+        matches = set()
+        for make in {normalise_term(record["make"]), _ANY}:
+            for model in {normalise_term(record["model"]), _ANY}:
+                for location in {normalise_term(record["location"]), _ANY}:
+                    group = self._groups.get((make, model, location))
+                    if group is not None:
+                        matches.update(group.match(record["yom"], record["price"]))
+        return matches
+
+
+class SearchAlerts(StorageHook):
+    """Writes an alert to the search_alert table for every saved search that a newly saved ad matches.
+
+    Ads are matched when they are queued, the alerts are inserted with the ads of the save so an alert never points to
+    an ad that was not committed. Saved searches are loaded again after RELOAD_SECONDS.
+    """
+    RELOAD_SECONDS = 300
+
+    GET_SEARCHES_QUERY: str = "SELECT search_id, make, model, location, yom_min, yom_max, price_max FROM saved_search " \
+                              "WHERE active = 1"
+    SAVE_ALERT_QUERY: str = "INSERT IGNORE INTO search_alert(search_id, source, ad_id) VALUES (%s, %s, %s)"
+
+    def __init__(self, connection: MySQLConnection):
+        self._connection = connection
+        self._index = None
+        self._loaded_at = 0.0
+        self._alert_tuple_list = []
+        self._total_alerts = 0
+        self._load()
+
+    def on_queue(self, record: dict):
+        for search_id in self._index.match(record):
+            self._alert_tuple_list.append((search_id, record["source"], record["ad_id"]))
+
+    def on_save(self, cursor, records: list):
+        if len(self._alert_tuple_list) == 0:
+            return
+        cursor.executemany(SearchAlerts.SAVE_ALERT_QUERY, self._alert_tuple_list)
+        self._total_alerts += len(self._alert_tuple_list)
+        logger.info(f"Saved {len(self._alert_tuple_list)} alerts. Total alerts: {self._total_alerts}")
+        self._alert_tuple_list = []
+
+    def on_commit(self, records: list):
+        if time.monotonic() - self._loaded_at > SearchAlerts.RELOAD_SECONDS:
+            self._load()
+
+    def _load(self):
+        start = time.perf_counter()
+        with self._connection.cursor() as cursor:
+            cursor.execute(SearchAlerts.GET_SEARCHES_QUERY)
+            self._index = SavedSearchIndex(cursor.fetchall())
+        self._loaded_at = time.monotonic()
+        logger.info(f"Indexed {len(self._index)} saved searches in {time.perf_counter() - start:0.2f} seconds")
@@ -0,0 +1,100 @@
+import argparse
+
+from time import perf_counter
+from mysql.connector import connect, Error
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="fill the typed price, mileage, engine capacity and year columns "
+                                                      "of ads saved before they were added")
+argument_parser.add_argument("-B", "--batch", metavar="integer", type=int, default=1000,
+                             help="number of rows converted per transaction")
+arguments = argument_parser.parse_args()
+_batch = arguments.batch
+if _batch <= 0:
+    argument_parser.error("batch must be a positive number")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from normaliser import Normaliser
+from sources.ikman import ikman_records
+
+logger = logger.get_logger("Backfill")
+
+GET_RIYASEWANA_QUERY: str = "SELECT primary_id, price, mileage, engine_cc FROM riyasewana_ad WHERE primary_id > %s " \
+                            "AND price_value IS NULL ORDER BY primary_id LIMIT %s"
+UPDATE_RIYASEWANA_QUERY: str = "UPDATE riyasewana_ad SET price_value = %s, mileage_km = %s, engine_cc_value = %s " \
+                               "WHERE primary_id = %s"
+GET_IKMAN_QUERY: str = "SELECT primary_id, ad_id, money FROM ad WHERE primary_id > %s AND price_value IS NULL " \
+                       "ORDER BY primary_id LIMIT %s"
+GET_IKMAN_PROPERTIES_QUERY: str = "SELECT ad_id, prop_key, prop_value FROM properties WHERE ad_id IN ({}) " \
+                                  "AND prop_key IN (%s, %s, %s, %s, %s)"
+UPDATE_IKMAN_QUERY: str = "UPDATE ad SET make = %s, model = %s, yom = %s, price_value = %s, mileage_km = %s, " \
+                          "engine_cc_value = %s WHERE primary_id = %s"
+
+
+def backfill_riyasewana(_connection, _normaliser: Normaliser) -> int:
+    last_id = 0
+    total = 0
+    while True:
+        with _connection.cursor() as cursor:
+            cursor.execute(GET_RIYASEWANA_QUERY, (last_id, _batch))
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                break
+            updates = [(_normaliser.parse_price(price), _normaliser.parse_mileage(mileage),
+                        _normaliser.parse_engine_cc(engine_cc), primary_id)
+                       for primary_id, price, mileage, engine_cc in rows]
+            cursor.executemany(UPDATE_RIYASEWANA_QUERY, updates)
+            _connection.commit()
+        last_id = rows[-1][0]
+        total += len(rows)
+        logger.info(f"riyasewana: converted {total} ads")
+    return total
+
+
+def backfill_ikman(_connection, _normaliser: Normaliser) -> int:
+    last_id = 0
+    total = 0
+    keys = (ikman_records.MAKE_KEY, ikman_records.MODEL_KEY, ikman_records.YOM_KEY, ikman_records.MILEAGE_KEY,
+            ikman_records.ENGINE_CC_KEY)
+    while True:
+        with _connection.cursor() as cursor:
+            cursor.execute(GET_IKMAN_QUERY, (last_id, _batch))
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                break
+            ad_ids = [row[1] for row in rows]
+            cursor.execute(GET_IKMAN_PROPERTIES_QUERY.format(", ".join(["%s"] * len(ad_ids))), ad_ids + list(keys))
+            properties = {}
+            for prop in cursor.fetchall():
+                properties.setdefault(prop[0], []).append(prop)
+            updates = [ikman_records.get_typed_values(_normaliser, money, properties.get(ad_id, [])) + (primary_id,)
+                       for primary_id, ad_id, money in rows]
+            cursor.executemany(UPDATE_IKMAN_QUERY, updates)
+            _connection.commit()
+        last_id = rows[-1][0]
+        total += len(rows)
+        logger.info(f"ikman: converted {total} ads")
+    return total
+
+
+config = AppConfig()
+config.parse_config_file()
+db_config = config.get_db_config()
+
+try:
+    connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+except Error as err:
+    logger.critical(err)
+    exit(1)
+
+normaliser = Normaliser()
+try:
+    logger.info(f"Converted {backfill_riyasewana(connection, normaliser)} riyasewana ads")
+    logger.info(f"Converted {backfill_ikman(connection, normaliser)} ikman ads")
+    logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
+except KeyboardInterrupt as exc:
+    logger.warning("User abort. Converted batches are kept, run again to continue")
+    exit(0)
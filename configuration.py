@@ -11,6 +11,10 @@ class AppConfig:
         self._CONFIG_SOURCES = []
         self._MAX_FAILS = 2
         self._PROXIES = {}
+        self._PROXY_POOL = []
+        self._PROXY_STRATEGY = "round_robin"
+        self._PROXY_MAX_ERRORS = 3
+        self._PROXY_EVICT_SECONDS = 300
         self._DEFAULT_FETCH_LIMIT = 10
         self._DEFAULT_FETCH_TYPE = "all"
         self._ARG_FETCH_LIMIT = -1
@@ -20,6 +24,43 @@ class AppConfig:
         self._DB_PASS = ""
         self._DB_HOST = ""
         self._DB_NAME = ""
+        self._DEDUPE = False
+        self._HISTORY = False
+        self._ALERTS = False
+        self._RETRY = False
+        self._RETRY_MAX_ATTEMPTS = 5
+        self._RETRY_BUDGET = 20
+        self._RETRY_BASE_DELAY = 300
+        self._RETRY_MAX_DELAY = 86400
+        self._POLL_HISTORY_FILE = "poll_history.json"
+        self._FEED_YIELD_FILE = "feed_yield.json"
+        self._ARCHIVE = False
+        self._ARCHIVE_DIRECTORY = "archive"
+        self._ARCHIVE_LEVEL = 3
+        self._EVENTS = False
+        self._EVENTS_SINK = "jsonl"
+        self._EVENTS_PATH = "events.jsonl"
+        self._EVENTS_SOCKET = "/tmp/motorcycle-ads.sock"
+        self._EVENTS_KAFKA_SERVERS = "localhost:9092"
+        self._EVENTS_TOPIC = "motorcycle-ads"
+        self._EVENTS_COMPRESSION = "none"
+        self._EVENTS_BATCH_SIZE = 100
+        self._EVENTS_LINGER_MS = 500
+        self._EVENTS_BUFFER_SIZE = 10000
+        self._EVENTS_BLOCK_SECONDS = 5
+        self._POLL_MIN_INTERVAL = 300
+        self._POLL_MAX_INTERVAL = 6 * 3600
+        self._POLL_DEFAULT_INTERVAL = 1800
+        self._PLAN_HISTORY_FILE = "run_history.json"
+        self._FRESHNESS_LATE_SECONDS = 6 * 3600
+        self._STATS_CACHE_DIRECTORY = "stats_cache"
+        self._STATS_MILEAGE_BAND_KM = 10000
+        self._STATS_CHUNK_SIZE = 50000
+        self._SELLERS = False
+        self._SELLERS_DEALER_ADS = 10
+        self._SEARCH = False
+        self._SEARCH_PATH = "search.db"
+        self._SEARCH_SYNONYMS = []
 
         self._DEFAULT_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36"
 
@@ -43,7 +84,8 @@ class AppConfig:
                 "LIST_URL": "https://riyasewana.com/search/motorcycles",
                 "FETCH_LIMIT": self._DEFAULT_FETCH_LIMIT,
                 "FETCH_TYPE": self._DEFAULT_FETCH_TYPE,
-                "MAX_FAILS": self._MAX_FAILS
+                "MAX_FAILS": self._MAX_FAILS,
+                "STREAM_DETAILS": False
             },
         }
 
@@ -56,6 +98,20 @@ class AppConfig:
                         self._PROXIES["http"] = config["PROXIES"]["HTTP"]
                     if "HTTPS" in config["PROXIES"]:
                         self._PROXIES["https"] = config["PROXIES"]["HTTPS"]
+                if "PROXY_POOL" in config:
+                    pool = config["PROXY_POOL"]
+                    if "PROXIES" in pool and type(pool["PROXIES"]) is list:
+                        self._PROXY_POOL = pool["PROXIES"]
+                    if "STRATEGY" in pool:
+                        if pool["STRATEGY"] in ("round_robin", "least_load"):
+                            self._PROXY_STRATEGY = pool["STRATEGY"]
+                        else:
+                            logger.warning(f"Proxy strategy should be 'round_robin' or 'least_load' provided "
+                                           f"{pool['STRATEGY']}, will use {self._PROXY_STRATEGY}")
+                    if "MAX_ERRORS" in pool:
+                        self._PROXY_MAX_ERRORS = int(pool["MAX_ERRORS"])
+                    if "EVICT_SECONDS" in pool:
+                        self._PROXY_EVICT_SECONDS = int(pool["EVICT_SECONDS"])
                 if "USER_AGENT" in config and config["USER_AGENT"] != "":
                     self._USER_AGENT = config["USER_AGENT"]
                 self._DB_USER = config["USERNAME"]
@@ -68,6 +124,110 @@ class AppConfig:
                     self._MAX_FAILS = int(config['MAX_FAILS'])
                 if "SOURCES" in config and type(config["SOURCES"]) is list:
                     self._CONFIG_SOURCES = config["SOURCES"]
+                if "DEDUPE" in config:
+                    self._DEDUPE = bool(config["DEDUPE"])
+                if "HISTORY" in config:
+                    self._HISTORY = bool(config["HISTORY"])
+                if "ALERTS" in config:
+                    self._ALERTS = bool(config["ALERTS"])
+                if "RETRY" in config:
+                    retry = config["RETRY"]
+                    if "ENABLED" in retry:
+                        self._RETRY = bool(retry["ENABLED"])
+                    if "MAX_ATTEMPTS" in retry:
+                        self._RETRY_MAX_ATTEMPTS = int(retry["MAX_ATTEMPTS"])
+                    if "BUDGET" in retry:
+                        self._RETRY_BUDGET = int(retry["BUDGET"])
+                    if "BASE_DELAY" in retry:
+                        self._RETRY_BASE_DELAY = int(retry["BASE_DELAY"])
+                    if "MAX_DELAY" in retry:
+                        self._RETRY_MAX_DELAY = int(retry["MAX_DELAY"])
+                if "SCHEDULER" in config:
+                    scheduler = config["SCHEDULER"]
+                    if "HISTORY_FILE" in scheduler:
+                        self._POLL_HISTORY_FILE = scheduler["HISTORY_FILE"]
+                    if "FEED_YIELD_FILE" in scheduler:
+                        self._FEED_YIELD_FILE = scheduler["FEED_YIELD_FILE"]
+                    if "MIN_INTERVAL" in scheduler:
+                        self._POLL_MIN_INTERVAL = int(scheduler["MIN_INTERVAL"])
+                    if "MAX_INTERVAL" in scheduler:
+                        self._POLL_MAX_INTERVAL = int(scheduler["MAX_INTERVAL"])
+                    if "DEFAULT_INTERVAL" in scheduler:
+                        self._POLL_DEFAULT_INTERVAL = int(scheduler["DEFAULT_INTERVAL"])
+                if "PLANNER" in config:
+                    planner = config["PLANNER"]
+                    if "HISTORY_FILE" in planner:
+                        self._PLAN_HISTORY_FILE = planner["HISTORY_FILE"]
+                if "FRESHNESS" in config:
+                    freshness = config["FRESHNESS"]
+                    if "LATE_SECONDS" in freshness:
+                        self._FRESHNESS_LATE_SECONDS = int(freshness["LATE_SECONDS"])
+                if "STATS" in config:
+                    stats = config["STATS"]
+                    if "CACHE_DIRECTORY" in stats:
+                        self._STATS_CACHE_DIRECTORY = stats["CACHE_DIRECTORY"]
+                    if "MILEAGE_BAND_KM" in stats:
+                        self._STATS_MILEAGE_BAND_KM = int(stats["MILEAGE_BAND_KM"])
+                    if "CHUNK_SIZE" in stats:
+                        self._STATS_CHUNK_SIZE = int(stats["CHUNK_SIZE"])
+                if "SELLERS" in config:
+                    sellers = config["SELLERS"]
+                    if "ENABLED" in sellers:
+                        self._SELLERS = bool(sellers["ENABLED"])
+                    if "DEALER_ADS" in sellers:
+                        self._SELLERS_DEALER_ADS = int(sellers["DEALER_ADS"])
+                if "SEARCH" in config:
+                    search = config["SEARCH"]
+                    if "ENABLED" in search:
+                        self._SEARCH = bool(search["ENABLED"])
+                    if "PATH" in search:
+                        self._SEARCH_PATH = search["PATH"]
+                    if "SYNONYMS" in search:
+                        if type(search["SYNONYMS"]) is list and all(type(group) is list for group in search["SYNONYMS"]):
+                            self._SEARCH_SYNONYMS = search["SYNONYMS"]
+                        else:
+                            logger.warning(f"Search synonyms should be a list of lists of words, provided "
+                                           f"{search['SYNONYMS']}, will use the built-in synonyms only")
+                if "ARCHIVE" in config:
+                    archive = config["ARCHIVE"]
+                    if "ENABLED" in archive:
+                        self._ARCHIVE = bool(archive["ENABLED"])
+                    if "DIRECTORY" in archive:
+                        self._ARCHIVE_DIRECTORY = archive["DIRECTORY"]
+                    if "LEVEL" in archive:
+                        self._ARCHIVE_LEVEL = int(archive["LEVEL"])
+                if "EVENTS" in config:
+                    events = config["EVENTS"]
+                    if "ENABLED" in events:
+                        self._EVENTS = bool(events["ENABLED"])
+                    if "SINK" in events:
+                        if events["SINK"] in ("jsonl", "unix", "kafka"):
+                            self._EVENTS_SINK = events["SINK"]
+                        else:
+                            logger.warning(f"Event sink should be 'jsonl', 'unix' or 'kafka' provided "
+                                           f"{events['SINK']}, will use {self._EVENTS_SINK}")
+                    if "PATH" in events:
+                        self._EVENTS_PATH = events["PATH"]
+                    if "SOCKET" in events:
+                        self._EVENTS_SOCKET = events["SOCKET"]
+                    if "KAFKA_SERVERS" in events:
+                        self._EVENTS_KAFKA_SERVERS = events["KAFKA_SERVERS"]
+                    if "TOPIC" in events:
+                        self._EVENTS_TOPIC = events["TOPIC"]
+                    if "COMPRESSION" in events:
+                        if events["COMPRESSION"] in ("none", "gzip"):
+                            self._EVENTS_COMPRESSION = events["COMPRESSION"]
+                        else:
+                            logger.warning(f"Event compression should be 'none' or 'gzip' provided "
+                                           f"{events['COMPRESSION']}, will use {self._EVENTS_COMPRESSION}")
+                    if "BATCH_SIZE" in events:
+                        self._EVENTS_BATCH_SIZE = int(events["BATCH_SIZE"])
+                    if "LINGER_MS" in events:
+                        self._EVENTS_LINGER_MS = int(events["LINGER_MS"])
+                    if "BUFFER_SIZE" in events:
+                        self._EVENTS_BUFFER_SIZE = int(events["BUFFER_SIZE"])
+                    if "BLOCK_SECONDS" in events:
+                        self._EVENTS_BLOCK_SECONDS = float(events["BLOCK_SECONDS"])
         except Exception as ex:
             logger.exception(ex)
             exit(1)
@@ -114,6 +274,15 @@ class AppConfig:
                             f"Fetch should be 'new' or 'all' provided {source['fetch_type']}, will use default type")
                 else:
                     logger.warning(f"Fetch type not found for source: {source['name']}, using default type")
+                if "stream_details" in source:
+                    if "STREAM_DETAILS" in self._default_sources[name]:
+                        self._default_sources[name]["STREAM_DETAILS"] = bool(source["stream_details"])
+                    else:
+                        logger.warning(f"Streaming details is not supported by source: {name}")
+                if "feeds" in source:
+                    feeds = self._parse_feeds(name, source["feeds"])
+                    if len(feeds) > 0:
+                        self._default_sources[name]["FEEDS"] = feeds
                 sources.append(self._default_sources[name])
             elif "name" in source:
                 logger.warning(f" Unknown source '{source['name']}'")
@@ -129,9 +298,95 @@ class AppConfig:
             logger.critical(f"No sources found")
         return sources
 
+    @staticmethod
+    def _parse_feeds(source_name: str, config_feeds: list) -> list:
+        """categories and searches of a source. A feed without list_url is skipped, weight defaults to 1"""
+        feeds = []
+        for count, feed in enumerate(config_feeds):
+            if "list_url" not in feed:
+                logger.warning(f"List url not found for feed {count} of source: {source_name}, skipping feed")
+                continue
+            weight = 1
+            if "weight" in feed:
+                try:
+                    weight = float(feed["weight"])
+                except (TypeError, ValueError):
+                    weight = 0
+                if weight <= 0:
+                    logger.warning(f"Feed weight should be a positive number, provided '{feed['weight']}', "
+                                   f"will use weight 1")
+                    weight = 1
+            feeds.append({"NAME": feed.get("name", f"{source_name}-{count}"), "LIST_URL": feed["list_url"],
+                          "WEIGHT": weight})
+        return feeds
+
+    def is_dedupe_enabled(self) -> bool:
+        return self._DEDUPE
+
+    def is_history_enabled(self) -> bool:
+        return self._HISTORY
+
+    def is_alerts_enabled(self) -> bool:
+        return self._ALERTS
+
+    def get_retry_config(self) -> dict:
+        return {"enabled": self._RETRY, "max_attempts": self._RETRY_MAX_ATTEMPTS, "budget": self._RETRY_BUDGET,
+                "base_delay": self._RETRY_BASE_DELAY, "max_delay": self._RETRY_MAX_DELAY}
+
+    def get_archive_config(self) -> dict:
+        return {"enabled": self._ARCHIVE, "directory": self._ARCHIVE_DIRECTORY, "level": self._ARCHIVE_LEVEL}
+
+    def get_events_config(self) -> dict:
+        return {"enabled": self._EVENTS, "sink": self._EVENTS_SINK, "path": self._EVENTS_PATH,
+                "socket": self._EVENTS_SOCKET, "kafka_servers": self._EVENTS_KAFKA_SERVERS, "topic": self._EVENTS_TOPIC,
+                "compression": self._EVENTS_COMPRESSION, "batch_size": self._EVENTS_BATCH_SIZE,
+                "linger_ms": self._EVENTS_LINGER_MS, "buffer_size": self._EVENTS_BUFFER_SIZE,
+                "block_seconds": self._EVENTS_BLOCK_SECONDS}
+
+    def get_scheduler_config(self) -> dict:
+        return {"history_file": self._POLL_HISTORY_FILE, "feed_yield_file": self._FEED_YIELD_FILE,
+                "min_interval": self._POLL_MIN_INTERVAL, "max_interval": self._POLL_MAX_INTERVAL,
+                "default_interval": self._POLL_DEFAULT_INTERVAL}
+
+    def get_planner_config(self) -> dict:
+        return {"history_file": self._PLAN_HISTORY_FILE}
+
+    def get_freshness_config(self) -> dict:
+        return {"late_seconds": self._FRESHNESS_LATE_SECONDS}
+
+    def get_stats_config(self) -> dict:
+        return {"cache_directory": self._STATS_CACHE_DIRECTORY, "mileage_band_km": self._STATS_MILEAGE_BAND_KM,
+                "chunk_size": self._STATS_CHUNK_SIZE}
+
+    def get_sellers_config(self) -> dict:
+        return {"enabled": self._SELLERS, "dealer_ads": self._SELLERS_DEALER_ADS}
+
+    def get_search_config(self) -> dict:
+        return {"enabled": self._SEARCH, "path": self._SEARCH_PATH, "synonyms": self._SEARCH_SYNONYMS}
+
     def get_wait_seconds(self) -> int:
         return self._WAIT_SECONDS
 
+    def get_proxy_pool_config(self) -> dict:
+        """proxies of the pool. Each proxy is a dict with name, proxies (requests style) and wait_seconds.
+
+        Uses PROXY_POOL when set, else the single PROXIES entry, else a direct connection
+        """
+        proxies = []
+        for entry in self._PROXY_POOL:
+            if "URL" not in entry or entry["URL"] == "":
+                logger.warning(f"Proxy without URL in PROXY_POOL, skipping {entry}")
+                continue
+            proxies.append({"name": entry.get("NAME", entry["URL"]),
+                            "proxies": {"http": entry["URL"], "https": entry["URL"]},
+                            "wait_seconds": float(entry.get("WAIT_SECONDS", self._WAIT_SECONDS))})
+        if len(proxies) == 0:
+            legacy = {scheme: url for scheme, url in self._PROXIES.items() if url != ""}
+            proxies.append({"name": "proxy" if len(legacy) > 0 else "direct", "proxies": legacy,
+                            "wait_seconds": self._WAIT_SECONDS})
+        return {"proxies": proxies, "strategy": self._PROXY_STRATEGY, "max_errors": self._PROXY_MAX_ERRORS,
+                "evict_seconds": self._PROXY_EVICT_SECONDS}
+
     def get_user_agent(self) -> str:
         return self._USER_AGENT
 
@@ -0,0 +1,168 @@
+import math
+import random
+import re
+import struct
+from hashlib import blake2b
+
+import logger
+from storage_hook import StorageHook
+
+logger = logger.get_logger("dedupe")
+
+
+class DedupeIndex(StorageHook):
+    """Assigns a cluster id to every saved ad so that the same bike posted on several sources, or re-posted under a
+    new id, ends up in the same cluster.
+
+    A MinHash signature is computed over shingles of the normalised title and description, the phone numbers, and the
+    make, model, year, price, mileage and location of an ad. The structured fields weigh least since many different
+    bikes share them, so only ads with mostly the same text or seller reach the threshold. The signature is split into
+    bands and each band hash is stored in the indexed ad_lsh_band table. Ads sharing at least MIN_SHARED_BANDS bands are
+    candidates, at most MAX_CANDIDATES of them, and the closest candidate with enough estimated similarity gives its
+    cluster to the new ad. A lookup is one indexed query per ad that reads at most MAX_BAND_ROWS ads of each band,
+    however many ads are stored. A band shared by more ads is a common one, e.g. of a popular model, and a copy of the
+    ad still shares its other bands
+    """
+    NUM_PERM = 64
+    BANDS = 16
+    ROWS = NUM_PERM // BANDS
+    _PRIME = (1 << 61) - 1
+
+    # a pair at the threshold shares about BANDS * THRESHOLD ** ROWS = 6.5 bands, fewer than 2 in 1 of 400 pairs
+    MIN_SHARED_BANDS = 2
+    MAX_CANDIDATES = 20
+    MAX_BAND_ROWS = 100
+    DESCRIPTION_WORDS = 60
+
+    # {} is one FIND_BAND_QUERY per band joined by UNION ALL
+    FIND_CANDIDATES_QUERY: str = "SELECT c.source, c.ad_id, c.cluster_id, c.signature FROM (SELECT b.source, b.ad_id " \
+                                 "FROM ({}) b GROUP BY b.source, b.ad_id HAVING COUNT(*) >= %s ORDER BY COUNT(*) DESC " \
+                                 "LIMIT %s) m JOIN ad_cluster c ON c.source = m.source AND c.ad_id = m.ad_id"
+    FIND_BAND_QUERY: str = "(SELECT source, ad_id FROM ad_lsh_band WHERE band_no = %s AND band_hash = %s LIMIT %s)"
+    SAVE_CLUSTER_QUERY: str = "INSERT INTO ad_cluster(source, ad_id, cluster_id, signature) VALUES (%s, %s, %s, %s) " \
+                              "ON DUPLICATE KEY UPDATE cluster_id = VALUES(cluster_id), signature = VALUES(signature)"
+    SAVE_BAND_QUERY: str = "INSERT IGNORE INTO ad_lsh_band(band_no, band_hash, source, ad_id) VALUES (%s, %s, %s, %s)"
+
+    def __init__(self, threshold: float = 0.8):
+        self._THRESHOLD = threshold
+        self._TOKEN_PATTERN = re.compile("[a-z0-9]+")
+        self._DIGIT_PATTERN = re.compile("\\d+")
+        self._CENTS_PATTERN = re.compile("\\.\\d{1,2}$")
+        self._STOP_WORDS = {"for", "sale", "brand", "new", "used", "bike", "motorcycle", "motorbike", "rs"}
+        self._PHONE_WEIGHT = 4
+        _random = random.Random(402)
+        self._permutations = [(_random.randrange(1, DedupeIndex._PRIME), _random.randrange(0, DedupeIndex._PRIME))
+                              for _ in range(DedupeIndex.NUM_PERM)]
+        self._clustered = 0
+        self._matched = 0
+
+    def on_save(self, cursor, records: list):
+        for record in records:
+            signature = self.get_signature(record)
+            bands = self.get_bands(signature)
+            cluster_id = self._find_cluster(cursor, record, signature, bands)
+            if cluster_id is None:
+                cluster_id = self._new_cluster_id(record)
+            else:
+                self._matched += 1
+            self._clustered += 1
+            cursor.execute(DedupeIndex.SAVE_CLUSTER_QUERY,
+                           (record["source"], record["ad_id"], cluster_id, self._pack(signature)))
+            cursor.executemany(DedupeIndex.SAVE_BAND_QUERY,
+                               [(band_no, band_hash, record["source"], record["ad_id"])
+                                for band_no, band_hash in enumerate(bands)])
+        logger.info(f"Clustered {self._clustered} ads, {self._matched} matched an existing cluster")
+
+    def get_signature(self, record: dict) -> list:
+        hashes = [self._hash(feature) for feature in self._get_features(record)]
+        if len(hashes) == 0:
+            # nothing to compare. unique signature so the ad forms its own cluster
+            hashes = [self._hash(f"{record['source']}:{record['ad_id']}")]
+        signature = []
+        for a, b in self._permutations:
+            signature.append(min((a * h + b) % DedupeIndex._PRIME for h in hashes))
+        return signature
+
+    def _get_features(self, record: dict) -> set:
+        features = set()
+        # character shingles of the title without spaces and filler words, so 'CD 125' and 'CD125' look the same
+        title = "".join(token for token in self._tokens(record.get("title")) if token not in self._STOP_WORDS)
+        features.update("t:" + title[i:i + 4] for i in range(max(0, len(title) - 3)))
+        # word pairs of the start of the description, which re-posts and copies on another source keep
+        words = self._tokens(record.get("description"))[:DedupeIndex.DESCRIPTION_WORDS]
+        features.update(f"d:{words[i]} {words[i + 1]}" for i in range(len(words) - 1))
+        for key in ("make", "model", "location"):
+            tokens = self._tokens(record.get(key))
+            if len(tokens) > 0:
+                features.add(f"{key}:{''.join(tokens)}")
+        year = self._to_int(record.get("yom"))
+        if year is not None:
+            features.add(f"year:{year}")
+        # 5% and 10% wide buckets so small price and mileage changes on a re-post still match
+        for key, base in (("price", 1.05), ("mileage", 1.1)):
+            value = self._to_int(record.get(key))
+            if value is not None and value > 0:
+                features.add(f"{key}:{int(math.log(value) / math.log(base))}")
+        # a phone number is the best evidence of the same seller. weigh it up
+        for number in record.get("phones") or []:
+            digits = "".join(self._DIGIT_PATTERN.findall(str(number)))
+            if len(digits) >= 9:
+                features.update(f"phone:{digits[-9:]}#{copy}" for copy in range(self._PHONE_WEIGHT))
+        return features
+
+    def _find_cluster(self, cursor, record: dict, signature: list, bands: list):
+        band_queries = " UNION ALL ".join([DedupeIndex.FIND_BAND_QUERY] * len(bands))
+        params = []
+        for band_no, band_hash in enumerate(bands):
+            params.extend((band_no, band_hash, DedupeIndex.MAX_BAND_ROWS))
+        params.extend((DedupeIndex.MIN_SHARED_BANDS, DedupeIndex.MAX_CANDIDATES))
+        cursor.execute(DedupeIndex.FIND_CANDIDATES_QUERY.format(band_queries), params)
+        best_cluster = None
+        best_similarity = self._THRESHOLD
+        for source, ad_id, cluster_id, packed in cursor.fetchall():
+            if source == record["source"] and ad_id == record["ad_id"]:
+                continue
+            similarity = self.get_similarity(signature, self._unpack(packed))
+            if similarity >= best_similarity:
+                best_similarity = similarity
+                best_cluster = cluster_id
+        if best_cluster is not None:
+            logger.info(f"{record['source']} ad {record['ad_id']} joins cluster {best_cluster} "
+                        f"(similarity {best_similarity:0.2f})")
+        return best_cluster
+
+    def get_bands(self, signature: list) -> list:
+        bands = []
+        for band_no in range(DedupeIndex.BANDS):
+            rows = signature[band_no * DedupeIndex.ROWS:(band_no + 1) * DedupeIndex.ROWS]
+            bands.append(int.from_bytes(blake2b(self._pack(rows), digest_size=8).digest(), "big") >> 1)
+        return bands
+
+    def _new_cluster_id(self, record: dict) -> int:
+        return self._hash(f"{record['source']}:{record['ad_id']}") >> 1
+
+    def get_similarity(self, signature: list, other: list) -> float:
+        """estimated jaccard similarity of the features of two ads"""
+        return sum(1 for a, b in zip(signature, other) if a == b) / DedupeIndex.NUM_PERM
+
+    def _tokens(self, text) -> list:
+        if text is None:
+            return []
+        return self._TOKEN_PATTERN.findall(str(text).lower())
+
+    def _to_int(self, value):
+        if value is None:
+            return None
+        # drop decimal cents before joining the digit groups
+        text = self._CENTS_PATTERN.sub("", str(value).strip())
+        digits = "".join(self._DIGIT_PATTERN.findall(text))
+        return int(digits) if digits != "" else None
+
+    def _hash(self, text: str) -> int:
+        return int.from_bytes(blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+    def _pack(self, values: list) -> bytes:
+        return struct.pack(f">{len(values)}Q", *values)
+
+    def _unpack(self, packed: bytes) -> list:
+        return list(struct.unpack(f">{len(packed) // 8}Q", packed))
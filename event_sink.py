@@ -0,0 +1,220 @@
+import gzip
+import json
+import queue
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+
+import logger
+from storage_hook import StorageHook
+
+logger = logger.get_logger("event.sink")
+
+CODEC_NONE = 0
+CODEC_GZIP = 1
+# frame header of the unix socket sink: payload length and codec
+FRAME_HEADER = struct.Struct(">IB")
+
+
+def encode_batch(events: list, compression: str) -> bytes:
+    """events as json lines, gzip compressed when compression is 'gzip'"""
+    payload = "".join(json.dumps(event, default=str, ensure_ascii=False) + "\n" for event in events).encode("utf-8")
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=6)
+    return payload
+
+
+def read_frames(file):
+    """events sent by UnixSocketSink, read from a binary file object such as socket.makefile("rb")"""
+    while True:
+        header = file.read(FRAME_HEADER.size)
+        if len(header) < FRAME_HEADER.size:
+            return
+        length, codec = FRAME_HEADER.unpack(header)
+        payload = file.read(length)
+        if codec == CODEC_GZIP:
+            payload = gzip.decompress(payload)
+        for line in payload.splitlines():
+            yield json.loads(line)
+
+
+class EventSink:
+    """Destination of the ad events. send raises on failure, the publisher retries the same batch"""
+
+    def send(self, events: list):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlSink(EventSink):
+    """Appends events to a json lines file. With gzip compression every batch is a gzip member, the file can be read
+    with zcat or gzip.open"""
+
+    def __init__(self, path: str, compression: str = "none"):
+        self._path = path
+        self._compression = compression
+        self._file = open(path, "ab")
+
+    def send(self, events: list):
+        self._file.write(encode_batch(events, self._compression))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class UnixSocketSink(EventSink):
+    """Streams batches to a local consumer listening on a unix socket. Each batch is a frame of FRAME_HEADER followed by
+    the encoded batch. The connection is opened again on the next batch after an error"""
+
+    def __init__(self, path: str, compression: str = "none"):
+        self._path = path
+        self._codec = CODEC_GZIP if compression == "gzip" else CODEC_NONE
+        self._compression = compression
+        self._socket = None
+
+    def send(self, events: list):
+        payload = encode_batch(events, self._compression)
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self._path)
+            self._socket.sendall(FRAME_HEADER.pack(len(payload), self._codec) + payload)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+class KafkaSink(EventSink):
+    """Sends every event as a message keyed by source:ad_id. The producer is a kafka-python KafkaProducer or any object
+    with the same send(topic, value=, key=) and flush() methods, e.g. a local stand-in. Batching and compression are
+    done by the producer (linger_ms, compression_type)"""
+
+    def __init__(self, producer, topic: str):
+        self._producer = producer
+        self._topic = topic
+
+    def send(self, events: list):
+        for event in events:
+            self._producer.send(self._topic, value=json.dumps(event, default=str, ensure_ascii=False).encode("utf-8"),
+                                key=f"{event['source']}:{event['ad_id']}".encode("utf-8"))
+        # wait for the acks so that a slow broker holds the publisher back
+        self._producer.flush()
+
+    def close(self):
+        self._producer.flush()
+
+
+def make_kafka_producer(servers: str, compression: str, linger_ms: int):
+    try:
+        from kafka import KafkaProducer
+    except ImportError:
+        raise ImportError("The kafka event sink needs the kafka-python package. pip install kafka-python")
+    return KafkaProducer(bootstrap_servers=servers.split(","), linger_ms=linger_ms,
+                         compression_type=None if compression == "none" else compression)
+
+
+class EventPublisher(StorageHook):
+    """Publishes an event for every committed ad to a sink, from a background thread.
+
+    Events are kept in a bounded buffer and sent in batches of at most batch_size events, or whatever arrived within
+    linger_seconds. A failed batch is retried with a growing delay while new events wait in the buffer. When the buffer
+    is full the save waits at most block_seconds for space, events that still do not fit are dropped and counted, so a
+    slow consumer delays the crawl by a bounded time and never grows memory.
+    """
+    _MAX_RETRY_SECONDS = 30.0
+
+    def __init__(self, sink: EventSink, buffer_size: int = 10000, batch_size: int = 100, linger_seconds: float = 0.5,
+                 block_seconds: float = 5.0):
+        self._sink = sink
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._BATCH_SIZE = batch_size
+        self._LINGER_SECONDS = linger_seconds
+        self._BLOCK_SECONDS = block_seconds
+        self._closing = threading.Event()
+
+        self.published = 0
+        self.sent = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failures = 0
+
+        self._worker = threading.Thread(target=self._run, name="event-publisher", daemon=True)
+        self._worker.start()
+
+    def on_commit(self, records: list):
+        committed_at = datetime.now().isoformat()
+        deadline = time.monotonic() + self._BLOCK_SECONDS
+        dropped = 0
+        for record in records:
+            event = {"type": "ad.created", "committed_at": committed_at}
+            event.update(record)
+            try:
+                self._buffer.put(event, timeout=max(0.0, deadline - time.monotonic()))
+                self.published += 1
+            except queue.Full:
+                dropped += 1
+        if dropped > 0:
+            self.dropped += dropped
+            logger.warning(f"Event buffer full, dropped {dropped} events. Is the consumer of the sink running?")
+
+    def close(self, timeout: float = 10.0):
+        """sends the buffered events, waiting at most timeout seconds"""
+        self._closing.set()
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            logger.warning(f"{self._buffer.qsize()} events not sent within {timeout} seconds")
+        self._sink.close()
+        logger.info(f"Events published: {self.published}, sent: {self.sent} in {self.batches} batches, "
+                    f"dropped: {self.dropped}, failed sends: {self.failures}")
+
+    def _run(self):
+        while not (self._closing.is_set() and self._buffer.empty()):
+            batch = self._next_batch()
+            if len(batch) > 0:
+                self._send(batch)
+
+    def _next_batch(self) -> list:
+        batch = []
+        deadline = None
+        while len(batch) < self._BATCH_SIZE:
+            timeout = 0.5 if deadline is None else deadline - time.monotonic()
+            if timeout <= 0 or (self._closing.is_set() and self._buffer.empty()):
+                break
+            try:
+                batch.append(self._buffer.get(timeout=timeout))
+            except queue.Empty:
+                if deadline is None:
+                    # nothing buffered yet, check closing
+                    break
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + self._LINGER_SECONDS
+        return batch
+
+    def _send(self, batch: list):
+        delay = 0.5
+        while True:
+            try:
+                self._sink.send(batch)
+                self.sent += len(batch)
+                self.batches += 1
+                return
+            except Exception as ex:
+                self.failures += 1
+                if self._closing.is_set():
+                    self.dropped += len(batch)
+                    logger.warning(f"Dropped {len(batch)} events while closing. {ex}")
+                    return
+                logger.warning(f"Sending {len(batch)} events failed, retrying in {delay:0.1f} seconds. {ex}")
+                self._closing.wait(delay)
+                delay = min(delay * 2, EventPublisher._MAX_RETRY_SECONDS)
@@ -0,0 +1,148 @@
+import json
+import os
+
+import logger
+
+logger = logger.get_logger("feed.scheduler")
+
+
+class Feed:
+    """a list of ads of a source, e.g. a category or a search, and its paging state in the current run"""
+
+    def __init__(self, name: str, list_url: str, weight: float):
+        self.name = name
+        self.list_url = list_url
+        self.weight = weight
+        # new ads per request, learnt over runs and kept in the yield file of the FeedScheduler
+        self.yield_rate = None
+        self.page_count = 1
+        self.total_pages = 1
+        # ads listed in the feed according to its first page
+        self.total_ads = 0
+        self.up_to_date = False
+        self.requests = 0
+        self.new_ads = 0
+
+    def reset(self):
+        self.page_count = 1
+        self.total_pages = 1
+        self.total_ads = 0
+        self.up_to_date = False
+        self.requests = 0
+        self.new_ads = 0
+
+    def is_active(self) -> bool:
+        return not self.up_to_date and self.page_count <= self.total_pages
+
+
+class FeedScheduler:
+    """Shares the requests of a source between its feeds.
+
+    Every feed gets a share of weight * (yield floor + new ads per request), so feeds that keep finding new ads get
+    more of the fetch limit while quiet feeds are still visited. The next feed is the active one that used the fewest
+    requests for its share (stride scheduling). The yield of a feed is an exponentially weighted average over runs,
+    written to a json file by source and feed name so it survives restarts
+    """
+    YIELD_FLOOR = 0.1
+    YIELD_ALPHA = 0.3
+
+    def __init__(self, feeds: list, source: str = None, yield_file: str = None):
+        """
+        :param feeds:
+        :param source: source name of the feeds, their key in the yield file
+        :param yield_file: json file of the learnt yields, None to keep them in memory only
+        """
+        self._feeds = feeds
+        self._SOURCE = source
+        self._YIELD_FILE = yield_file
+        self._load()
+
+    def __len__(self):
+        return len(self._feeds)
+
+    def start(self):
+        """resets the paging state of every feed for a new run"""
+        for feed in self._feeds:
+            feed.reset()
+
+    def is_up_to_date(self) -> bool:
+        return all(feed.up_to_date for feed in self._feeds)
+
+    def has_active(self) -> bool:
+        return any(feed.is_active() for feed in self._feeds)
+
+    def next_feed(self) -> Feed:
+        active = [feed for feed in self._feeds if feed.is_active()]
+        return min(active, key=lambda feed: feed.requests / self._get_share(feed))
+
+    def record_page(self, feed: Feed, requests: int, new_ads: int):
+        """a list page of the feed and its detail pages were fetched
+
+        :param feed:
+        :param requests: the list request and the detail requests
+        :param new_ads: ads of the page that were not stored yet
+        """
+        feed.requests += requests
+        feed.new_ads += new_ads
+
+    def get_run_stats(self) -> dict:
+        """totals of the feeds in the current run: requests, list pages, new ads, and the total pages and ads the
+        feeds listed on their first page"""
+        return {"requests": sum(feed.requests for feed in self._feeds),
+                "pages": sum(feed.page_count - 1 for feed in self._feeds),
+                "new_ads": sum(feed.new_ads for feed in self._feeds),
+                "total_pages": sum(feed.total_pages for feed in self._feeds if feed.page_count > 1),
+                "total_ads": sum(feed.total_ads for feed in self._feeds)}
+
+    def finish_run(self):
+        for feed in self._feeds:
+            if feed.requests == 0:
+                continue
+            feed.yield_rate = self._get_yield(feed)
+            logger.info(f"Feed {feed.name}: {feed.requests} requests, {feed.new_ads} new ads, "
+                        f"yield {feed.yield_rate:0.2f} new ads per request")
+        self._save()
+
+    def _get_share(self, feed: Feed) -> float:
+        rate = self._get_yield(feed)
+        return feed.weight * (FeedScheduler.YIELD_FLOOR + (rate if rate is not None else 1.0))
+
+    @staticmethod
+    def _get_yield(feed: Feed):
+        """yield learnt in earlier runs updated with the current run, None when the feed was never fetched"""
+        if feed.requests == 0:
+            return feed.yield_rate
+        rate = feed.new_ads / feed.requests
+        if feed.yield_rate is None:
+            return rate
+        return feed.yield_rate + FeedScheduler.YIELD_ALPHA * (rate - feed.yield_rate)
+
+    def _read_yields(self) -> dict:
+        """the yield file, source name -> feed name -> yield"""
+        if self._YIELD_FILE is None or not os.path.exists(self._YIELD_FILE):
+            return {}
+        try:
+            with open(self._YIELD_FILE) as file:
+                return json.load(file)
+        except (ValueError, OSError) as ex:
+            logger.warning(f"Could not read feed yields, starting fresh. {ex}")
+            return {}
+
+    def _load(self):
+        yields = self._read_yields().get(self._SOURCE, {})
+        for feed in self._feeds:
+            if feed.name in yields:
+                feed.yield_rate = yields[feed.name]
+        if len(yields) > 0:
+            logger.info(f"Loaded feed yields of {self._SOURCE} for {list(yields.keys())}")
+
+    def _save(self):
+        if self._YIELD_FILE is None:
+            return
+        # the other sources share the file
+        yields = self._read_yields()
+        yields[self._SOURCE] = {feed.name: feed.yield_rate for feed in self._feeds if feed.yield_rate is not None}
+        tmp_file = self._YIELD_FILE + ".tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(yields, file, indent=2)
+        os.replace(tmp_file, self._YIELD_FILE)
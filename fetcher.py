@@ -1,24 +1,85 @@
+from __future__ import annotations
+
+from time import perf_counter
+from typing import TYPE_CHECKING
+
 import requests
-import time
+from requests.exceptions import ConnectionError, Timeout
+
 import logger
 
+if TYPE_CHECKING:
+    from proxy_pool import ProxyPool
+
 logger = logger.get_logger("Fetcher")
 
 
 class Fetcher:
-    def __init__(self, headers: dict, wait_seconds: int):
+    def __init__(self, headers: dict, proxy_pool: ProxyPool):
         self._headers = headers
-        self._wait_seconds = wait_seconds
+        self._proxy_pool = proxy_pool
         self._request_count = 0
+        self._streamed_bytes = 0
+        self._saved_bytes = 0
 
     def get(self, _url: str) -> requests.Response:
         logger.info(f"Sending request to url: {_url}")
-        response = requests.get(_url, headers=self._headers)
-        self._request_count += 1
-        logger.info(f"Server responded with {response.status_code}")
-        logger.info(f"Waiting for {self._wait_seconds} seconds")
-        time.sleep(self._wait_seconds)
-        return response
-
-    def get_request_count(self)-> int:
+        return self._send(_url, False)
+
+    def stream(self, _url: str, _consumer):
+        """requests the url as a stream and hands the response to the consumer
+
+        The connection is closed as soon as the consumer returns, so any part of the body the consumer did not read is
+        never downloaded. Raises HTTPError for error responses.
+
+        :param _url:
+        :param _consumer: callable that reads from the streamed response and returns the parsed result
+        :return: whatever the consumer returns
+        """
+        logger.info(f"Streaming from url: {_url}")
+        response = self._send(_url, True)
+        try:
+            response.raise_for_status()
+            result = _consumer(response)
+            self._count_stream_bytes(response)
+        finally:
+            response.close()
+        return result
+
+    def _send(self, _url: str, _stream: bool) -> requests.Response:
+        """sends the request through the proxy pool. A connection error is retried once through every other proxy"""
+        attempts = len(self._proxy_pool)
+        for attempt in range(attempts):
+            proxy = self._proxy_pool.acquire()
+            start = perf_counter()
+            try:
+                response = requests.get(_url, headers=self._headers, proxies=proxy.proxies, stream=_stream)
+            except (ConnectionError, Timeout) as ex:
+                self._proxy_pool.release(proxy, False, perf_counter() - start)
+                if attempt == attempts - 1:
+                    raise
+                logger.warning(f"Request through {proxy.name} failed, trying another proxy. {ex}")
+                continue
+            self._request_count += 1
+            success = response.status_code < 500 and response.status_code != 429
+            self._proxy_pool.release(proxy, success, perf_counter() - start)
+            logger.info(f"Server responded with {response.status_code} ({proxy.name})")
+            return response
+
+    def _count_stream_bytes(self, response: requests.Response):
+        # bytes read from the socket. compressed size when the body is compressed, same as content-length
+        received = response.raw.tell()
+        self._streamed_bytes += received
+        content_length = response.headers.get("Content-Length")
+        if content_length is None:
+            logger.info(f"Received {received} bytes. Total size unknown (no content-length)")
+            return
+        saved = max(0, int(content_length) - received)
+        self._saved_bytes += saved
+        logger.info(f"Received {received} of {content_length} bytes, saved {saved} bytes")
+
+    def get_request_count(self) -> int:
         return self._request_count
+
+    def get_stream_stats(self) -> dict:
+        return {"received": self._streamed_bytes, "saved": self._saved_bytes}
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import logger
+from storage_hook import StorageHook
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("freshness")
+
+TABLES = {"ikman": "ad", "riyasewana": "riyasewana_ad"}
+
+
+def format_lag(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:0.0f}s"
+    if seconds < 3600:
+        return f"{seconds / 60:0.1f}m"
+    if seconds < 86400:
+        return f"{seconds / 3600:0.1f}h"
+    return f"{seconds / 86400:0.1f}d"
+
+
+def parse_posted(value):
+    """posting datetime of a storage hook record as a naive local datetime, None when missing or not iso formatted"""
+    if value is None:
+        return None
+    try:
+        posted = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if posted.tzinfo is not None:
+        posted = posted.astimezone().replace(tzinfo=None)
+    return posted
+
+
+class LagHistogram:
+    """Counts lags in seconds in fixed buckets and keeps the largest lag of each bucket, so histograms of any number
+    of ads can be added up and stored as a few rows. Percentiles are interpolated within their bucket.
+    """
+    # lower bound of every bucket in seconds. The last bucket has no upper bound
+    EDGES = (0, 60, 300, 600, 900, 1800, 3600, 2 * 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 4 * 86400,
+             7 * 86400, 14 * 86400, 30 * 86400)
+
+    def __init__(self):
+        self.counts = [0] * len(LagHistogram.EDGES)
+        self.max_lags = [0] * len(LagHistogram.EDGES)
+
+    def __len__(self):
+        return sum(self.counts)
+
+    @staticmethod
+    def get_bucket(lag: int) -> int:
+        bucket = 0
+        while bucket + 1 < len(LagHistogram.EDGES) and lag >= LagHistogram.EDGES[bucket + 1]:
+            bucket += 1
+        return bucket
+
+    def add(self, lag: int):
+        """adds the lag of one ad. Lags below zero, an ad stored before its posting time, count as zero"""
+        lag = max(0, int(lag))
+        bucket = LagHistogram.get_bucket(lag)
+        self.counts[bucket] += 1
+        self.max_lags[bucket] = max(self.max_lags[bucket], lag)
+
+    def add_bucket(self, bucket: int, count: int, max_lag: int):
+        self.counts[bucket] += count
+        self.max_lags[bucket] = max(self.max_lags[bucket], max_lag)
+
+    def get_max(self) -> int:
+        return max(self.max_lags)
+
+    def percentile(self, q: float) -> float:
+        """lag in seconds that q percent of the ads do not exceed. 0 for an empty histogram"""
+        total = len(self)
+        if total == 0:
+            return 0.0
+        rank = q / 100 * total
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            if count == 0:
+                continue
+            if seen + count >= rank:
+                low = LagHistogram.EDGES[bucket]
+                high = self.max_lags[bucket]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return float(self.get_max())
+
+    def describe(self) -> str:
+        return f"p50 {format_lag(self.percentile(50))}, p95 {format_lag(self.percentile(95))}, " \
+               f"max {format_lag(self.get_max())}"
+
+
+class FreshnessMetric(StorageHook):
+    """Logs the lag between posting and saving of the ads saved by every agent run, and the number of late ads: ads
+    saved more than late_seconds after they were posted, usually because new ad cycles were missed
+    """
+
+    def __init__(self, late_seconds: int):
+        self._LATE_SECONDS = late_seconds
+        # source -> lags of the current run
+        self._histograms = {}
+        self._late = {}
+
+    def on_commit(self, records: list):
+        saved_at = datetime.now()
+        for record in records:
+            posted = parse_posted(record["datetime"])
+            if posted is None:
+                continue
+            lag = (saved_at - posted).total_seconds()
+            source = record["source"]
+            if source not in self._histograms:
+                self._histograms[source] = LagHistogram()
+                self._late[source] = 0
+            self._histograms[source].add(lag)
+            if lag > self._LATE_SECONDS:
+                self._late[source] += 1
+
+    def finish_run(self, source: str) -> tuple:
+        """logs and resets the metric of the run of the source
+
+        :return: tuple (LagHistogram of the run, number of late ads)
+        """
+        histogram = self._histograms.pop(source, LagHistogram())
+        late = self._late.pop(source, 0)
+        if len(histogram) == 0:
+            logger.info(f"{source}: no ads saved in this run")
+        else:
+            logger.info(f"{source}: {len(histogram)} ads saved {histogram.describe()} after posting, {late} later "
+                        f"than {format_lag(self._LATE_SECONDS)}")
+        return histogram, late
+
+
+class FreshnessStore:
+    """Keeps the lag histograms of the stored ads per source and hour of day of posting in the database.
+
+    update() reads only the ads stored after the watermark of the source through the _created_at index, adds their lags
+    to the freshness_lag rows and moves the watermark, in one transaction. Ads stored in the last SETTLE_SECONDS are
+    left for the next update since a save that started before them may not be committed yet.
+    """
+    SETTLE_SECONDS = 300
+    BATCH_SIZE = 10000
+
+    GET_WATERMARK_QUERY: str = "SELECT created_at FROM freshness_watermark WHERE source = %s"
+    GET_SETTLED_QUERY: str = "SELECT NOW() - INTERVAL %s SECOND"
+    GET_STORED_QUERY: str = "SELECT ad_id, datetime, _created_at FROM {} WHERE _created_at > %s AND _created_at <= %s"
+    SAVE_LAG_QUERY: str = "INSERT INTO freshness_lag(source, hour_of_day, bucket, ads, max_lag) VALUES (%s, %s, %s, " \
+                          "%s, %s) ON DUPLICATE KEY UPDATE ads = ads + VALUES(ads), " \
+                          "max_lag = GREATEST(max_lag, VALUES(max_lag))"
+    SAVE_LATE_QUERY: str = "INSERT IGNORE INTO late_ad(source, ad_id, posted_at, stored_at, lag) " \
+                           "VALUES (%s, %s, %s, %s, %s)"
+    SAVE_WATERMARK_QUERY: str = "INSERT INTO freshness_watermark(source, created_at) VALUES (%s, %s) " \
+                                "ON DUPLICATE KEY UPDATE created_at = VALUES(created_at)"
+    GET_LAG_QUERY: str = "SELECT hour_of_day, bucket, ads, max_lag FROM freshness_lag WHERE source = %s"
+    GET_LATE_COUNT_QUERY: str = "SELECT HOUR(posted_at), COUNT(*) FROM late_ad WHERE source = %s " \
+                                "GROUP BY HOUR(posted_at)"
+    GET_LATE_ADS_QUERY: str = "SELECT ad_id, posted_at, stored_at, lag FROM late_ad WHERE source = %s " \
+                              "ORDER BY stored_at DESC LIMIT %s"
+    DELETE_QUERIES: tuple = ("DELETE FROM freshness_lag WHERE source = %s",
+                             "DELETE FROM late_ad WHERE source = %s",
+                             "DELETE FROM freshness_watermark WHERE source = %s")
+
+    def __init__(self, connection: MySQLConnection, late_seconds: int):
+        self._connection = connection
+        self._LATE_SECONDS = late_seconds
+
+    def update(self, source: str) -> int:
+        """adds the ads stored since the last update of the source
+
+        :return: number of ads added
+        """
+        with self._connection.cursor() as cursor:
+            cursor.execute(FreshnessStore.GET_WATERMARK_QUERY, (source,))
+            rows = cursor.fetchall()
+            watermark = rows[0][0] if len(rows) > 0 else datetime(1970, 1, 1)
+            cursor.execute(FreshnessStore.GET_SETTLED_QUERY, (FreshnessStore.SETTLE_SECONDS,))
+            settled = cursor.fetchall()[0][0]
+            if settled <= watermark:
+                return 0
+            cursor.execute(FreshnessStore.GET_STORED_QUERY.format(TABLES[source]), (watermark, settled))
+            # hour of day -> histogram
+            histograms = {}
+            late_tuple_list = []
+            added = 0
+            while True:
+                batch = cursor.fetchmany(FreshnessStore.BATCH_SIZE)
+                if len(batch) == 0:
+                    break
+                for ad_id, posted_at, stored_at in batch:
+                    if posted_at is None:
+                        continue
+                    lag = max(0, int((stored_at - posted_at).total_seconds()))
+                    if posted_at.hour not in histograms:
+                        histograms[posted_at.hour] = LagHistogram()
+                    histograms[posted_at.hour].add(lag)
+                    if lag > self._LATE_SECONDS:
+                        late_tuple_list.append((source, ad_id, posted_at, stored_at, lag))
+                    added += 1
+
+        with self._connection.cursor() as cursor:
+            cursor.executemany(FreshnessStore.SAVE_LAG_QUERY,
+                               [(source, hour, bucket, count, histogram.max_lags[bucket])
+                                for hour, histogram in histograms.items()
+                                for bucket, count in enumerate(histogram.counts) if count > 0])
+            for i in range(0, len(late_tuple_list), FreshnessStore.BATCH_SIZE):
+                cursor.executemany(FreshnessStore.SAVE_LATE_QUERY, late_tuple_list[i:i + FreshnessStore.BATCH_SIZE])
+            cursor.execute(FreshnessStore.SAVE_WATERMARK_QUERY, (source, settled))
+            self._connection.commit()
+        logger.info(f"{source}: added {added} ads stored until {settled}, {len(late_tuple_list)} late")
+        return added
+
+    def get_histograms(self, source: str) -> dict:
+        """hour of day of posting -> LagHistogram"""
+        histograms = {}
+        with self._connection.cursor() as cursor:
+            cursor.execute(FreshnessStore.GET_LAG_QUERY, (source,))
+            for hour, bucket, count, max_lag in cursor:
+                if hour not in histograms:
+                    histograms[hour] = LagHistogram()
+                histograms[hour].add_bucket(bucket, count, max_lag)
+        return histograms
+
+    def get_late_counts(self, source: str) -> dict:
+        """hour of day of posting -> number of late ads"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(FreshnessStore.GET_LATE_COUNT_QUERY, (source,))
+            return {hour: count for hour, count in cursor}
+
+    def get_late_ads(self, source: str, limit: int) -> list:
+        """the last stored late ads as tuples (ad_id, posted_at, stored_at, lag)"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(FreshnessStore.GET_LATE_ADS_QUERY, (source, limit))
+            return cursor.fetchall()
+
+    def reset(self, source: str):
+        """forgets the histograms, late ads and watermark of the source so the next update reads all its ads again"""
+        with self._connection.cursor() as cursor:
+            for query in FreshnessStore.DELETE_QUERIES:
+                cursor.execute(query, (source,))
+            self._connection.commit()
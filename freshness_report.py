@@ -0,0 +1,70 @@
+import argparse
+
+from time import perf_counter
+from mysql.connector import connect, Error
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="add the ads stored since the last report to the ingestion lag "
+                                                      "histograms and log the lag between posting and storing per "
+                                                      "source and hour of day")
+argument_parser.add_argument("-S", "--source", choices=["ikman", "riyasewana"], action="append",
+                             help="source to report, can be repeated. Default both")
+argument_parser.add_argument("-L", "--late", metavar="integer", type=int, default=10,
+                             help="number of the last stored late ads to list, default 10")
+argument_parser.add_argument("--rebuild", action="store_true",
+                             help="forget the histograms and late ads and read all stored ads again, e.g. after "
+                                  "changing FRESHNESS.LATE_SECONDS")
+arguments = argument_parser.parse_args()
+if arguments.late < 0:
+    argument_parser.error("late cannot be negative")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from freshness import FreshnessStore, LagHistogram, format_lag
+
+logger = logger.get_logger("Freshness")
+
+
+def report(store: FreshnessStore, source: str):
+    histograms = store.get_histograms(source)
+    late_counts = store.get_late_counts(source)
+    total = LagHistogram()
+    for histogram in histograms.values():
+        for bucket, count in enumerate(histogram.counts):
+            total.add_bucket(bucket, count, histogram.max_lags[bucket])
+    if len(total) == 0:
+        logger.info(f"{source}: no stored ads")
+        return
+    logger.info(f"{source}: {len(total)} ads, {total.describe()}, {sum(late_counts.values())} late")
+    for hour in sorted(histograms):
+        logger.info(f"{source} posted {hour:02d}:00-{hour:02d}:59: {len(histograms[hour]):7d} ads, "
+                    f"{histograms[hour].describe()}, {late_counts.get(hour, 0)} late")
+    for ad_id, posted_at, stored_at, lag in store.get_late_ads(source, arguments.late):
+        logger.info(f"{source} late ad {ad_id}: posted {posted_at}, stored {stored_at}, {format_lag(lag)} later")
+
+
+config = AppConfig()
+config.parse_config_file()
+db_config = config.get_db_config()
+late_seconds = config.get_freshness_config()["late_seconds"]
+
+try:
+    connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+except Error as err:
+    logger.critical(err)
+    exit(1)
+
+freshness_store = FreshnessStore(connection, late_seconds)
+try:
+    for source_name in arguments.source or ["ikman", "riyasewana"]:
+        if arguments.rebuild:
+            freshness_store.reset(source_name)
+        freshness_store.update(source_name)
+        report(freshness_store, source_name)
+    logger.info(f"Late means stored more than {format_lag(late_seconds)} after posting. "
+                f"Finished in {perf_counter() - start:0.2f} seconds")
+except KeyboardInterrupt as exc:
+    logger.warning("User abort. Exiting...")
+    exit(0)
@@ -0,0 +1,76 @@
+import random
+import threading
+from datetime import datetime, timedelta
+
+
+class Catalogue:
+    """Synthetic motorcycle ads shared by the mock Ikman and Riyasewana sites, newest first.
+
+    New ads can be added while a crawl is running. They are put in front of the list, so every page shifts like on the
+    real sites.
+    """
+    MAKES = {
+        "Honda": ["CD 125", "CB Hornet", "Dio", "Grazia", "XR 150"],
+        "Yamaha": ["FZ", "Ray ZR", "FZ-S", "MT 15", "R15"],
+        "Bajaj": ["Pulsar 150", "Discover 125", "CT 100", "Platina", "Avenger"],
+        "TVS": ["Apache RTR", "Ntorq", "Wego", "Metro", "Jupiter"],
+        "Hero": ["Pleasure", "Splendor", "Maestro", "Hunk", "Dash"],
+    }
+    LOCATIONS = ["Colombo", "Gampaha", "Kandy", "Galle", "Kurunegala", "Matara", "Jaffna", "Negombo"]
+    NAMES = ["Kamal", "Nimal", "Sunil", "Ruwan", "Chamara", "Dilan", "Kasun", "Saman"]
+
+    def __init__(self, size: int, seed: int = 1):
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._next_id = 1000000
+        self._ads = []
+        now = datetime.now().replace(second=0, microsecond=0)
+        # oldest first while generating, reversed once at the end
+        for minutes in range(size, 0, -1):
+            self._ads.append(self._make_ad(now - timedelta(minutes=minutes * 7)))
+        self._ads.reverse()
+        self._ads_by_id = {ad["id"]: ad for ad in self._ads}
+
+    def __len__(self):
+        return len(self._ads)
+
+    def add_new(self, count: int = 1):
+        with self._lock:
+            for _ in range(count):
+                ad = self._make_ad(datetime.now().replace(second=0, microsecond=0))
+                self._ads.insert(0, ad)
+                self._ads_by_id[ad["id"]] = ad
+
+    def get_page(self, page: int, page_size: int, make: str = None) -> tuple:
+        """ads of a 1-index based page and the total number of ads, only ads of the make when make is given"""
+        with self._lock:
+            ads = self._ads if make is None else [ad for ad in self._ads if ad["make"] == make]
+            start = (page - 1) * page_size
+            return ads[start:start + page_size], len(ads)
+
+    def get_ad(self, ad_id: str):
+        return self._ads_by_id.get(ad_id)
+
+    def _make_ad(self, posted: datetime) -> dict:
+        make = self._random.choice(list(Catalogue.MAKES.keys()))
+        model = self._random.choice(Catalogue.MAKES[make])
+        yom = self._random.randint(2005, posted.year)
+        location = self._random.choice(Catalogue.LOCATIONS)
+        ad_id = str(self._next_id)
+        self._next_id += 1
+        return {
+            "id": ad_id,
+            "make": make,
+            "model": model,
+            "yom": yom,
+            "price": self._random.randint(60, 1200) * 1000,
+            "mileage": self._random.randint(1, 120) * 1000,
+            "engine_cc": self._random.choice([100, 110, 125, 150, 160, 200]),
+            "location": location,
+            "name": self._random.choice(Catalogue.NAMES),
+            "phone": f"07{self._random.randint(10000000, 89999999)}",
+            "posted": posted,
+            "title": f"{make} {model} {yom}",
+            "slug": f"{make}-{model}-{yom}-for-sale-{location}".lower().replace(" ", "-"),
+            "description": f"{make} {model} {yom} in good condition. " * self._random.randint(1, 6),
+        }
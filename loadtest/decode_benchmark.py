@@ -0,0 +1,82 @@
+import argparse
+import logging
+import tracemalloc
+from time import perf_counter
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="compare the ikman response decoders on mock site payloads")
+argument_parser.add_argument("--ads", metavar="integer", type=int, default=2000, help="ads in the synthetic catalogue")
+argument_parser.add_argument("--repeat", metavar="integer", type=int, default=5, help="passes over the payloads")
+argument_parser.add_argument("--decoder", choices=["json", "orjson", "msgspec"], action="append",
+                             help="decoder to measure, can be repeated. Default all installed decoders")
+arguments = argument_parser.parse_args()
+
+from loadtest.catalogue import Catalogue
+from loadtest.mock_site import Faults, Latency, MockSite
+from sources.ikman.ikman_decoder import make_decoder
+from sources.ikman.ikman_parser import IkmanParser
+
+# the parser logs every page and missing key
+logging.disable(logging.INFO)
+
+
+class Payload:
+    """the part of a requests Response the parser reads"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+def get_decoders() -> list:
+    if arguments.decoder is not None:
+        return [make_decoder(name) for name in arguments.decoder]
+    decoders = []
+    for name in ("json", "orjson", "msgspec"):
+        try:
+            decoders.append(make_decoder(name))
+        except ImportError as ex:
+            print(ex)
+    return decoders
+
+
+def measure(parse, payloads: list) -> tuple:
+    """mean seconds and mean peak traced bytes per payload, and the parsed results of the last pass"""
+    results = []
+    start = perf_counter()
+    for _ in range(arguments.repeat):
+        results = [parse(payload) for payload in payloads]
+    seconds = (perf_counter() - start) / (arguments.repeat * len(payloads))
+    # allocations are traced in a pass of their own, tracing slows parsing down
+    peak = 0
+    tracemalloc.start()
+    for payload in payloads:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        parse(payload)
+        peak += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return seconds, peak / len(payloads), results
+
+
+catalogue = Catalogue(arguments.ads)
+site = MockSite(("127.0.0.1", 0), catalogue, Faults(Latency("fixed:0")))
+pages = (arguments.ads + MockSite.IKMAN_PAGE_SIZE - 1) // MockSite.IKMAN_PAGE_SIZE
+list_payloads = [Payload(site.ikman_list(page)) for page in range(1, pages + 1)]
+detail_payloads = [Payload(site.ikman_detail(catalogue.get_ad(ad_id)))
+                   for payload in list_payloads for ad_id in IkmanParser().parse_list(payload)]
+site.server_close()
+print(f"{len(list_payloads)} list pages of {sum(len(p.content) for p in list_payloads) / len(list_payloads) / 1024:0.1f} "
+      f"KiB, {len(detail_payloads)} ads of {sum(len(p.content) for p in detail_payloads) / len(detail_payloads) / 1024:0.1f}"
+      f" KiB")
+
+baseline = None
+for decoder in get_decoders():
+    parser = IkmanParser(decoder)
+    list_seconds, list_peak, list_results = measure(parser.parse_list, list_payloads)
+    detail_seconds, detail_peak, detail_results = measure(parser.parse_detail, detail_payloads)
+    if baseline is None:
+        baseline = (list_results, detail_results)
+    elif (list_results, detail_results) != baseline:
+        print(f"{decoder.NAME}: parsed results differ from {get_decoders()[0].NAME}")
+    print(f"{decoder.NAME:8} list page {list_seconds * 1e6:7.0f} us, peak {list_peak / 1024:6.1f} KiB | "
+          f"ad {detail_seconds * 1e6:5.0f} us, peak {detail_peak / 1024:5.1f} KiB")
@@ -0,0 +1,44 @@
+import argparse
+import sys
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="check that the dedupe signatures join re-posted and copied ads "
+                                                      "and keep different bikes of the same model apart. Exits with "
+                                                      "status 1 when a pair is clustered wrongly")
+argument_parser.add_argument("--threshold", metavar="float", type=float, default=0.8, help="similarity threshold")
+arguments = argument_parser.parse_args()
+
+from dedupe import DedupeIndex
+
+DESCRIPTION = "Honda CD 125 2015 in excellent condition. Single owner, all papers cleared, leasing available. " \
+              "New tyres and battery, recently serviced at the agent. Call for a test ride, price slightly negotiable."
+OTHER_DESCRIPTION = "Very good condition CD125, second owner. Original paint, genuine mileage, engine never opened. " \
+                    "Jaffna registration. No leasing, cash buyers only, no time wasters please."
+
+AD = {"source": "ikman", "ad_id": "1", "title": "Honda CD 125 2015", "description": DESCRIPTION, "make": "Honda",
+      "model": "CD 125", "yom": 2015, "price": 245000, "mileage": 35000, "location": "Nugegoda",
+      "phones": ["0771234567"]}
+BARE = dict(AD, description=None)
+# (name, ad, other ad, whether they are the same bike)
+PAIRS = [("re-post with a lower price", AD, dict(AD, ad_id="2", price=239000), True),
+         ("copy on riyasewana", AD, dict(AD, source="riyasewana", ad_id="3", title="Honda CD125 2015 for sale",
+                                         location="Colombo", phones=["+94 77 123 4567"]), True),
+         ("same model, year and price from another seller", AD,
+          dict(AD, ad_id="4", description=OTHER_DESCRIPTION, mileage=61000, location="Jaffna",
+               phones=["0719876543"]), False),
+         ("the same without descriptions", BARE,
+          dict(BARE, ad_id="5", mileage=61000, location="Jaffna", phones=["0719876543"]), False)]
+
+index = DedupeIndex(arguments.threshold)
+failed = 0
+for name, ad, other, same in PAIRS:
+    signature = index.get_signature(ad)
+    other_signature = index.get_signature(other)
+    similarity = index.get_similarity(signature, other_signature)
+    shared = sum(1 for a, b in zip(index.get_bands(signature), index.get_bands(other_signature)) if a == b)
+    clustered = shared >= DedupeIndex.MIN_SHARED_BANDS and similarity >= arguments.threshold
+    if clustered != same:
+        failed += 1
+    print(f"{'ok' if clustered == same else 'WRONG':5} {name}: similarity {similarity:0.2f}, {shared} of "
+          f"{DedupeIndex.BANDS} bands shared, {'same cluster' if clustered else 'apart'}")
+sys.exit(1 if failed > 0 else 0)
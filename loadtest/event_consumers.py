@@ -0,0 +1,63 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+from event_sink import read_frames
+
+
+class _Consumer:
+    def __init__(self, delay: float):
+        # seconds a consumer needs per 100 events, to see the backpressure of a slow consumer
+        self._DELAY = delay
+        self.received = 0
+        self.max_latency = 0.0
+
+    def _receive(self, event: dict):
+        self.received += 1
+        latency = (datetime.now() - datetime.fromisoformat(event["committed_at"])).total_seconds()
+        self.max_latency = max(self.max_latency, latency)
+
+
+class SocketConsumer(_Consumer):
+    """Listens on a unix socket and reads the frames of UnixSocketSink"""
+
+    def __init__(self, path: str, delay: float = 0.0):
+        super(SocketConsumer, self).__init__(delay)
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(1)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            connection, _ = self._server.accept()
+            with connection, connection.makefile("rb") as file:
+                for event in read_frames(file):
+                    self._receive(event)
+                    if self._DELAY > 0 and self.received % 100 == 0:
+                        time.sleep(self._DELAY)
+
+
+class MemoryProducer(_Consumer):
+    """Stand-in for KafkaProducer that keeps the messages in memory"""
+
+    def __init__(self, delay: float = 0.0):
+        super(MemoryProducer, self).__init__(delay)
+        self._pending = []
+
+    def send(self, topic: str, value: bytes = None, key: bytes = None):
+        self._pending.append(value)
+
+    def flush(self):
+        if len(self._pending) == 0:
+            return
+        if self._DELAY > 0:
+            time.sleep(self._DELAY * len(self._pending) / 100)
+        for value in self._pending:
+            self._receive(json.loads(value))
+        self._pending.clear()
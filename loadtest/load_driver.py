@@ -0,0 +1,240 @@
+import argparse
+import logging
+import os
+import tempfile
+import threading
+
+import time
+from time import perf_counter
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="run the agents against a local mock site and report throughput")
+argument_parser.add_argument("--source", choices=["ikman", "riyasewana"], action="append",
+                             help="source to crawl, can be given more than once. default both")
+argument_parser.add_argument("--ads", metavar="integer", type=int, default=2000, help="ads in the synthetic catalogue")
+argument_parser.add_argument("--limit", metavar="integer", type=int, default=200,
+                             help="fetch limit per source, 0 fetches all")
+argument_parser.add_argument("--new", action="store_true",
+                             help="fetch type new. The catalogue is crawled once to fill the local ads first")
+argument_parser.add_argument("--backlog", metavar="integer", type=int, default=100,
+                             help="with --new, ads posted between filling the local ads and the measured run")
+argument_parser.add_argument("--latency", metavar="spec", default="fixed:0",
+                             help="response delay: fixed:seconds, uniform:low:high or lognormal:mu:sigma")
+argument_parser.add_argument("--error-429", metavar="rate", type=float, default=0.0,
+                             help="probability of a 429 response")
+argument_parser.add_argument("--error-5xx", metavar="rate", type=float, default=0.0,
+                             help="probability of a 503 response")
+argument_parser.add_argument("--malformed", metavar="rate", type=float, default=0.0,
+                             help="probability of a page the parser cannot use")
+argument_parser.add_argument("--arrival-rate", metavar="ads/s", type=float, default=0.0,
+                             help="new ads posted per second while crawling")
+argument_parser.add_argument("--max-fails", metavar="integer", type=int, default=2, help="MAX_FAILS of the agents")
+argument_parser.add_argument("--wait-seconds", metavar="seconds", type=float, default=0.0,
+                             help="politeness delay per egress route")
+argument_parser.add_argument("--egress", metavar="integer", type=int, default=1,
+                             help="number of egress routes in the proxy pool, each with its own delay")
+argument_parser.add_argument("--stream-details", action="store_true", help="stream riyasewana detail pages")
+argument_parser.add_argument("--profile", metavar="directory", nargs="?", const="profiles",
+                             help="profile the measured runs, see aggregator.py --profile")
+argument_parser.add_argument("--memtrace", action="store_true",
+                             help="trace memory of the measured runs, see aggregator.py --memtrace")
+argument_parser.add_argument("--feed", metavar="make", action="append",
+                             help="crawl a feed of the ads of this make, 'all' for the whole list. Repeat for more "
+                                  "feeds, overlapping feeds share the fetched ads")
+argument_parser.add_argument("--events", choices=["jsonl", "unix", "kafka"],
+                             help="publish the saved ads to this event sink, a local consumer or stand-in producer "
+                                  "receives them")
+argument_parser.add_argument("--events-compression", choices=["none", "gzip"], default="none")
+argument_parser.add_argument("--consumer-delay", metavar="seconds", type=float, default=0.0,
+                             help="seconds the event consumer needs per 100 events")
+argument_parser.add_argument("--events-buffer", metavar="integer", type=int, default=10000,
+                             help="event buffer size of the publisher")
+argument_parser.add_argument("--archive", action="store_true",
+                             help="keep the fetched detail pages in a raw response archive in a temporary directory")
+argument_parser.add_argument("--freshness", metavar="seconds", type=int,
+                    help="report the lag between posting and saving of the saved ads, late after this many seconds")
+argument_parser.add_argument("--budget", metavar="integer", type=int,
+                    help="after the runs, plan a second run of every source within this many requests and run it")
+argument_parser.add_argument("--seed", metavar="integer", type=int, default=1)
+argument_parser.add_argument("--verbose", action="store_true", help="show the agents' info logs")
+arguments = argument_parser.parse_args()
+
+import logger
+from configuration import AppConfig
+from fetcher import Fetcher
+from profiler import Profiler, PhaseProfiler, MemoryTracer, ProfilerGroup
+from proxy_pool import Proxy, ProxyPool
+from scheduler import PollScheduler
+from run_planner import RunPlanner
+from sources.agent_factory import AgentFactory
+from event_sink import EventPublisher, JsonlSink, UnixSocketSink, KafkaSink
+from raw_archive import BlobStore, RawArchive
+from freshness import FreshnessMetric
+from loadtest.catalogue import Catalogue
+from loadtest.event_consumers import SocketConsumer, MemoryProducer
+from loadtest.memory_connection import MemoryConnection
+from loadtest.mock_site import Faults, Latency, MockSite
+
+if arguments.feed is not None:
+    for make in arguments.feed:
+        if make != "all" and make not in Catalogue.MAKES:
+            argument_parser.error(f"unknown make '{make}', one of: all, {', '.join(Catalogue.MAKES)}")
+
+logger = logger.get_logger("loadtest")
+if not arguments.verbose:
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.WARNING)
+
+TABLES = {"ikman": "ad", "riyasewana": "riyasewana_ad"}
+
+
+def make_list_url(name: str, base_url: str, make: str = None) -> str:
+    if name == "ikman":
+        return f"{base_url}/data/serp?sort=date&order=desc&category=402" + \
+            (f"&make={make}" if make is not None else "") + "&page="
+    return f"{base_url}/search/motorcycles" + (f"?make={make}" if make is not None else "")
+
+
+def make_props(name: str, base_url: str, fetch_type: str, limit: int, feeds: list = None) -> dict:
+    props = {"NAME": name, "FETCH_LIMIT": limit, "FETCH_TYPE": fetch_type, "MAX_FAILS": arguments.max_fails,
+             "LIST_URL": make_list_url(name, base_url)}
+    if name == "ikman":
+        props["DET_URL"] = f"{base_url}/v1/ads/"
+    else:
+        props["STREAM_DETAILS"] = arguments.stream_details
+    if feeds is not None:
+        props["FEEDS"] = [{"NAME": make, "LIST_URL": make_list_url(name, base_url, None if make == "all" else make),
+                           "WEIGHT": 1} for make in feeds]
+    return props
+
+
+def post_new_ads(_catalogue: Catalogue, rate: float, stop: threading.Event):
+    interval = 1.0 / rate
+    while not stop.wait(interval):
+        _catalogue.add_new()
+
+
+catalogue = Catalogue(arguments.ads, arguments.seed)
+faults = Faults(Latency(arguments.latency), arguments.error_429, arguments.error_5xx, arguments.malformed,
+                arguments.seed)
+site = MockSite(("127.0.0.1", 0), catalogue, faults)
+threading.Thread(target=site.serve_forever, daemon=True).start()
+print(f"Mock site on {site.get_base_url()} with {len(catalogue)} ads")
+
+connection = MemoryConnection()
+proxy_pool = ProxyPool([Proxy(f"egress-{i}", {}, arguments.wait_seconds) for i in range(arguments.egress)],
+                       ProxyPool.LEAST_LOAD, 3, 5)
+fetcher = Fetcher(headers={"User-Agent": "loadtest"}, proxy_pool=proxy_pool)
+history_file = os.path.join(tempfile.mkdtemp(), "poll_history.json")
+scheduler_config = AppConfig().get_scheduler_config()
+scheduler = PollScheduler(history_file, scheduler_config["min_interval"], scheduler_config["max_interval"],
+                          scheduler_config["default_interval"])
+planner = RunPlanner(os.path.join(tempfile.mkdtemp(), "run_history.json"), arguments.wait_seconds / arguments.egress)
+profilers = []
+if arguments.memtrace:
+    profilers.append(MemoryTracer())
+if arguments.profile is not None:
+    profilers.append(PhaseProfiler(arguments.profile))
+profiler = ProfilerGroup(profilers) if len(profilers) > 1 else profilers[0] if len(profilers) == 1 else Profiler()
+consumer = None
+hooks = []
+if arguments.events is not None:
+    events_dir = tempfile.mkdtemp()
+    if arguments.events == "unix":
+        consumer = SocketConsumer(os.path.join(events_dir, "events.sock"), arguments.consumer_delay)
+        event_sink = UnixSocketSink(os.path.join(events_dir, "events.sock"), arguments.events_compression)
+    elif arguments.events == "kafka":
+        consumer = MemoryProducer(arguments.consumer_delay)
+        event_sink = KafkaSink(consumer, "motorcycle-ads")
+    else:
+        event_sink = JsonlSink(os.path.join(events_dir, "events.jsonl"), arguments.events_compression)
+    hooks.append(EventPublisher(event_sink, arguments.events_buffer))
+freshness_metric = None
+if arguments.freshness is not None:
+    freshness_metric = FreshnessMetric(arguments.freshness)
+    hooks.append(freshness_metric)
+archive = None
+if arguments.archive:
+    archive = RawArchive(connection, BlobStore(tempfile.mkdtemp()))
+    hooks.append(archive)
+# defaults only: no history, no retry table, no storage hooks other than the event publisher and archive
+factory = AgentFactory(connection, fetcher, scheduler, hooks, AppConfig(), profiler, archive)
+
+stop = threading.Event()
+for name in arguments.source or ["ikman", "riyasewana"]:
+    if arguments.new:
+        # fill local storage with the current catalogue so that only ads posted during the run are new
+        faults.enabled = False
+        # a factory of its own, the factory keeps the feeds of a source between runs
+        AgentFactory(connection, fetcher, scheduler, [], AppConfig()).make_agent(
+            make_props(name, site.get_base_url(), "all", 0)).run()
+        faults.enabled = True
+        catalogue.add_new(arguments.backlog)
+    arrival = None
+    if arguments.arrival_rate > 0:
+        stop.clear()
+        arrival = threading.Thread(target=post_new_ads, args=(catalogue, arguments.arrival_rate, stop), daemon=True)
+        arrival.start()
+
+    saved_before = connection.count(TABLES[name])
+    requests_before = fetcher.get_request_count()
+    server_before = dict(site.stats)
+    start = perf_counter()
+    profiler.start(name)
+    agent = factory.make_agent(make_props(name, site.get_base_url(), "new" if arguments.new else "all",
+                                          arguments.limit, arguments.feed))
+    agent.run()
+    elapsed = perf_counter() - start
+    profiler.stop()
+    planner.record_run(name, fetcher.get_request_count() - requests_before, elapsed, agent.get_run_stats())
+    stop.set()
+    if arrival is not None:
+        arrival.join()
+
+    saved = connection.count(TABLES[name]) - saved_before
+    requests = fetcher.get_request_count() - requests_before
+    served = {key: site.stats[key] - server_before[key] for key in site.stats}
+    print(f"{name}: {saved} ads in {elapsed:0.2f}s = {saved / elapsed if elapsed > 0 else 0:0.1f} ads/s, "
+          f"{requests} requests ({requests / elapsed if elapsed > 0 else 0:0.1f}/s), "
+          f"injected 429: {served['429']}, 5xx: {served['5xx']}, malformed: {served['malformed']}, "
+          f"served {served['bytes'] / 1024:0.0f} KiB")
+    if freshness_metric is not None:
+        lags, late = freshness_metric.finish_run(name)
+        print(f"{name}: saved {lags.describe()} after posting, {late} late")
+
+if arguments.budget is not None:
+    if arguments.new:
+        catalogue.add_new(arguments.backlog)
+    plan_sources = [make_props(name, site.get_base_url(), "new" if arguments.new else "all", arguments.limit,
+                               arguments.feed) for name in arguments.source or ["ikman", "riyasewana"]]
+    estimates = planner.allocate([planner.estimate(source, scheduler) for source in plan_sources], arguments.budget)
+    requests_before = fetcher.get_request_count()
+    for source, estimate in zip(plan_sources, estimates):
+        source["FETCH_LIMIT"] = estimate["plan_limit"]
+        source_requests_before = fetcher.get_request_count()
+        factory.make_agent(source).run()
+        print(f"{source['NAME']}: planned {estimate['budget_requests']} requests with limit {estimate['plan_limit']}, "
+              f"sent {fetcher.get_request_count() - source_requests_before}")
+    print(f"Budget {arguments.budget} requests, sent {fetcher.get_request_count() - requests_before}")
+
+if archive is not None:
+    archive.close()
+    archive_stats = archive.get_stats()
+    print(f"Archived {archive_stats['archived']} pages, {archive_stats['stored']} bodies of "
+          f"{archive_stats['raw_bytes'] / 1024:0.0f} KiB compressed to {archive_stats['compressed_bytes'] / 1024:0.0f} KiB")
+for hook in hooks:
+    if hook is archive or hook is freshness_metric:
+        continue
+    hook.close()
+    print(f"Events published: {hook.published}, sent: {hook.sent} in {hook.batches} batches, dropped: {hook.dropped}")
+if consumer is not None:
+    # the socket consumer may still be reading frames that are in the socket buffer
+    deadline = time.monotonic() + 30
+    while consumer.received < sum(hook.sent for hook in hooks) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    print(f"Events received: {consumer.received}, max latency after commit: {consumer.max_latency:0.2f}s")
+
+stream_stats = fetcher.get_stream_stats()
+if stream_stats["received"] > 0:
+    print(f"Streamed {stream_stats['received'] / 1024:0.0f} KiB, saved {stream_stats['saved'] / 1024:0.0f} KiB")
+site.shutdown()
@@ -0,0 +1,92 @@
+import argparse
+import logging
+import sys
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="check the memory the storage layer needs per ad against a "
+                                                      "budget. Exits with status 1 when a source is over budget")
+argument_parser.add_argument("--source", choices=["ikman", "riyasewana"], action="append",
+                             help="source to check, can be given more than once. default both")
+argument_parser.add_argument("--local", metavar="integer", type=int, default=1000000, help="ads in the local database")
+argument_parser.add_argument("--fetched", metavar="integer", type=int, default=50000, help="ads fetched in the session")
+argument_parser.add_argument("--budget", metavar="bytes", type=int, default=128,
+                             help="allowed peak traced memory per local and fetched ad")
+argument_parser.add_argument("--verbose", action="store_true", help="show the storage info logs")
+arguments = argument_parser.parse_args()
+
+import logger
+from profiler import MemoryTracer
+from sources.ikman.ikman_records import IkmanAd, IkmanDetail
+from sources.ikman.ikman_storage import IkmanStorage
+from sources.riyasewana.riyasewana_records import RiyasewanaAd
+from sources.riyasewana.riyasewana_storage import RiyasewanaStorage
+from loadtest.memory_connection import MemoryConnection
+
+logger = logger.get_logger("memory_budget")
+if not arguments.verbose:
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.WARNING)
+
+TABLES = {"ikman": "ad", "riyasewana": "riyasewana_ad"}
+PAGE_SIZE = 25
+DESCRIPTION = "Honda CD 125 2015 in good condition, single owner, all papers cleared. " * 6
+
+
+def make_id(source: str, number: int) -> str:
+    # ikman ids are 24 hex digits, riyasewana ids are the number at the end of the ad url
+    return f"{number:024x}" if source == "ikman" else str(number)
+
+
+def make_ikman_ad(ad_id: str) -> IkmanDetail:
+    ad = IkmanAd(ad_id, "active", DESCRIPTION, "2022-03-01 10:15:00", f"/en/ad/honda-cd-125-{ad_id}",
+                 "Honda CD 125 2015", "245000", "2022-05-01 10:15:00", "used", f"honda-cd-125-{ad_id}", "Colombo",
+                 "Nugegoda", "for_sale", "Nugegoda, Colombo", "Honda", "CD 125", 2015, 245000, 35000, 125)
+    phones = ((ad_id, "Kamal", "0771234567", 1),)
+    properties = ((ad_id, "brand", "Honda"), (ad_id, "model", "CD 125"), (ad_id, "model_year", "2015"),
+                  (ad_id, "mileage", "35,000 km"), (ad_id, "engine_capacity", "125 cc"))
+    return ad, phones, properties
+
+
+def make_riyasewana_ad(ad_id: str) -> RiyasewanaAd:
+    return RiyasewanaAd(ad_id, "Kamal", "0771234567", "Colombo",
+                        f"https://riyasewana.com/buy/honda-cd-125-sale-colombo-{ad_id}", "Honda CD 125 2015",
+                        "Rs. 245,000", "2022-03-01 10:15:00", "Honda", "CD 125", 2015, "35000", "125", "Electric",
+                        DESCRIPTION, 245000, 35000, 125)
+
+
+def check(source: str) -> bool:
+    connection = MemoryConnection(store_inserts=False)
+    connection.preload(TABLES[source], (make_id(source, number) for number in range(arguments.local)))
+    tracer = MemoryTracer(sample_every=10000)
+    tracer.start(source)
+
+    with tracer.phase("load local"):
+        storage = IkmanStorage(connection, []) if source == "ikman" else RiyasewanaStorage(connection, [])
+    fetched = 0
+    number = arguments.local
+    while fetched < arguments.fetched:
+        page = [make_id(source, number + i) for i in range(PAGE_SIZE)]
+        number += PAGE_SIZE
+        with tracer.phase("filter"):
+            if source == "ikman":
+                page = storage.filter_list(page)
+            else:
+                page = [ad_id for url, ad_id in storage.filter_list([(None, ad_id) for ad_id in page])]
+        for ad_id in page[:arguments.fetched - fetched]:
+            with tracer.phase("save"):
+                storage.queue(make_ikman_ad(ad_id) if source == "ikman" else make_riyasewana_ad(ad_id))
+        fetched += len(page)
+    with tracer.phase("save"):
+        storage.save()
+
+    peak = tracer.get_peak()
+    tracer.stop()
+    per_ad = peak / (arguments.local + arguments.fetched)
+    result = "within" if per_ad <= arguments.budget else "over"
+    print(f"{source}: {arguments.local} local and {storage.get_fetch_count()} fetched ads, "
+          f"peak {peak / 2 ** 20:0.1f} MiB = {per_ad:0.0f} bytes per ad, {result} budget of {arguments.budget}")
+    return per_ad <= arguments.budget
+
+
+results = [check(source) for source in arguments.source or ["ikman", "riyasewana"]]
+sys.exit(0 if all(results) else 1)
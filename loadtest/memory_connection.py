@@ -0,0 +1,107 @@
+import re
+
+
+class MemoryConnection:
+    """Stand-in for a mysql connection so the storage classes can run without a database server.
+
+    Understands the statements the storages send: INSERT [IGNORE] INTO table(columns) ..., with or without ON DUPLICATE
+    KEY UPDATE, and SELECT ad_id FROM table ORDER BY datetime DESC. Other SELECT statements return no rows and other statements are ignored.
+
+    With store_inserts off inserted rows are only counted, for memory measurements of the storages.
+    """
+    _INSERT_PATTERN = re.compile("INSERT\\s+(?:IGNORE\\s+)?INTO\\s+(\\w+)\\s*\\(([^)]*)\\)", re.IGNORECASE)
+    _SELECT_IDS_PATTERN = re.compile("SELECT\\s+ad_id\\s+FROM\\s+(\\w+)\\s+ORDER\\s+BY\\s+datetime\\s+DESC",
+                                     re.IGNORECASE)
+
+    def __init__(self, store_inserts: bool = True):
+        self._STORE_INSERTS = store_inserts
+        self._tables = {}
+        self._dropped = {}
+        self.commit_count = 0
+
+    def cursor(self):
+        return _MemoryCursor(self)
+
+    def commit(self):
+        self.commit_count += 1
+
+    def close(self):
+        pass
+
+    def preload(self, table: str, ad_ids):
+        """adds rows with only ad_id set, oldest first"""
+        rows = self._tables.setdefault(table, [])
+        rows.extend({"ad_id": ad_id} for ad_id in ad_ids)
+
+    def count(self, table: str) -> int:
+        return len(self._tables.get(table, [])) + self._dropped.get(table, 0)
+
+    def get_rows(self, table: str) -> list:
+        return self._tables.get(table, [])
+
+    def _insert(self, query: str, params: tuple):
+        match = MemoryConnection._INSERT_PATTERN.search(query)
+        if match is None:
+            return 0
+        if not self._STORE_INSERTS:
+            self._dropped[match.group(1)] = self._dropped.get(match.group(1), 0) + 1
+            return 1
+        columns = [column.strip() for column in match.group(2).split(",")]
+        self._tables.setdefault(match.group(1), []).append(dict(zip(columns, params)))
+        return 1
+
+    def _select(self, query: str):
+        """rows are generated one by one like an unbuffered mysql cursor reads them"""
+        match = MemoryConnection._SELECT_IDS_PATTERN.search(query)
+        if match is None:
+            return iter(())
+        rows = self._tables.get(match.group(1), [])
+        if all("datetime" not in row for row in rows):
+            # preloaded rows only, already in posting order
+            return ((_copy(row["ad_id"]),) for row in reversed(rows))
+        # latest datetime first. rows without a datetime count as inserted in posting order
+        ordered = sorted(enumerate(rows), key=lambda r: (r[1].get("datetime") or "", r[0]), reverse=True)
+        return ((_copy(row["ad_id"]),) for index, row in ordered)
+
+
+def _copy(value):
+    """a new string object like the ones a database driver returns, so memory traces count one string per row"""
+    return value.encode("utf-8").decode("utf-8") if isinstance(value, str) else value
+
+
+class _MemoryCursor:
+    def __init__(self, connection: MemoryConnection):
+        self._connection = connection
+        self._result = iter(())
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __iter__(self):
+        return self._result
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def execute(self, query: str, params=None):
+        if query.lstrip().upper().startswith("SELECT"):
+            self._result = self._connection._select(query)
+            self.rowcount = -1
+        else:
+            self._result = iter(())
+            self.rowcount = self._connection._insert(query, tuple(params or ()))
+
+    def executemany(self, query: str, seq_params):
+        count = 0
+        for params in seq_params:
+            count += self._connection._insert(query, tuple(params))
+        self.rowcount = count
+
+    def fetchall(self) -> list:
+        result = list(self._result)
+        self._result = iter(())
+        return result
+
+    def close(self):
+        pass
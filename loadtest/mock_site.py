@@ -0,0 +1,244 @@
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlparse
+
+from loadtest.catalogue import Catalogue
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+def _read_template(name: str) -> Template:
+    with open(os.path.join(TEMPLATE_DIR, name)) as file:
+        return Template(file.read())
+
+
+class Latency:
+    """Response delay distribution parsed from 'fixed:seconds', 'uniform:low:high' or 'lognormal:mu:sigma'"""
+
+    def __init__(self, spec: str):
+        parts = spec.split(":")
+        self._kind = parts[0]
+        self._params = [float(p) for p in parts[1:]]
+        if self._kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution '{self._kind}'")
+
+    def sample(self, _random: random.Random) -> float:
+        if self._kind == "fixed":
+            return self._params[0] if len(self._params) > 0 else 0.0
+        if self._kind == "uniform":
+            return _random.uniform(self._params[0], self._params[1])
+        return _random.lognormvariate(self._params[0], self._params[1])
+
+
+class Faults:
+    """What the mock site does wrong and how often. Rates are probabilities per request"""
+
+    def __init__(self, latency: Latency, rate_429: float = 0.0, rate_5xx: float = 0.0, rate_malformed: float = 0.0,
+                 seed: int = 1):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.rate_malformed = rate_malformed
+        self.enabled = True
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def draw(self) -> tuple:
+        """(delay seconds, fault) where fault is None, 429, 500 or 'malformed'"""
+        if not self.enabled:
+            return 0.0, None
+        with self._lock:
+            delay = self.latency.sample(self._random)
+            roll = self._random.random()
+        if roll < self.rate_429:
+            return delay, 429
+        roll -= self.rate_429
+        if roll < self.rate_5xx:
+            return delay, 500
+        roll -= self.rate_5xx
+        if roll < self.rate_malformed:
+            return delay, "malformed"
+        return delay, None
+
+
+class MockSite(ThreadingHTTPServer):
+    """Local http server that answers like the Ikman serp/detail json api and the Riyasewana list/detail pages.
+
+    Routes
+        /data/serp?...&page=N          ikman list (json)
+        /v1/ads/<id>                   ikman detail (json)
+        /search/motorcycles[?page=N]   riyasewana list (html)
+        /buy/<slug>-<id>               riyasewana detail (html)
+
+    A make=<make> query parameter limits a list to the ads of one make, like a category or search feed.
+    """
+    daemon_threads = True
+    IKMAN_PAGE_SIZE = 25
+    RIYASEWANA_PAGE_SIZE = 40
+
+    # fields of the ikman responses that are not read by the parser: images, badges, filters, breadcrumbs
+    _IKMAN_LIST_AD_EXTRA = {"imgUrl": "https://i.ikman-st.com/u/thumbnail.jpg", "isMember": False,
+                            "membershipLevel": "free", "isFeaturedAd": False, "isTopAd": False, "isUrgentAd": False,
+                            "category": {"id": 402, "name": "Motorbikes & Scooters"},
+                            "images": {"base_uri": "https://i.ikman-st.com/u/", "ids": ["a1b2c3d4e5"] * 5},
+                            "adType": "for_sale", "shopName": None, "isJobAd": False}
+    _IKMAN_LIST_EXTRA = {"filters": [{"key": f"filter_{i}", "values": [{"key": f"value_{j}", "count": j}
+                                                                       for j in range(12)]} for i in range(8)],
+                         "breadcrumbs": [{"name": "Vehicles", "url": "/en/ads/sri-lanka/vehicles"}] * 3}
+    _IKMAN_DETAIL_AD_EXTRA = {"images": {"base_uri": "https://i.ikman-st.com/u/",
+                                         "meta": [{"id": "a1b2c3d4e5", "width": 1280, "height": 960}] * 6},
+                              "category": {"id": 402, "name": "Motorbikes & Scooters", "parent_id": 400},
+                              "shop": None, "promotions": [], "is_member": False,
+                              "delivery": {"available": False}}
+    _IKMAN_DETAIL_EXTRA = {"similarAds": [{"id": "0", "title": "Similar ad", "price": "Rs 250,000",
+                                           "imgUrl": "https://i.ikman-st.com/u/thumbnail.jpg"}] * 8,
+                           "breadcrumbs": [{"name": "Vehicles", "url": "/en/ads/sri-lanka/vehicles"}] * 4}
+
+    def __init__(self, address: tuple, catalogue: Catalogue, faults: Faults):
+        super(MockSite, self).__init__(address, _MockSiteHandler)
+        self.catalogue = catalogue
+        self.faults = faults
+        self.list_template = _read_template("riyasewana_list.html")
+        self.list_item_template = _read_template("riyasewana_list_item.html")
+        self.detail_template = _read_template("riyasewana_detail.html")
+        # page weight that is not needed by the parsers: footer, related ads and scripts
+        self.filler = "<div class=\"ad\"><a href=\"/buy/related\">Related ad</a><img src=\"/img.jpg\"></div>" * 60
+        self.script = "var tracking = {};" * 400
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "429": 0, "5xx": 0, "malformed": 0, "bytes": 0}
+
+    def ikman_list(self, page: int, make: str = None, malformed: bool = False) -> bytes:
+        ads, total = self.catalogue.get_page(page, MockSite.IKMAN_PAGE_SIZE, make)
+        body = {"ads": [{"id": ad["id"], "slug": ad["slug"], "title": ad["title"], "price": f"Rs {ad['price']:,}",
+                         "description": ad["description"][:120], "location": ad["location"],
+                         "details": f"{ad['mileage']:,} km", "timeStamp": ad["posted"].isoformat(),
+                         **MockSite._IKMAN_LIST_AD_EXTRA} for ad in ads],
+                "topAds": [MockSite._IKMAN_LIST_AD_EXTRA] * 4,
+                "paginationData": {"total": total, "pageSize": MockSite.IKMAN_PAGE_SIZE, "activePage": page},
+                **MockSite._IKMAN_LIST_EXTRA}
+        if malformed:
+            # no ad list. the agent should count a failure and move on
+            del body["ads"]
+        return json.dumps(body).encode("utf-8")
+
+    def ikman_detail(self, ad: dict, malformed: bool = False) -> bytes:
+        detail = {
+            "id": ad["id"], "status": "active", "description": ad["description"], "date": ad["posted"].isoformat(),
+            "url": f"/en/ad/{ad['slug']}", "title": ad["title"], "money": {"amount": str(ad["price"])},
+            "deactivates": ad["posted"].isoformat(),
+            "contact_card": {"name": ad["name"], "phone_numbers": [{"number": ad["phone"], "verified": True}]},
+            "item_condition": "used", "slug": ad["slug"], "area": {"name": ad["location"]},
+            "location": {"name": ad["location"]}, "type": "for_sale", "info": ad["location"],
+            "properties": [{"key": "brand", "value": ad["make"]}, {"key": "model", "value": ad["model"]},
+                           {"key": "model_year", "value": str(ad["yom"])},
+                           {"key": "mileage", "value": f"{ad['mileage']:,} km"},
+                           {"key": "engine_capacity", "value": f"{ad['engine_cc']} cc"}],
+            **MockSite._IKMAN_DETAIL_AD_EXTRA,
+        }
+        body = {"ad": detail, **MockSite._IKMAN_DETAIL_EXTRA}
+        if malformed:
+            # missing required key
+            del detail["id"]
+        return json.dumps(body).encode("utf-8")
+
+    def get_base_url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+
+class _MockSiteHandler(BaseHTTPRequestHandler):
+    server: MockSite
+
+    def do_GET(self):
+        self.server.count("requests")
+        delay, fault = self.server.faults.draw()
+        if delay > 0:
+            time.sleep(delay)
+        if fault == 429:
+            self.server.count("429")
+            self._send(429, "text/plain", b"Too Many Requests")
+            return
+        if fault == 500:
+            self.server.count("5xx")
+            self._send(503, "text/plain", b"Service Unavailable")
+            return
+        malformed = fault == "malformed"
+        if malformed:
+            self.server.count("malformed")
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get("page", ["1"])[0])
+        make = query.get("make", [None])[0]
+        if url.path == "/data/serp":
+            self._send(200, "application/json", self.server.ikman_list(page, make, malformed))
+        elif url.path.startswith("/v1/ads/"):
+            self._ikman_detail(url.path[len("/v1/ads/"):], malformed)
+        elif url.path == "/search/motorcycles":
+            self._send(200, "text/html; charset=utf-8", self._riyasewana_list(page, make, malformed))
+        elif url.path.startswith("/buy/"):
+            self._riyasewana_detail(url.path.rsplit("-", 1)[-1], malformed)
+        else:
+            self._send(404, "text/plain", b"Not Found")
+
+    def log_message(self, format, *args):
+        # keep the load driver output readable
+        pass
+
+    def _ikman_detail(self, ad_id: str, malformed: bool):
+        ad = self.server.catalogue.get_ad(ad_id)
+        if ad is None:
+            self._send(404, "application/json", b"{}")
+            return
+        self._send(200, "application/json", self.server.ikman_detail(ad, malformed))
+
+    def _riyasewana_list(self, page: int, make: str, malformed: bool) -> bytes:
+        ads, total = self.server.catalogue.get_page(page, MockSite.RIYASEWANA_PAGE_SIZE, make)
+        base_url = self.server.get_base_url()
+        items = "".join(self.server.list_item_template.substitute(
+            url=f"{base_url}/buy/{ad['slug']}-{ad['id']}", title=ad["title"], location=ad["location"],
+            price=f"{ad['price']:,}", date=ad["posted"].strftime("%Y-%m-%d")).strip() for ad in ads)
+        # the parser expects a three digit page count before 'Next'
+        total_pages = f"{math.ceil(total / MockSite.RIYASEWANA_PAGE_SIZE):03d}"
+        first = (page - 1) * MockSite.RIYASEWANA_PAGE_SIZE + 1
+        html = self.server.list_template.substitute(first=first, last=first + len(ads) - 1, total=total,
+                                                    items=items, page=page, total_pages=total_pages,
+                                                    filler=self.server.filler)
+        if malformed:
+            html = html.replace("id=\"content\"", "id=\"maintenance\"")
+        return html.encode("utf-8")
+
+    def _riyasewana_detail(self, ad_id: str, malformed: bool):
+        ad = self.server.catalogue.get_ad(ad_id)
+        if ad is None:
+            self._send(404, "text/html", b"<html><body>Not Found</body></html>")
+            return
+        html = self.server.detail_template.substitute(
+            title=ad["title"], name=ad["name"], date=ad["posted"].strftime("%Y-%m-%d %I:%M %p").lower(),
+            location=ad["location"], phone=ad["phone"], price=f"{ad['price']:,}", make=ad["make"],
+            model=ad["model"], yom=ad["yom"], mileage=ad["mileage"], engine_cc=ad["engine_cc"],
+            description=ad["description"], filler=self.server.filler, script=self.server.script)
+        if malformed:
+            html = html.replace("id=\"content\"", "id=\"maintenance\"")
+        self._send(200, "text/html; charset=utf-8", html.encode("utf-8"))
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            self.server.count("bytes", len(body))
+        except (BrokenPipeError, ConnectionResetError):
+            # streaming clients close the connection once they have what they need
+            pass
@@ -0,0 +1,144 @@
+import argparse
+import logging
+import sys
+from time import perf_counter
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="compare the cost of building and queueing parsed ads as the "
+                                                      "records of the parsers with the lists and dicts used before")
+argument_parser.add_argument("--ads", metavar="integer", type=int, default=10000, help="ads built per pass")
+argument_parser.add_argument("--repeat", metavar="integer", type=int, default=5,
+                             help="timed passes, the fastest is shown")
+arguments = argument_parser.parse_args()
+
+from normaliser import Normaliser
+from sources.ikman.ikman_records import (IkmanAd, IkmanDetail, ENGINE_CC_KEY, MAKE_KEY, MILEAGE_KEY, MODEL_KEY,
+                                         YOM_KEY, get_typed_values)
+from sources.riyasewana.riyasewana_records import RiyasewanaAd
+
+logging.disable(logging.INFO)
+
+DESCRIPTION = "Honda CD 125 2015 in good condition, single owner, all papers cleared. " * 6
+# properties and contact card as in the decoded detail json
+PROPERTIES = [{"key": MAKE_KEY, "value": "Honda"}, {"key": MODEL_KEY, "value": "CD 125"},
+              {"key": YOM_KEY, "value": "2015"}, {"key": MILEAGE_KEY, "value": "35,000 km"},
+              {"key": ENGINE_CC_KEY, "value": "125 cc"}, {"key": "bike_type", "value": "Motorbikes"},
+              {"key": "condition", "value": "used"}]
+CONTACT_CARD = {"name": "Kamal", "phone_numbers": [{"number": "0771234567", "verified": True}]}
+normaliser = Normaliser()
+
+
+def get_ad_values(ad_id: str) -> list:
+    """the ad columns the parser reads from the json, in KEY_LIST order"""
+    return [ad_id, "active", DESCRIPTION, "2022-03-01 10:15:00", f"/en/ad/honda-cd-125-{ad_id}", "Honda CD 125 2015",
+            "245000", "2022-05-01 10:15:00", "used", f"honda-cd-125-{ad_id}", "Colombo", "Nugegoda", "for_sale",
+            "Nugegoda, Colombo"]
+
+
+# the parser and storage steps as they were before the records: a list of the ad tuple and lists of phone and property
+# tuples for ikman with the typed values added by the storage, a dict of the table labels for riyasewana
+def old_ikman(ad_id: str) -> tuple:
+    _ad = get_ad_values(ad_id)
+    _phones = []
+    _properties = []
+    prop_list = []
+    for prop in PROPERTIES:
+        prop_list.append((ad_id, prop["key"], prop["value"]))
+    _properties.extend(tuple(prop_list))
+    phone_list = []
+    for entry in CONTACT_CARD["phone_numbers"]:
+        phone_list.append((ad_id, CONTACT_CARD["name"], entry["number"], entry["verified"]))
+    _phones.extend(tuple(phone_list))
+    fetched = [tuple(_ad), _phones, _properties]
+    typed = get_typed_values(normaliser, fetched[0][6], fetched[2])
+    return fetched[0] + typed, fetched[1], fetched[2]
+
+
+def old_riyasewana(ad_id: str) -> tuple:
+    _ad = {"ad_id": ad_id, "url": f"https://riyasewana.com/buy/honda-cd-125-sale-colombo-{ad_id}",
+           "title": "Honda CD 125 2015", "name": "Kamal", "date": "2022-03-01 10:15:00", "location": "Colombo",
+           "contact": "0771234567", "price": "Rs. 245,000", "make": "Honda", "model": "CD 125", "yom": str(2015),
+           "mileage (km)": "35000", "gear": "Manual", "fuel type": "Petrol", "options": "", "engine (cc)": "125",
+           "start type": "Electric", "details": DESCRIPTION}
+    _ad["price_value"] = normaliser.parse_price(_ad["price"])
+    _ad["mileage_km"] = normaliser.parse_mileage(_ad["mileage (km)"])
+    _ad["engine_cc_value"] = normaliser.parse_engine_cc(_ad["engine (cc)"])
+    _ad["yom_value"] = normaliser.parse_yom(_ad["yom"])
+    return (_ad["ad_id"], _ad["name"], _ad["contact"], _ad["location"], _ad["url"], _ad["title"], _ad["price"],
+            _ad["date"], _ad["make"], _ad["model"], _ad["yom"], _ad["mileage (km)"], _ad["engine (cc)"],
+            _ad["start type"], _ad["details"], _ad["price_value"], _ad["mileage_km"], _ad["engine_cc_value"])
+
+
+# the same steps with the records
+def new_ikman(ad_id: str) -> IkmanDetail:
+    _ad = get_ad_values(ad_id)
+    prop_list = []
+    for prop in PROPERTIES:
+        prop_list.append((ad_id, prop["key"], prop["value"]))
+    properties = tuple(prop_list)
+    phone_list = []
+    for entry in CONTACT_CARD["phone_numbers"]:
+        phone_list.append((ad_id, CONTACT_CARD["name"], entry["number"], entry["verified"]))
+    _ad.extend(get_typed_values(normaliser, _ad[6], properties))
+    return tuple.__new__(IkmanAd, _ad), tuple(phone_list), properties
+
+
+def new_riyasewana(ad_id: str) -> RiyasewanaAd:
+    return RiyasewanaAd(ad_id, "Kamal", "0771234567", "Colombo",
+                        f"https://riyasewana.com/buy/honda-cd-125-sale-colombo-{ad_id}", "Honda CD 125 2015",
+                        "Rs. 245,000", "2022-03-01 10:15:00", "Honda", "CD 125", normaliser.parse_yom("2015") or 0,
+                        "35000", "125", "Electric", DESCRIPTION, normaliser.parse_price("Rs. 245,000"),
+                        normaliser.parse_mileage("35000"), normaliser.parse_engine_cc("125"))
+
+
+def queue_all(build, ad_ids: list) -> tuple:
+    """the executemany parameter lists of the ads, as the storages keep them until a save"""
+    ads, phones, properties = [], [], []
+    for ad_id in ad_ids:
+        fetched = build(ad_id)
+        # riyasewana gives the ad row alone, ikman the ad with its phones and properties
+        if len(fetched) > 3:
+            ads.append(fetched)
+        else:
+            ads.append(fetched[0])
+            phones.extend(fetched[1])
+            properties.extend(fetched[2])
+    return ads, phones, properties
+
+
+def get_kept_size(queued: tuple) -> int:
+    """bytes of the queued containers, records and the values they hold, each object counted once. tracemalloc would
+    miss the plain tuples reused from the free lists of the interpreter"""
+    seen = set()
+    size = 0
+    pending = list(queued)
+    while len(pending) > 0:
+        value = pending.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, (tuple, list)):
+            pending.extend(value)
+    return size
+
+
+def measure(builds: tuple, ad_ids: list) -> list:
+    """seconds of the fastest pass over the ads and bytes kept of the queued ads for each way of building them. The
+    passes alternate between the builds so a change of the machine load slows each of them alike"""
+    seconds = [None] * len(builds)
+    for _ in range(arguments.repeat):
+        for index, build in enumerate(builds):
+            start = perf_counter()
+            queue_all(build, ad_ids)
+            elapsed = perf_counter() - start
+            seconds[index] = elapsed if seconds[index] is None else min(seconds[index], elapsed)
+    return [(seconds[index], get_kept_size(queue_all(build, ad_ids))) for index, build in enumerate(builds)]
+
+
+ad_ids = [f"{number:024x}" for number in range(arguments.ads)]
+scale = 10000 / arguments.ads
+print(f"{'':26} {'ms / 10k ads':>14} {'kept KiB / 10k ads':>20}")
+for source, old, new in (("ikman", old_ikman, new_ikman), ("riyasewana", old_riyasewana, new_riyasewana)):
+    for label, (seconds, kept) in zip(("lists and dicts", "records"), measure((old, new), ad_ids)):
+        print(f"{source + ' ' + label:26} {seconds * 1000 * scale:14.1f} {kept * scale / 1024:20.0f}")
@@ -0,0 +1,85 @@
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+from time import perf_counter
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="time keyword queries on the full-text search index against "
+                                                      "LIKE scans of the same synthetic ads")
+argument_parser.add_argument("--ads", metavar="integer", type=int, default=300000, help="synthetic saved ads")
+argument_parser.add_argument("--batch", metavar="integer", type=int, default=1000, help="ads indexed per commit")
+argument_parser.add_argument("--repeat", metavar="integer", type=int, default=5, help="runs of every query")
+argument_parser.add_argument("--seed", metavar="integer", type=int, default=1)
+arguments = argument_parser.parse_args()
+
+from loadtest.catalogue import Catalogue
+from search_index import SearchIndex
+
+logging.disable(logging.INFO)
+
+_PHRASES = ["in good condition", "first owner", "brand new tyres", "recently serviced", "original paint",
+            "leasing available", "call for a test ride", "price negotiable", "mint condition", "genuine mileage",
+            "all papers clear", "new battery", "urgent sale", "well maintained", "book and key available"]
+# query words -> LIKE patterns of the same ads, the title or description must contain each pattern
+QUERIES = [("pulsar", ["%pulsar%"]),
+           ("pleasure 2008 jaffna", ["%pleasure%", "%2008%", "%jaffna%"]),
+           ("cd 125", ["%cd%125%"]),
+           ("honda hornet kandy", ["%honda%", "%hornet%", "%kandy%"]),
+           ("first owner", ["%first owner%"]),
+           ("serviced yamaha r15", ["%serviced%", "%yamaha%", "%r15%"])]
+
+
+def make_records(count: int, _random: random.Random) -> list:
+    records = []
+    makes = list(Catalogue.MAKES.keys())
+    for number in range(count):
+        make = _random.choice(makes)
+        model = _random.choice(Catalogue.MAKES[make])
+        yom = _random.randint(2005, 2022)
+        location = _random.choice(Catalogue.LOCATIONS)
+        # some ads write the model without the space, 'CD125'
+        title = f"{make} {model if _random.random() < 0.7 else model.replace(' ', '')} {yom}"
+        description = f"{title} for sale in {location}, " + ", ".join(_random.sample(_PHRASES, _random.randint(2, 6)))
+        records.append({"source": "ikman" if number % 2 == 0 else "riyasewana", "ad_id": str(1000000 + number),
+                        "title": title, "description": description, "make": make, "model": model, "yom": yom,
+                        "price": _random.randint(60, 1200) * 1000, "location": location,
+                        "datetime": f"2022-01-01 00:{number % 60:02d}:00"})
+    return records
+
+
+def timed(label: str, function, repeat: int = 1):
+    start = perf_counter()
+    for _ in range(repeat):
+        result = function()
+    print(f"{label:52} {(perf_counter() - start) * 1000 / repeat:9.2f} ms")
+    return result
+
+
+_random = random.Random(arguments.seed)
+records = make_records(arguments.ads, _random)
+directory = tempfile.mkdtemp()
+
+index = SearchIndex(os.path.join(directory, "search.db"))
+timed(f"index {arguments.ads} ads, {arguments.batch} per commit",
+      lambda: [index.add(records[i:i + arguments.batch]) for i in range(0, len(records), arguments.batch)])
+
+# the same text in a plain table, searched like the ad tables are without the index
+scan = sqlite3.connect(os.path.join(directory, "scan.db"))
+scan.execute("CREATE TABLE ad(source TEXT, ad_id TEXT, title TEXT, description TEXT)")
+scan.executemany("INSERT INTO ad VALUES (?, ?, ?, ?)",
+                 [(record["source"], record["ad_id"], record["title"], record["description"]) for record in records])
+scan.commit()
+
+for words, patterns in QUERIES:
+    found = timed(f"search '{words}' (top 20)", lambda: index.search(words, 20), arguments.repeat)
+    condition = " AND ".join(["(title || ' ' || description) LIKE ?"] * len(patterns))
+    # all matches are read, like a ranking over them would have to
+    scanned = timed(f"LIKE scan for '{words}'",
+                    lambda: scan.execute(f"SELECT source, ad_id FROM ad WHERE {condition}", patterns).fetchall(),
+                    arguments.repeat)
+    matched = len(index.search(words, arguments.ads))
+    print(f"  {matched} ads found, {len(scanned)} by LIKE. Best: {found[0]['snippet'] if len(found) > 0 else '-'}")
+index.close()
@@ -0,0 +1,86 @@
+import argparse
+import logging
+import random
+import tempfile
+from time import perf_counter
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="time the market statistics on synthetic ads and check the "
+                                                      "grouped percentiles against numpy.percentile")
+argument_parser.add_argument("--ads", metavar="integer", type=int, default=3000000, help="synthetic stored ads")
+argument_parser.add_argument("--chunk", metavar="integer", type=int, default=50000, help="rows appended per chunk")
+argument_parser.add_argument("--seed", metavar="integer", type=int, default=1)
+arguments = argument_parser.parse_args()
+
+import numpy
+
+from loadtest.catalogue import Catalogue
+from market_stats import MarketStats
+
+logging.disable(logging.INFO)
+
+
+def make_rows(count: int, first_id: int, _random: random.Random) -> list:
+    """rows as returned by MarketStats.LOAD_QUERY, with the raw spelling variations of the sites"""
+    rows = []
+    makes = list(Catalogue.MAKES.keys())
+    for primary_id in range(first_id, first_id + count):
+        make = _random.choice(makes)
+        model = _random.choice(Catalogue.MAKES[make])
+        yom = _random.randint(2000, 2022)
+        age = 2022 - yom
+        # a price that drops with age and some ads priced far off
+        price = max(20000, int(_random.lognormvariate(13.5, 0.25) * 0.93 ** age))
+        if _random.random() < 0.01:
+            price *= 10
+        rows.append((primary_id, make.upper() if primary_id % 7 == 0 else make, model, yom,
+                     price if _random.random() > 0.05 else None,
+                     _random.randint(1, 150) * 1000 if _random.random() > 0.1 else None, 2022))
+    return rows
+
+
+def timed(label: str, function):
+    start = perf_counter()
+    result = function()
+    print(f"{label:42} {(perf_counter() - start) * 1000:8.1f} ms")
+    return result
+
+
+_random = random.Random(arguments.seed)
+stats = MarketStats(None, tempfile.mkdtemp(), 10000, arguments.chunk)
+columns = stats.get_columns()
+rows = [make_rows(min(arguments.chunk, arguments.ads - start), start + 1, _random)
+        for start in range(0, arguments.ads, arguments.chunk)]
+sources = ["ikman", "riyasewana"]
+timed(f"append {arguments.ads} ads in chunks of {arguments.chunk}",
+      lambda: [columns.append(sources[index % 2], chunk) for index, chunk in enumerate(rows)])
+timed("concatenate the chunks", lambda: columns.get("price"))
+
+group_by = ["make", "model", "yom", "mileage_band"]
+result = timed("p25/p50/p75 by make, model, yom, mileage", lambda: stats.price_percentiles(group_by, [25, 50, 75], 1))
+timed("same query, cached", lambda: stats.price_percentiles(group_by, [25, 50, 75], 1))
+timed("p50/p90 by make, model", lambda: stats.price_percentiles(["make", "model"], [50, 90], 1))
+curve = timed("depreciation of honda (all models)", lambda: stats.depreciation("Honda", None, 10))
+flagged = timed("outliers by make, model, yom", lambda: stats.outliers(1.5, 20))
+print(f"{len(result)} groups, {len(curve)} depreciation points, {len(flagged)} outliers")
+
+# check a few groups against numpy.percentile over a plain boolean mask
+price = columns.get("price")
+mileage = columns.get("mileage")
+mismatches = 0
+for row in _random.sample(result, min(20, len(result))):
+    mask = (columns.get("make") == columns.get_code(row["make"])) & \
+           (columns.get("model") == columns.get_code(row["model"])) & (columns.get("yom") == row["yom"]) & \
+           ~numpy.isnan(price)
+    if row["mileage_band"] is None:
+        mask &= mileage < 0
+    else:
+        low, high = (int(bound) for bound in row["mileage_band"].split("-"))
+        mask &= (mileage >= low) & (mileage < high)
+    expected = numpy.percentile(price[mask], [25, 50, 75])
+    if int(mask.sum()) != row["count"] or not numpy.allclose(expected, [row["p25"], row["p50"], row["p75"]]):
+        mismatches += 1
+        print(f"mismatch {row}: {int(mask.sum())} ads, {expected}")
+honda = [point for point in curve if point["model"] == "cd 125"]
+print(f"honda cd 125 retained after " + ", ".join(f"{point['age']}y {point['retained']:0.2f}" for point in honda[:6]))
+print(f"{'no' if mismatches == 0 else mismatches} mismatches with numpy.percentile")
@@ -0,0 +1,80 @@
+import argparse
+
+from time import perf_counter
+from mysql.connector import connect, Error
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="load the ads stored since the last report into the column "
+                                                      "cache and log price statistics")
+argument_parser.add_argument("-G", "--group-by", choices=["make", "model", "yom", "mileage_band"], action="append",
+                             help="field to group the price percentiles by, can be repeated. Default make, model "
+                                  "and yom")
+argument_parser.add_argument("-P", "--percentile", metavar="number", type=float, action="append",
+                             help="price percentile, can be repeated. Default 25, 50 and 75")
+argument_parser.add_argument("-C", "--min-count", metavar="integer", type=int, default=5,
+                             help="leave out groups of fewer ads, default 5")
+argument_parser.add_argument("-D", "--depreciation", metavar="make[/model]",
+                             help="log the median price by age of the make, or of one of its models, instead")
+argument_parser.add_argument("-O", "--outliers", metavar="fence", type=float, nargs="?", const=1.5,
+                             help="log the ads priced more than fence (default 1.5) times the interquartile range "
+                                  "outside the quartiles of their make, model and year instead")
+argument_parser.add_argument("--rebuild", action="store_true",
+                             help="load all stored ads again, e.g. after reparse.py or backfill.py updated them")
+arguments = argument_parser.parse_args()
+_percentiles = arguments.percentile or [25, 50, 75]
+if any(percentile < 0 or percentile > 100 for percentile in _percentiles):
+    argument_parser.error("percentiles must be between 0 and 100")
+if arguments.min_count <= 0:
+    argument_parser.error("min-count must be a positive number")
+if arguments.outliers is not None and arguments.outliers < 0:
+    argument_parser.error("fence cannot be negative")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from market_stats import MarketStats
+
+logger = logger.get_logger("Market")
+
+config = AppConfig()
+config.parse_config_file()
+db_config = config.get_db_config()
+stats_config = config.get_stats_config()
+
+try:
+    connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+except Error as err:
+    logger.critical(err)
+    exit(1)
+
+stats = MarketStats(connection, stats_config["cache_directory"], stats_config["mileage_band_km"],
+                    stats_config["chunk_size"])
+try:
+    if arguments.rebuild:
+        stats.rebuild()
+    stats.refresh()
+    query_start = perf_counter()
+    if arguments.depreciation is not None:
+        make, _, model = arguments.depreciation.partition("/")
+        for point in stats.depreciation(make, model or None, arguments.min_count):
+            retained = f"{point['retained']:0.2f}" if point["retained"] is not None else "-"
+            logger.info(f"{point['make']} {point['model']} age {point['age']:2d}: {point['count']:6d} ads, median "
+                        f"{point['median']:,.0f}, retained {retained}")
+    elif arguments.outliers is not None:
+        outliers = stats.outliers(arguments.outliers, arguments.min_count)
+        for outlier in outliers:
+            logger.info(f"{outlier['source']} primary id {outlier['primary_id']}: price {outlier['price']:,.0f} "
+                        f"outside {outlier['low']:,.0f} - {outlier['high']:,.0f}")
+        logger.info(f"{len(outliers)} outliers")
+    else:
+        group_by = arguments.group_by or ["make", "model", "yom"]
+        for row in stats.price_percentiles(group_by, _percentiles, arguments.min_count):
+            group = " ".join(str(row[field]) for field in group_by)
+            values = ", ".join(f"p{percentile:g} {row[f'p{percentile:g}']:,.0f}" for percentile in _percentiles)
+            logger.info(f"{group}: {row['count']} ads, {values}")
+    logger.info(f"Query took {perf_counter() - query_start:0.3f} seconds. Finished in {perf_counter() - start:0.2f} "
+                f"seconds")
+except KeyboardInterrupt as exc:
+    logger.warning("User abort. Exiting...")
+    exit(0)
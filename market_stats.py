@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+from typing import TYPE_CHECKING
+
+import logger
+from alerts import normalise_term
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logger.get_logger("market.stats")
+
+# source -> (table, source code in the columns)
+SOURCES = {"ikman": ("ad", 0), "riyasewana": ("riyasewana_ad", 1)}
+
+
+def grouped_percentiles(keys: list, ranks, sorted_values, percentiles: list) -> tuple:
+    """percentiles of the values of every group, linearly interpolated like numpy.percentile
+
+    Sorting the values is the costly part and does not depend on the grouping, so the values are sorted once and every
+    grouping sorts single int64s of group and rank.
+
+    :param keys: int64 arrays with an item per grouped value, the group of a value is its tuple of keys. Keys must not
+     be negative
+    :param ranks: int64 array, the position of the value of every item in sorted_values. No two items share a rank
+    :param sorted_values: float array in ascending order
+    :param percentiles: percentiles from 0 to 100
+    :return: tuple (group keys as a 2d array with a row per group in ascending order, value count per group, 2d array
+     of percentiles with a row per group, ranks sorted by group and value, group of each of these ranks)
+    """
+    size = len(sorted_values)
+    # keys are replaced by dense codes of the values present, so that the codes of all keys and the rank fit in one
+    # int64
+    packed = numpy.zeros(len(ranks), dtype=numpy.int64)
+    present_values = []
+    for key in keys:
+        present = numpy.zeros(int(key.max()) + 1 if len(key) > 0 else 1, dtype=bool)
+        present[key] = True
+        dense = numpy.cumsum(present) - 1
+        present_values.append(numpy.flatnonzero(present))
+        packed = packed * len(present_values[-1]) + dense[key]
+    bits = sum(max(1, len(values_of_key)).bit_length() for values_of_key in present_values) + size.bit_length()
+    if bits > 63:
+        raise ValueError(f"Group keys and ranks need {bits} bits, more than fit in an int64")
+    packed = packed * size + ranks
+    packed.sort()
+    ranks = packed % size
+    sorted_keys = packed // size
+    sorted_values = sorted_values[ranks]
+    is_start = numpy.empty(len(sorted_keys), dtype=bool)
+    is_start[:1] = True
+    numpy.not_equal(sorted_keys[1:], sorted_keys[:-1], out=is_start[1:])
+    starts = numpy.flatnonzero(is_start)
+    counts = numpy.diff(numpy.append(starts, len(sorted_keys)))
+
+    result = numpy.empty((len(starts), len(percentiles)))
+    for column, percentile in enumerate(percentiles):
+        position = starts + (counts - 1) * (percentile / 100)
+        low = numpy.floor(position).astype(numpy.int64)
+        high = numpy.minimum(low + 1, starts + counts - 1)
+        fraction = position - low
+        result[:, column] = sorted_values[low] + (sorted_values[high] - sorted_values[low]) * fraction
+
+    group_keys = numpy.empty((len(starts), len(keys)), dtype=numpy.int64)
+    remainder = sorted_keys[starts]
+    for column in range(len(keys) - 1, -1, -1):
+        group_keys[:, column] = present_values[column][remainder % len(present_values[column])]
+        remainder = remainder // len(present_values[column])
+    return group_keys, counts, result, ranks, numpy.cumsum(is_start) - 1
+
+
+class AdColumns:
+    """The typed columns of the stored ads of both sources as numpy arrays, appended to in chunks and saved to an npz
+    file. make and model are normalised and coded by their index in the vocabulary, code 0 is an empty value. A missing
+    year or mileage is -1, a missing price nan.
+    """
+    FIELDS = {"source": "int8", "primary_id": "int64", "make": "int32", "model": "int32", "yom": "int16",
+              "price": "float64", "mileage": "int64", "year": "int16"}
+
+    def __init__(self):
+        self.vocabulary = [""]
+        self._codes = {"": 0}
+        self._raw_codes = {}
+        # source -> highest primary_id loaded
+        self.watermarks = {source: 0 for source in SOURCES}
+        self._arrays = {field: numpy.empty(0, dtype=dtype) for field, dtype in AdColumns.FIELDS.items()}
+        self._chunks = []
+
+    def __len__(self):
+        return len(self._arrays["source"]) + sum(len(chunk["source"]) for chunk in self._chunks)
+
+    def get(self, field: str):
+        if len(self._chunks) > 0:
+            for name in AdColumns.FIELDS:
+                self._arrays[name] = numpy.concatenate([self._arrays[name]] + [chunk[name] for chunk in self._chunks])
+            self._chunks = []
+        return self._arrays[field]
+
+    def append(self, source: str, rows: list):
+        """appends rows of (primary_id, make, model, yom, price_value, mileage_km, posting year) of the source"""
+        if len(rows) == 0:
+            return
+        primary_id, make, model, yom, price, mileage, year = zip(*rows)
+        chunk = {"source": numpy.full(len(rows), SOURCES[source][1], dtype=numpy.int8),
+                 "primary_id": numpy.array(primary_id, dtype=numpy.int64),
+                 "make": self._encode(make),
+                 "model": self._encode(model),
+                 "yom": self._to_int(yom, numpy.int16),
+                 "price": numpy.array([numpy.nan if value is None else value for value in price], dtype=numpy.float64),
+                 "mileage": self._to_int(mileage, numpy.int64),
+                 "year": self._to_int(year, numpy.int16)}
+        self._chunks.append(chunk)
+        self.watermarks[source] = max(self.watermarks[source], int(chunk["primary_id"].max()))
+
+    def get_code(self, term) -> int:
+        """code of a make or model, -1 when no stored ad has it"""
+        return self._codes.get(normalise_term(term) or "", -1)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {field: self.get(field) for field in AdColumns.FIELDS}
+        # written to temporary files first so that a crash never leaves columns that do not match their watermark
+        numpy.savez(os.path.join(directory, "columns.tmp.npz"), **arrays)
+        with open(os.path.join(directory, "columns.tmp.json"), "w") as file:
+            json.dump({"vocabulary": self.vocabulary, "watermarks": self.watermarks}, file)
+        os.replace(os.path.join(directory, "columns.tmp.npz"), os.path.join(directory, "columns.npz"))
+        os.replace(os.path.join(directory, "columns.tmp.json"), os.path.join(directory, "columns.json"))
+
+    @staticmethod
+    def load(directory: str) -> AdColumns:
+        """the saved columns, empty columns when nothing is saved or the files do not match"""
+        columns = AdColumns()
+        if not os.path.exists(os.path.join(directory, "columns.json")):
+            return columns
+        try:
+            with open(os.path.join(directory, "columns.json")) as file:
+                meta = json.load(file)
+            with numpy.load(os.path.join(directory, "columns.npz")) as arrays:
+                loaded = {field: arrays[field] for field in AdColumns.FIELDS}
+        except (OSError, ValueError, KeyError) as ex:
+            logger.warning(f"Could not read the saved columns, loading all ads again. {ex}")
+            return columns
+        columns._arrays = loaded
+        columns.vocabulary = meta["vocabulary"]
+        columns._codes = {term: code for code, term in enumerate(columns.vocabulary)}
+        columns.watermarks.update(meta["watermarks"])
+        return columns
+
+    def _encode(self, terms: tuple):
+        return numpy.fromiter((self._get_raw_code(term) for term in terms), dtype=numpy.int32, count=len(terms))
+
+    def _get_raw_code(self, term) -> int:
+        # raw values repeat, so each distinct raw value of a session is normalised once
+        code = self._raw_codes.get(term)
+        if code is None:
+            normalised = normalise_term(term) or ""
+            if normalised not in self._codes:
+                self._codes[normalised] = len(self.vocabulary)
+                self.vocabulary.append(normalised)
+            code = self._raw_codes[term] = self._codes[normalised]
+        return code
+
+    @staticmethod
+    def _to_int(values: tuple, dtype):
+        return numpy.array([-1 if value is None else value for value in values], dtype=dtype)
+
+
+class MarketStats:
+    """Price statistics of the stored ads computed with numpy over AdColumns.
+
+    refresh() loads only the ads stored since the watermark of each source, in chunks of chunk_size rows ordered by
+    primary_id, and saves the columns in directory. Results are cached in directory too, keyed by the query and the
+    watermarks, so a query is computed again only after new ads were loaded. Ads updated in place, e.g. by reparse.py,
+    are only seen after a rebuild.
+    """
+    LOAD_QUERY: str = "SELECT primary_id, make, model, yom, price_value, mileage_km, YEAR(datetime) FROM {} " \
+                      "WHERE primary_id > %s ORDER BY primary_id LIMIT %s"
+    MAX_AGE = 40
+
+    def __init__(self, connection: MySQLConnection, directory: str, mileage_band_km: int, chunk_size: int):
+        if numpy is None:
+            raise ImportError("Market statistics need the numpy package. pip install numpy")
+        self._connection = connection
+        self._DIRECTORY = directory
+        self._MILEAGE_BAND_KM = mileage_band_km
+        self._CHUNK_SIZE = chunk_size
+        self._columns = AdColumns.load(directory)
+        # number of ads and the result of _get_price_order for them
+        self._price_order = None
+
+    def get_columns(self) -> AdColumns:
+        return self._columns
+
+    def rebuild(self):
+        """forgets the loaded ads and the cached results, the next refresh loads all ads"""
+        self._columns = AdColumns()
+        self._price_order = None
+        shutil.rmtree(os.path.join(self._DIRECTORY, "results"), ignore_errors=True)
+
+    def refresh(self) -> int:
+        """loads the ads stored since the last refresh
+
+        :return: number of loaded ads
+        """
+        loaded = 0
+        for source, (table, _) in SOURCES.items():
+            with self._connection.cursor() as cursor:
+                while True:
+                    cursor.execute(MarketStats.LOAD_QUERY.format(table),
+                                   (self._columns.watermarks[source], self._CHUNK_SIZE))
+                    rows = cursor.fetchall()
+                    self._columns.append(source, rows)
+                    loaded += len(rows)
+                    if len(rows) < self._CHUNK_SIZE:
+                        break
+            logger.info(f"{source}: loaded ads up to primary id {self._columns.watermarks[source]}")
+        if loaded > 0:
+            self._columns.save(self._DIRECTORY)
+        logger.info(f"Loaded {loaded} new ads, {len(self._columns)} ads in total")
+        return loaded
+
+    def price_percentiles(self, group_by: list, percentiles: list, min_count: int) -> list:
+        """price percentiles of the ads grouped by any of make, model, yom and mileage_band
+
+        :return: list of dicts with the group fields, count and p<percentile> keys, groups of fewer than min_count ads
+         left out
+        """
+        return self._cached("percentiles", [group_by, percentiles, min_count],
+                            lambda: self._price_percentiles(group_by, percentiles, min_count))
+
+    def depreciation(self, make: str, model: str, min_count: int) -> list:
+        """median price by age (posting year - year of manufacture) of a make and model, or of every model of the make
+        when model is None, and the share of the median of the youngest age that is left
+
+        :return: list of dicts with make, model, age, count, median and retained
+        """
+        return self._cached("depreciation", [make, model, min_count],
+                            lambda: self._depreciation(make, model, min_count))
+
+    def outliers(self, fence: float, min_count: int) -> list:
+        """ads priced outside [q1 - fence * iqr, q3 + fence * iqr] of the ads of the same make, model and year
+
+        :return: list of dicts with source, primary_id, price, low and high, only of groups of min_count ads or more
+        """
+        return self._cached("outliers", [fence, min_count], lambda: self._outliers(fence, min_count))
+
+    def _price_percentiles(self, group_by: list, percentiles: list, min_count: int) -> list:
+        priced, ranks, sorted_prices, _ = self._get_price_order()
+        keys = [self._get_key(field)[priced] for field in group_by]
+        group_keys, counts, result, _, _ = grouped_percentiles(keys, ranks, sorted_prices, percentiles)
+        kept = counts >= min_count
+        columns = {field: self._decode(field, group_keys[kept, column]) for column, field in enumerate(group_by)}
+        columns["count"] = counts[kept].tolist()
+        for column, percentile in enumerate(percentiles):
+            columns[f"p{percentile:g}"] = result[kept, column].tolist()
+        return [dict(zip(columns.keys(), values)) for values in zip(*columns.values())]
+
+    def _depreciation(self, make: str, model: str, min_count: int) -> list:
+        priced, ranks, sorted_prices, _ = self._get_price_order()
+        yom = self._columns.get("yom")[priced]
+        age = self._columns.get("year")[priced].astype(numpy.int64) - yom
+        selected = (yom > 0) & (age >= 0) & (age <= MarketStats.MAX_AGE)
+        selected &= self._columns.get("make")[priced] == self._columns.get_code(make)
+        if model is not None:
+            selected &= self._columns.get("model")[priced] == self._columns.get_code(model)
+        keys = [self._get_key("model")[priced][selected], age[selected]]
+        group_keys, counts, result, _, _ = grouped_percentiles(keys, ranks[selected], sorted_prices, [50])
+        rows = []
+        youngest = {}
+        for index in numpy.flatnonzero(counts >= min_count):
+            model_code = int(group_keys[index, 0])
+            median = float(result[index, 0])
+            # groups are sorted by model and age, the first kept group of a model has its youngest age
+            youngest.setdefault(model_code, median)
+            rows.append({"make": make, "model": self._columns.vocabulary[model_code], "age": int(group_keys[index, 1]),
+                         "count": int(counts[index]), "median": median,
+                         "retained": median / youngest[model_code] if youngest[model_code] > 0 else None})
+        return rows
+
+    def _outliers(self, fence: float, min_count: int) -> list:
+        priced, ranks, sorted_prices, order = self._get_price_order()
+        keys = [self._get_key(field)[priced] for field in ("make", "model", "yom")]
+        _, counts, quartiles, ranks, groups = grouped_percentiles(keys, ranks, sorted_prices, [25, 75])
+        iqr = quartiles[:, 1] - quartiles[:, 0]
+        low = (quartiles[:, 0] - fence * iqr)[groups]
+        high = (quartiles[:, 1] + fence * iqr)[groups]
+        prices = sorted_prices[ranks]
+        flagged = numpy.flatnonzero(((prices < low) | (prices > high)) & (counts[groups] >= min_count))
+        source_names = {code: source for source, (_, code) in SOURCES.items()}
+        rows = order[ranks[flagged]]
+        return [{"source": source_names[source], "primary_id": primary_id, "price": price, "low": low_fence,
+                 "high": high_fence}
+                for source, primary_id, price, low_fence, high_fence
+                in zip(self._columns.get("source")[rows].tolist(), self._columns.get("primary_id")[rows].tolist(),
+                       prices[flagged].tolist(), low[flagged].tolist(), high[flagged].tolist())]
+
+    def _get_price_order(self) -> tuple:
+        """tuple (mask of the priced ads, rank of the price of every priced ad, sorted prices, index of the ad of every
+        rank), kept until more ads are loaded
+        """
+        if self._price_order is None or self._price_order[0] != len(self._columns):
+            price = self._columns.get("price")
+            priced = ~numpy.isnan(price)
+            priced_prices = price[priced]
+            order = numpy.argsort(priced_prices)
+            ranks = numpy.empty(len(order), dtype=numpy.int64)
+            ranks[order] = numpy.arange(len(order), dtype=numpy.int64)
+            self._price_order = (len(self._columns), priced, ranks, priced_prices[order], numpy.flatnonzero(priced)[order])
+        return self._price_order[1:]
+
+    def _get_key(self, field: str):
+        if field == "mileage_band":
+            mileage = self._columns.get("mileage")
+            # band 0 is an unknown mileage
+            return numpy.where(mileage < 0, 0, mileage // self._MILEAGE_BAND_KM + 1)
+        if field == "yom":
+            return numpy.maximum(self._columns.get("yom"), 0).astype(numpy.int64)
+        return self._columns.get(field).astype(numpy.int64)
+
+    def _decode(self, field: str, values) -> list:
+        """group keys of a field as json values"""
+        if field in ("make", "model"):
+            vocabulary = numpy.array([term or None for term in self._columns.vocabulary], dtype=object)
+            return vocabulary[values].tolist()
+        if field == "mileage_band":
+            return [None if value == 0 else f"{(value - 1) * self._MILEAGE_BAND_KM}-{value * self._MILEAGE_BAND_KM}"
+                    for value in values.tolist()]
+        return [value if value > 0 else None for value in values.tolist()]
+
+    def _cached(self, name: str, params: list, compute) -> list:
+        key = json.dumps([name, self._MILEAGE_BAND_KM] + params)
+        watermarks = self._columns.watermarks
+        path = os.path.join(self._DIRECTORY, "results", hashlib.sha1(key.encode()).hexdigest() + ".json")
+        if os.path.exists(path):
+            try:
+                with open(path) as file:
+                    cached = json.load(file)
+                if cached["key"] == key and cached["watermarks"] == watermarks:
+                    return cached["result"]
+            except (ValueError, OSError, KeyError) as ex:
+                logger.warning(f"Could not read the cached result of {key}. {ex}")
+        result = compute()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as file:
+            json.dump({"key": key, "watermarks": watermarks, "result": result}, file)
+        os.replace(path + ".tmp", path)
+        return result
@@ -0,0 +1,72 @@
+import argparse
+
+from datetime import date, datetime
+from time import perf_counter
+from mysql.connector import connect, Error
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="apply the pending database migrations and keep the monthly "
+                                                      "partitions of the ad tables ahead of the current month")
+argument_parser.add_argument("-S", "--status", action="store_true",
+                             help="only list the applied and pending migrations")
+argument_parser.add_argument("-T", "--to", metavar="version", type=int,
+                             help="apply the pending migrations up to and including this version")
+argument_parser.add_argument("-P", "--partitions-ahead", metavar="months", type=int, default=3,
+                             help="months after the current one that must have a partition")
+argument_parser.add_argument("-D", "--drop-before", metavar="YYYY-MM",
+                             help="drop the partitions, and the ads in them, of the months before this month")
+arguments = argument_parser.parse_args()
+if arguments.partitions_ahead < 0:
+    argument_parser.error("partitions-ahead cannot be negative")
+_drop_before = None
+if arguments.drop_before is not None:
+    try:
+        _drop_before = datetime.strptime(arguments.drop_before, "%Y-%m").date()
+    except ValueError:
+        argument_parser.error("drop-before must be a month such as 2022-01")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from partitions import MonthlyPartitions
+from schema_migrator import SchemaMigrator
+
+logger = logger.get_logger("Migrate")
+
+PARTITIONED_TABLES = ["ad", "riyasewana_ad"]
+
+config = AppConfig()
+config.parse_config_file()
+db_config = config.get_db_config()
+
+try:
+    connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+except Error as err:
+    logger.critical(err)
+    exit(1)
+
+migrator = SchemaMigrator(connection)
+if arguments.status:
+    applied = migrator.get_applied()
+    for migration in migrator.get_migrations():
+        logger.info(f"{migration.version:04d} {migration.name}: {'applied' if migration.version in applied else 'pending'}")
+    exit(0)
+
+try:
+    logger.info(f"Applied {migrator.migrate(arguments.to)} migrations")
+except Error as err:
+    logger.critical(f"Migration failed. {err}")
+    exit(1)
+
+today = date.today()
+months = today.month - 1 + arguments.partitions_ahead
+last = date(today.year + months // 12, months % 12 + 1, 1)
+for table in PARTITIONED_TABLES:
+    partitions = MonthlyPartitions(connection, table)
+    if len(partitions.get_months()) == 0:
+        continue
+    logger.info(f"Added {partitions.extend(last)} partitions to {table}")
+    if _drop_before is not None:
+        logger.info(f"Dropped {len(partitions.drop_before(_drop_before))} partitions of {table}")
+logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
@@ -0,0 +1,66 @@
+--
+-- Tables and columns added to motorcycle_db.sql before the schema was versioned: the dedupe clusters and LSH bands,
+-- see dedupe.py, the typed price, mileage, engine capacity and year columns with their range index, the history of
+-- the price and status changes of known ads, see ad_history.py, and the detail fetch retry queue, see retry_queue.py.
+--
+-- Run backfill.py after this migration to fill the typed columns of the ads saved before it.
+--
+
+CREATE TABLE `ad_cluster` (
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `cluster_id` bigint(20) NOT NULL,
+  `signature` varbinary(512) NOT NULL,
+  `_created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`source`,`ad_id`),
+  KEY `cluster_id` (`cluster_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `ad_lsh_band` (
+  `band_no` tinyint(3) UNSIGNED NOT NULL,
+  `band_hash` bigint(20) NOT NULL,
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  PRIMARY KEY (`band_no`,`band_hash`,`source`,`ad_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+ALTER TABLE `ad`
+  ADD COLUMN `make` varchar(64) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL AFTER `info`,
+  ADD COLUMN `model` varchar(64) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL AFTER `make`,
+  ADD COLUMN `yom` smallint(4) UNSIGNED DEFAULT NULL AFTER `model`,
+  ADD COLUMN `price_value` int(10) UNSIGNED DEFAULT NULL AFTER `yom`,
+  ADD COLUMN `mileage_km` int(10) UNSIGNED DEFAULT NULL AFTER `price_value`,
+  ADD COLUMN `engine_cc_value` smallint(5) UNSIGNED DEFAULT NULL AFTER `mileage_km`,
+  ADD KEY `make_model_yom_price` (`make`,`model`,`yom`,`price_value`);
+
+ALTER TABLE `riyasewana_ad`
+  ADD COLUMN `price_value` int(10) UNSIGNED DEFAULT NULL AFTER `details`,
+  ADD COLUMN `mileage_km` int(10) UNSIGNED DEFAULT NULL AFTER `price_value`,
+  ADD COLUMN `engine_cc_value` smallint(5) UNSIGNED DEFAULT NULL AFTER `mileage_km`,
+  ADD KEY `make_model_yom_price` (`make`,`model`,`yom`,`price_value`);
+
+CREATE TABLE `ad_history` (
+  `primary_id` bigint(20) NOT NULL AUTO_INCREMENT,
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `observed_at` datetime NOT NULL,
+  `price_value` int(10) UNSIGNED DEFAULT NULL,
+  `status` varchar(32) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL,
+  `deactivates` datetime DEFAULT NULL,
+  `description_hash` binary(8) DEFAULT NULL,
+  PRIMARY KEY (`primary_id`),
+  KEY `source_ad_id_observed_at` (`source`,`ad_id`,`observed_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `fetch_retry` (
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `url` varchar(255) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `error_class` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `attempts` smallint(5) UNSIGNED NOT NULL,
+  `next_attempt_at` datetime NOT NULL,
+  `gave_up` tinyint(1) NOT NULL DEFAULT 0,
+  `_created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`source`,`ad_id`),
+  KEY `source_gave_up_next_attempt_at` (`source`,`gave_up`,`next_attempt_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -0,0 +1,48 @@
+--
+-- Indexes for looking ads up by ad_id and for the local ads query, which sorts by datetime, and unique keys so the same
+-- ad, phone number or property is not saved twice.
+--
+-- The unique keys of the ad tables include datetime because 0002 partitions them by datetime, and MySQL requires
+-- every unique key of a partitioned table to contain the partition column. An ad keeps its posting datetime, so a
+-- second insert of the same ad still hits the key.
+--
+-- Rows saved twice before these keys existed are removed first, the copy with the lowest primary_id is kept.
+-- Indexes are built online (ALGORITHM=INPLACE, LOCK=NONE): the agents can keep writing while this runs.
+--
+
+UPDATE `ad` SET `datetime` = `_created_at` WHERE `datetime` IS NULL;
+
+DELETE `later` FROM `ad` `later` JOIN `ad` `first`
+  ON `later`.`ad_id` = `first`.`ad_id` AND `later`.`datetime` = `first`.`datetime`
+  AND `later`.`primary_id` > `first`.`primary_id`;
+
+ALTER TABLE `ad`
+  MODIFY `datetime` datetime NOT NULL,
+  ADD UNIQUE KEY `ad_id_datetime` (`ad_id`,`datetime`),
+  ADD KEY `datetime_ad_id` (`datetime`,`ad_id`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+DELETE `later` FROM `riyasewana_ad` `later` JOIN `riyasewana_ad` `first`
+  ON `later`.`ad_id` = `first`.`ad_id` AND `later`.`datetime` = `first`.`datetime`
+  AND `later`.`primary_id` > `first`.`primary_id`;
+
+ALTER TABLE `riyasewana_ad`
+  ADD UNIQUE KEY `ad_id_datetime` (`ad_id`,`datetime`),
+  ADD KEY `datetime_ad_id` (`datetime`,`ad_id`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+DELETE `later` FROM `phone` `later` JOIN `phone` `first`
+  ON `later`.`ad_id` = `first`.`ad_id` AND `later`.`number` = `first`.`number`
+  AND `later`.`primary_id` > `first`.`primary_id`;
+
+ALTER TABLE `phone`
+  ADD UNIQUE KEY `ad_id_number` (`ad_id`,`number`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+DELETE `later` FROM `properties` `later` JOIN `properties` `first`
+  ON `later`.`ad_id` = `first`.`ad_id` AND `later`.`prop_key` = `first`.`prop_key`
+  AND `later`.`primary_id` > `first`.`primary_id`;
+
+ALTER TABLE `properties`
+  ADD UNIQUE KEY `ad_id_prop_key` (`ad_id`,`prop_key`),
+  ALGORITHM=INPLACE, LOCK=NONE;
@@ -0,0 +1,24 @@
+"""Partitions ad and riyasewana_ad by month of datetime.
+
+The primary key becomes (primary_id, datetime) since every unique key of a partitioned table must contain the
+partition column. Partitions are created from the month of the oldest ad to MONTHS_AHEAD months after the current one,
+later months are added by migrate.py. Converting a table copies it and blocks writes, so run this while the agents
+are stopped.
+"""
+from datetime import date
+
+from partitions import MonthlyPartitions
+
+TABLES = ["ad", "riyasewana_ad"]
+MONTHS_AHEAD = 3
+
+
+def upgrade(connection):
+    today = date.today()
+    last = date(today.year + (today.month - 1 + MONTHS_AHEAD) // 12, (today.month - 1 + MONTHS_AHEAD) % 12 + 1, 1)
+    for table in TABLES:
+        with connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE `{table}` DROP PRIMARY KEY, ADD PRIMARY KEY (`primary_id`,`datetime`)")
+            cursor.execute(f"SELECT MIN(`datetime`) FROM `{table}`")
+            oldest = cursor.fetchall()[0][0]
+        MonthlyPartitions(connection, table).partition(oldest.date() if oldest is not None else today, last)
@@ -0,0 +1,33 @@
+--
+-- Saved searches and the alerts of the ads that matched them, see alerts.py.
+--
+-- A NULL column of a saved search does not restrict the search. make, model and location are compared
+-- case-insensitively with the typed make, model and location of an ad, the year and price bounds are inclusive.
+--
+
+CREATE TABLE `saved_search` (
+  `search_id` int(10) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `user_ref` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `make` varchar(64) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL,
+  `model` varchar(64) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL,
+  `location` varchar(64) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL,
+  `yom_min` smallint(5) UNSIGNED DEFAULT NULL,
+  `yom_max` smallint(5) UNSIGNED DEFAULT NULL,
+  `price_max` int(10) UNSIGNED DEFAULT NULL,
+  `active` tinyint(1) NOT NULL DEFAULT 1,
+  `_created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`search_id`),
+  KEY `user_ref` (`user_ref`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `search_alert` (
+  `primary_id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `search_id` int(10) UNSIGNED NOT NULL,
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `notified` tinyint(1) NOT NULL DEFAULT 0,
+  `_created_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`primary_id`),
+  UNIQUE KEY `search_id_source_ad_id` (`search_id`,`source`,`ad_id`),
+  KEY `notified_search_id` (`notified`,`search_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -0,0 +1,17 @@
+--
+-- Index of the detail pages kept in the raw response archive, see raw_archive.py. The bodies are files named by their
+-- sha256 digest, the same body fetched again is stored once and indexed for every fetch.
+--
+
+CREATE TABLE `raw_response` (
+  `primary_id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `url` varchar(255) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `fetched_at` datetime NOT NULL,
+  `digest` char(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `size` int(10) UNSIGNED NOT NULL,
+  PRIMARY KEY (`primary_id`),
+  KEY `source_ad_id_fetched_at` (`source`,`ad_id`,`fetched_at`),
+  KEY `digest` (`digest`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
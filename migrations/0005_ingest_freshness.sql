@@ -0,0 +1,39 @@
+--
+-- Ingestion freshness, see freshness.py. The lag of an ad is the time between its posting datetime and the
+-- _created_at of its row. freshness.py reads the ads stored since its watermark through the _created_at index and adds
+-- their lags to a histogram per source, hour of day of posting and lag bucket. Ads stored more than the late threshold
+-- after they were posted are kept in late_ad.
+--
+
+ALTER TABLE `ad`
+  ADD KEY `_created_at` (`_created_at`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+ALTER TABLE `riyasewana_ad`
+  ADD KEY `_created_at` (`_created_at`),
+  ALGORITHM=INPLACE, LOCK=NONE;
+
+CREATE TABLE `freshness_lag` (
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `hour_of_day` tinyint(2) UNSIGNED NOT NULL,
+  `bucket` tinyint(3) UNSIGNED NOT NULL,
+  `ads` int(10) UNSIGNED NOT NULL,
+  `max_lag` int(10) UNSIGNED NOT NULL,
+  PRIMARY KEY (`source`,`hour_of_day`,`bucket`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `freshness_watermark` (
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `created_at` datetime NOT NULL,
+  PRIMARY KEY (`source`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `late_ad` (
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `posted_at` datetime NOT NULL,
+  `stored_at` datetime NOT NULL,
+  `lag` int(10) UNSIGNED NOT NULL,
+  PRIMARY KEY (`source`,`ad_id`),
+  KEY `stored_at` (`stored_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
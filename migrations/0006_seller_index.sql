@@ -0,0 +1,36 @@
+--
+-- Seller index, see sellers.py. Phone numbers are normalised to E.164 and stored as 63 bit blake2b hashes in
+-- seller_phone, each mapped to a seller. ad_seller maps every ad to its seller and is indexed both ways, so the ads of
+-- a seller and the seller of an ad are index-only lookups. seller keeps the running number of ads and price sum of
+-- each seller, and dealer is set once a seller has SELLERS.DEALER_ADS ads.
+--
+-- Ads saved before this migration are indexed with `python seller_report.py --backfill`.
+--
+
+CREATE TABLE `seller` (
+  `seller_id` bigint(20) UNSIGNED NOT NULL AUTO_INCREMENT,
+  `name` varchar(255) COLLATE utf8mb4_unicode_520_ci DEFAULT NULL,
+  `ads` int(10) UNSIGNED NOT NULL DEFAULT 0,
+  `priced_ads` int(10) UNSIGNED NOT NULL DEFAULT 0,
+  `price_sum` bigint(20) UNSIGNED NOT NULL DEFAULT 0,
+  `dealer` tinyint(1) NOT NULL DEFAULT 0,
+  `first_seen` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  `last_seen` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`seller_id`),
+  KEY `dealer_ads` (`dealer`,`ads`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `seller_phone` (
+  `phone_hash` bigint(20) UNSIGNED NOT NULL,
+  `seller_id` bigint(20) UNSIGNED NOT NULL,
+  PRIMARY KEY (`phone_hash`),
+  KEY `seller_id` (`seller_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
+
+CREATE TABLE `ad_seller` (
+  `source` varchar(16) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `ad_id` varchar(64) COLLATE utf8mb4_unicode_520_ci NOT NULL,
+  `seller_id` bigint(20) UNSIGNED NOT NULL,
+  PRIMARY KEY (`source`,`ad_id`),
+  KEY `seller_id_source_ad_id` (`seller_id`,`source`,`ad_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci;
@@ -0,0 +1,70 @@
+import re
+from datetime import datetime
+
+import logger
+
+logger = logger.get_logger("normaliser")
+
+
+class Normaliser:
+    """Parses the raw price, mileage, engine capacity and year of manufacture strings of an ad into numbers.
+
+    Every method returns None when the value cannot be understood, so the raw text is still saved and the typed column
+    is left empty.
+    """
+    _MULTIPLIERS = {"lakh": 100000, "lakhs": 100000, "lk": 100000, "mn": 1000000, "million": 1000000,
+                    "m": 1000000, "k": 1000}
+
+    def __init__(self):
+        self._NUMBER_PATTERN = re.compile("(\\d[\\d,]*(?:\\.\\d+)?)\\s*([a-z]*)")
+        self._MAX_PRICE = 100000000
+        self._MAX_MILEAGE = 2000000
+        self._MAX_ENGINE_CC = 3000
+        self._MIN_YEAR = 1900
+
+    def parse_price(self, _price):
+        """'Rs. 450,000' -> 450000, '4.5 lakhs' -> 450000. None for 'Negotiable' and other text"""
+        number, suffix = self._get_number(_price)
+        if number is None:
+            return None
+        number *= Normaliser._MULTIPLIERS.get(suffix, 1)
+        return self._in_range(int(round(number)), 1, self._MAX_PRICE, "price", _price)
+
+    def parse_mileage(self, _mileage):
+        """'12,000 km' -> 12000"""
+        number, suffix = self._get_number(_mileage)
+        if number is None:
+            return None
+        if suffix == "k":
+            number *= 1000
+        return self._in_range(int(round(number)), 0, self._MAX_MILEAGE, "mileage", _mileage)
+
+    def parse_engine_cc(self, _engine_cc):
+        """'125cc' -> 125"""
+        number, suffix = self._get_number(_engine_cc)
+        if number is None:
+            return None
+        return self._in_range(int(round(number)), 1, self._MAX_ENGINE_CC, "engine capacity", _engine_cc)
+
+    def parse_yom(self, _yom):
+        """'2015' -> 2015"""
+        number, suffix = self._get_number(_yom)
+        if number is None:
+            return None
+        return self._in_range(int(number), self._MIN_YEAR, datetime.now().year + 1, "year", _yom)
+
+    def _get_number(self, _value) -> tuple:
+        if _value is None:
+            return None, ""
+        if isinstance(_value, (int, float)):
+            return _value, ""
+        match = self._NUMBER_PATTERN.search(str(_value).lower())
+        if match is None:
+            return None, ""
+        return float(match.group(1).replace(",", "")), match.group(2)
+
+    def _in_range(self, _number: int, _min: int, _max: int, _name: str, _raw):
+        if _min <= _number <= _max:
+            return _number
+        logger.info(f"Discarding {_name} {_raw!r}, out of range")
+        return None
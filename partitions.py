@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from datetime import date
+from typing import TYPE_CHECKING
+
+import logger
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("partitions")
+
+
+class MonthlyPartitions:
+    """Monthly RANGE COLUMNS partitions of a table on a datetime column.
+
+    Partition pYYYYMM holds the rows of that month and pmax the rows after the last month, so inserts never fail when
+    extend() was not run in time. Old months are removed with drop_before(), which is much cheaper than deleting rows.
+    MySQL requires every primary and unique key of a partitioned table to include the partition column, and does not
+    allow FULLTEXT indexes or foreign keys on it.
+    """
+    GET_PARTITIONS_QUERY: str = "SELECT PARTITION_NAME FROM information_schema.PARTITIONS WHERE TABLE_SCHEMA = " \
+                                "DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL " \
+                                "ORDER BY PARTITION_ORDINAL_POSITION"
+    MAX_PARTITION = "pmax"
+
+    def __init__(self, connection: MySQLConnection, table: str, column: str = "datetime"):
+        self._connection = connection
+        self._TABLE = table
+        self._COLUMN = column
+
+    def get_months(self) -> list:
+        """first day of every month that has its own partition, oldest first. Empty when the table is not
+        partitioned"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(MonthlyPartitions.GET_PARTITIONS_QUERY, (self._TABLE,))
+            names = [row[0] for row in cursor.fetchall()]
+        return [date(int(name[1:5]), int(name[5:7]), 1) for name in names if name != MonthlyPartitions.MAX_PARTITION]
+
+    def partition(self, first: date, last: date):
+        """partitions the table by month from the month of first to the month of last. MySQL copies the whole table
+        for this and blocks writes until it is done"""
+        months = self._get_month_range(first, last)
+        logger.info(f"Partitioning {self._TABLE} into {len(months)} months from {months[0]:%Y-%m} to "
+                    f"{months[-1]:%Y-%m}")
+        with self._connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE `{self._TABLE}` PARTITION BY RANGE COLUMNS(`{self._COLUMN}`) "
+                           f"({self._get_definitions(months)})")
+
+    def extend(self, last: date) -> int:
+        """adds partitions for the months after the last partitioned month up to the month of last. Only the rows of
+        pmax are moved
+
+        :return: number of added partitions
+        """
+        months = self.get_months()
+        if len(months) == 0:
+            raise ValueError(f"{self._TABLE} is not partitioned by month")
+        new_months = self._get_month_range(self._get_next_month(months[-1]), last)
+        if len(new_months) == 0:
+            return 0
+        logger.info(f"Adding partitions to {self._TABLE} from {new_months[0]:%Y-%m} to {new_months[-1]:%Y-%m}")
+        with self._connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE `{self._TABLE}` REORGANIZE PARTITION {MonthlyPartitions.MAX_PARTITION} "
+                           f"INTO ({self._get_definitions(new_months)})")
+        return len(new_months)
+
+    def drop_before(self, month: date) -> list:
+        """drops the partitions of the months before the month of month together with their rows
+
+        :return: names of the dropped partitions
+        """
+        names = [self._get_name(m) for m in self.get_months() if m < date(month.year, month.month, 1)]
+        if len(names) == 0:
+            return names
+        logger.info(f"Dropping partitions {', '.join(names)} of {self._TABLE}")
+        with self._connection.cursor() as cursor:
+            cursor.execute(f"ALTER TABLE `{self._TABLE}` DROP PARTITION {', '.join(names)}")
+        return names
+
+    def _get_definitions(self, months: list) -> str:
+        """partition definitions of months followed by pmax"""
+        definitions = [f"PARTITION {self._get_name(month)} VALUES LESS THAN ('{self._get_next_month(month):%Y-%m-%d}')"
+                       for month in months]
+        definitions.append(f"PARTITION {MonthlyPartitions.MAX_PARTITION} VALUES LESS THAN (MAXVALUE)")
+        return ", ".join(definitions)
+
+    @staticmethod
+    def _get_name(month: date) -> str:
+        return f"p{month:%Y%m}"
+
+    @staticmethod
+    def _get_next_month(month: date) -> date:
+        return date(month.year + 1, 1, 1) if month.month == 12 else date(month.year, month.month + 1, 1)
+
+    @staticmethod
+    def _get_month_range(first: date, last: date) -> list:
+        months = []
+        month = date(first.year, first.month, 1)
+        while month <= last:
+            months.append(month)
+            month = MonthlyPartitions._get_next_month(month)
+        return months
@@ -0,0 +1,210 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from contextlib import ExitStack, contextmanager, nullcontext
+from datetime import datetime
+from time import perf_counter
+
+import logger
+
+logger = logger.get_logger("profiler")
+
+_NO_PHASE = nullcontext()
+
+
+class Profiler:
+    """Profiler interface used by the agents. This base class does nothing, so a run without profiling only pays for
+    entering an empty context manager per phase.
+
+    Phases used by the agents: list fetch, list parse, filter, detail fetch, detail parse, save
+    """
+
+    def start(self, source: str):
+        pass
+
+    def phase(self, name: str):
+        return _NO_PHASE
+
+    def stop(self):
+        pass
+
+
+class PhaseProfiler(Profiler):
+    """Profiles an agent run with cProfile and a stack sampler and splits the time into phases.
+
+    For every source it writes a pstats file and a collapsed stack file (one 'frame;frame;frame count' line per stack,
+    input for flamegraph.pl or speedscope) with the phase as the root frame, and logs the time per phase and the top
+    functions.
+    """
+
+    def __init__(self, output_dir: str, top_n: int = 15, sample_interval: float = 0.005):
+        self._OUTPUT_DIR = output_dir
+        self._TOP_N = top_n
+        self._SAMPLE_INTERVAL = sample_interval
+        self._source = None
+        self._profile = None
+        self._phase = None
+        self._phase_times = {}
+        self._samples = {}
+        self._target_thread = None
+        self._sampling = threading.Event()
+        self._sampler = None
+        self._started = 0.0
+
+    def start(self, source: str):
+        self._source = source
+        self._phase = None
+        self._phase_times = {}
+        self._samples = {}
+        self._target_thread = threading.get_ident()
+        self._sampling.set()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        self._started = perf_counter()
+        self._profile.enable()
+
+    @contextmanager
+    def phase(self, name: str):
+        # a single assignment, so the sampler thread always sees a whole phase name
+        outer, self._phase = self._phase, name
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._phase_times[name] = self._phase_times.get(name, 0.0) + perf_counter() - start
+            self._phase = outer
+
+    def stop(self):
+        self._profile.disable()
+        total = perf_counter() - self._started
+        self._sampling.clear()
+        self._sampler.join()
+
+        if not os.path.exists(self._OUTPUT_DIR):
+            os.makedirs(self._OUTPUT_DIR)
+        base_name = os.path.join(self._OUTPUT_DIR, f"{self._source}-{datetime.now().strftime('%Y-%m-%dT%H-%M-%S')}")
+        self._profile.dump_stats(base_name + ".pstats")
+        with open(base_name + ".collapsed", "w") as file:
+            for stack, count in sorted(self._samples.items()):
+                file.write(f"{stack} {count}\n")
+        logger.info(f"Profile of {self._source} written to {base_name}.pstats and {base_name}.collapsed")
+        self._log_summary(total)
+
+    def _log_summary(self, total: float):
+        for name, seconds in sorted(self._phase_times.items(), key=lambda item: item[1], reverse=True):
+            logger.info(f"{self._source} phase {name}: {seconds:0.3f}s ({seconds / total * 100 if total > 0 else 0:0.1f}%)")
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self._TOP_N)
+        logger.info(f"{self._source} top {self._TOP_N} functions by cumulative time\n{stream.getvalue()}")
+
+    def _sample(self):
+        while self._sampling.is_set():
+            frame = sys._current_frames().get(self._target_thread)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join([self._source, self._phase or "other"] + stack[::-1])
+                self._samples[key] = self._samples.get(key, 0) + 1
+            self._sampling.wait(self._SAMPLE_INTERVAL)
+
+
+class MemoryTracer(Profiler):
+    """Traces python memory allocations of an agent run with tracemalloc.
+
+    Logs the peak traced memory of the run and, for every phase, its highest peak, the memory it left allocated and
+    the lines that allocated the most. Allocation sites come from snapshots taken around every sample_every-th run of
+    a phase, since a snapshot of a large heap is slow.
+    """
+
+    def __init__(self, top_n: int = 10, sample_every: int = 100):
+        self._TOP_N = top_n
+        self._SAMPLE_EVERY = sample_every
+        # allocations of the tracing itself. Left out of the report, Snapshot.filter_traces is too slow on a large heap
+        self._IGNORED_FILES = {tracemalloc.__file__, __file__}
+        self._source = None
+        self._peak = 0
+        self._phases = {}
+        self._sites = {}
+
+    def start(self, source: str):
+        self._source = source
+        self._peak = 0
+        self._phases = {}
+        self._sites = {}
+        tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name: str):
+        stats = self._phases.setdefault(name, {"count": 0, "peak": 0, "retained": 0})
+        stats["count"] += 1
+        before = None
+        if (stats["count"] - 1) % self._SAMPLE_EVERY == 0:
+            before = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        self._peak = max(self._peak, peak)
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            after, peak = tracemalloc.get_traced_memory()
+            self._peak = max(self._peak, peak)
+            stats["peak"] = max(stats["peak"], peak)
+            stats["retained"] += after - current
+            if before is not None:
+                sites = self._sites.setdefault(name, {})
+                for stat in tracemalloc.take_snapshot().compare_to(before, "lineno"):
+                    if stat.traceback[0].filename in self._IGNORED_FILES:
+                        continue
+                    site = str(stat.traceback)
+                    sites[site] = sites.get(site, 0) + stat.size_diff
+
+    def get_peak(self) -> int:
+        """peak traced memory in bytes since start"""
+        return max(self._peak, tracemalloc.get_traced_memory()[1])
+
+    def stop(self):
+        peak = self.get_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        logger.info(f"{self._source} peak traced memory {peak / 2 ** 20:0.1f} MiB, "
+                    f"still allocated {current / 2 ** 20:0.1f} MiB")
+        for name, stats in sorted(self._phases.items(), key=lambda item: item[1]["peak"], reverse=True):
+            logger.info(f"{self._source} phase {name} ({stats['count']} times): "
+                        f"peak {stats['peak'] / 2 ** 20:0.1f} MiB, retained {stats['retained'] / 2 ** 20:0.1f} MiB")
+            sites = sorted(self._sites.get(name, {}).items(), key=lambda item: item[1], reverse=True)
+            for site, size in sites[:self._TOP_N]:
+                if size <= 0:
+                    break
+                logger.info(f"    {size / 1024:0.1f} KiB {site}")
+
+
+class ProfilerGroup(Profiler):
+    """runs several profilers on the same agent run"""
+
+    def __init__(self, profilers: list):
+        self._profilers = profilers
+
+    def start(self, source: str):
+        for profiler in self._profilers:
+            profiler.start(source)
+
+    @contextmanager
+    def phase(self, name: str):
+        with ExitStack() as stack:
+            for profiler in self._profilers:
+                stack.enter_context(profiler.phase(name))
+            yield
+
+    def stop(self):
+        # in the given order, so a profiler earlier in the list does not measure the reports of the later ones
+        for profiler in self._profilers:
+            profiler.stop()
@@ -0,0 +1,116 @@
+import time
+
+import logger
+
+logger = logger.get_logger("proxy.pool")
+
+
+class Proxy:
+    """An egress route with its own politeness delay, health score and request statistics"""
+
+    def __init__(self, name: str, proxies: dict, wait_seconds: float):
+        """
+        :param name: name used in logs and stats
+        :param proxies: requests style proxies dict, e.g. {"http": url, "https": url}. Empty for a direct connection
+        :param wait_seconds: minimum seconds between two requests sent through this proxy
+        """
+        self.name = name
+        self.proxies = proxies
+        self._wait_seconds = wait_seconds
+        self._next_slot = 0.0
+        self._evicted_until = 0.0
+        self._consecutive_errors = 0
+
+        self.health = 1.0
+        self.request_count = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.total_latency = 0.0
+
+    def seconds_until_ready(self, now: float) -> float:
+        return max(0.0, self._next_slot - now)
+
+    def is_evicted(self, now: float) -> bool:
+        return now < self._evicted_until
+
+    def evicted_until(self) -> float:
+        return self._evicted_until
+
+    def reserve(self, now: float):
+        self._next_slot = max(now, self._next_slot) + self._wait_seconds
+        self.request_count += 1
+
+    def record(self, success: bool, latency: float, max_errors: int, evict_seconds: float) -> bool:
+        """updates health and stats, returns True when the proxy got evicted"""
+        self.total_latency += latency
+        # exponentially weighted success rate
+        self.health = 0.8 * self.health + 0.2 * (1.0 if success else 0.0)
+        if success:
+            self.success_count += 1
+            self._consecutive_errors = 0
+            return False
+        self.error_count += 1
+        self._consecutive_errors += 1
+        if self._consecutive_errors >= max_errors:
+            self._consecutive_errors = 0
+            self._evicted_until = time.monotonic() + evict_seconds
+            return True
+        return False
+
+
+class ProxyPool:
+    """Spreads requests over several proxies. Each proxy keeps its own rate budget so throughput grows with the number
+    of proxies while every egress ip stays as polite as a single one.
+
+    Proxies that fail max_errors times in a row are evicted for evict_seconds.
+    """
+    ROUND_ROBIN = "round_robin"
+    LEAST_LOAD = "least_load"
+
+    def __init__(self, proxies: list, strategy: str, max_errors: int, evict_seconds: float):
+        self._proxies = proxies
+        self._strategy = strategy
+        self._MAX_ERRORS = max_errors
+        self._EVICT_SECONDS = evict_seconds
+        self._next_index = 0
+
+    def __len__(self):
+        return len(self._proxies)
+
+    def acquire(self) -> Proxy:
+        """picks a proxy and waits until its rate budget allows the next request"""
+        now = time.monotonic()
+        available = [proxy for proxy in self._proxies if not proxy.is_evicted(now)]
+        if len(available) == 0:
+            # every proxy is evicted. use the one that comes back first instead of stopping
+            proxy = min(self._proxies, key=lambda p: p.evicted_until())
+            logger.warning(f"All proxies are evicted, using {proxy.name}")
+        elif self._strategy == ProxyPool.LEAST_LOAD:
+            # soonest ready first, healthier proxy on a tie
+            proxy = min(available, key=lambda p: (p.seconds_until_ready(now), -p.health))
+        else:
+            proxy = self._next_round_robin(available)
+        wait = proxy.seconds_until_ready(now)
+        if wait > 0:
+            logger.info(f"Waiting for {wait:0.2f} seconds ({proxy.name})")
+            time.sleep(wait)
+        proxy.reserve(time.monotonic())
+        return proxy
+
+    def release(self, proxy: Proxy, success: bool, latency: float):
+        if proxy.record(success, latency, self._MAX_ERRORS, self._EVICT_SECONDS):
+            logger.warning(f"Evicting proxy {proxy.name} for {self._EVICT_SECONDS} seconds after repeated errors")
+
+    def log_stats(self):
+        for proxy in self._proxies:
+            average = proxy.total_latency / proxy.request_count if proxy.request_count > 0 else 0.0
+            logger.info(f"Proxy {proxy.name}: requests {proxy.request_count}, success {proxy.success_count}, "
+                        f"errors {proxy.error_count}, average latency {average:0.2f}s, health {proxy.health:0.2f}")
+
+    def _next_round_robin(self, available: list) -> Proxy:
+        for _ in range(len(self._proxies)):
+            proxy = self._proxies[self._next_index % len(self._proxies)]
+            self._next_index += 1
+            if proxy in available:
+                return proxy
+        return available[0]
@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import logger
+from storage_hook import StorageHook
+from sources.ikman.ikman_parser import IkmanParser
+from sources.ikman.ikman_records import PHONE_NUMBER
+from sources.riyasewana.riyasewana_parser import RiyasewanaParser
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logger.get_logger("raw.archive")
+
+
+class BlobStore:
+    """Content addressed store of zstd compressed response bodies. A body is saved once under the sha256 of its content
+    as <directory>/<first 2 hex digits>/<other 62 hex digits>.zst
+    """
+
+    def __init__(self, directory: str, level: int = 3):
+        if zstandard is None:
+            raise ImportError("The raw response archive needs the zstandard package. pip install zstandard")
+        self._DIRECTORY = directory
+        self._LEVEL = level
+        # compressor and decompressor objects are not thread safe. Each process makes its own store
+        self._compressor = None
+        self._decompressor = None
+
+    def get_path(self, digest: str) -> str:
+        return os.path.join(self._DIRECTORY, digest[:2], digest[2:] + ".zst")
+
+    def put(self, content: bytes) -> tuple:
+        """saves the body unless a body with the same content is saved already
+
+        :return: tuple (sha256 hex digest, compressed size or 0 when the body was saved before)
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.get_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        if self._compressor is None:
+            self._compressor = zstandard.ZstdCompressor(level=self._LEVEL)
+        compressed = self._compressor.compress(content)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temporary file first so that a crash never leaves a truncated body under the digest
+        descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(compressed)
+        os.replace(temp_path, path)
+        return digest, len(compressed)
+
+    def get(self, digest: str) -> bytes:
+        if self._decompressor is None:
+            self._decompressor = zstandard.ZstdDecompressor()
+        with open(self.get_path(digest), "rb") as file:
+            return self._decompressor.decompress(file.read())
+
+
+class RawArchive(StorageHook):
+    """Keeps the body of every fetched detail page in a BlobStore and indexes it by source, ad id and fetch time in
+    the raw_response table, so that reparse.py can parse the ads again without downloading them.
+
+    Index rows are inserted with the next save of the storage, or when the aggregator stops. Bodies of ads that failed
+    to parse are archived too.
+    """
+    SAVE_INDEX_QUERY: str = "INSERT INTO raw_response(source, ad_id, url, fetched_at, digest, size) " \
+                            "VALUES (%s, %s, %s, %s, %s, %s)"
+    GET_LATEST_QUERY: str = "SELECT ad_id, url, digest FROM raw_response WHERE source = %s ORDER BY ad_id, fetched_at"
+
+    def __init__(self, connection: MySQLConnection, store: BlobStore):
+        self._connection = connection
+        self._store = store
+        self._index_tuple_list = []
+        self._archived = 0
+        self._stored = 0
+        self._raw_bytes = 0
+        self._compressed_bytes = 0
+
+    def put(self, source: str, ad_id: str, url: str, content: bytes):
+        digest, compressed_size = self._store.put(content)
+        self._index_tuple_list.append((source, ad_id, url, datetime.now().isoformat(), digest, len(content)))
+        self._archived += 1
+        if compressed_size > 0:
+            self._stored += 1
+            self._raw_bytes += len(content)
+            self._compressed_bytes += compressed_size
+
+    def get_stats(self) -> dict:
+        return {"archived": self._archived, "stored": self._stored, "raw_bytes": self._raw_bytes,
+                "compressed_bytes": self._compressed_bytes}
+
+    def on_save(self, cursor, records: list):
+        self._save_index(cursor)
+
+    def close(self):
+        if len(self._index_tuple_list) > 0:
+            with self._connection.cursor() as cursor:
+                self._save_index(cursor)
+            self._connection.commit()
+        ratio = self._raw_bytes / self._compressed_bytes if self._compressed_bytes > 0 else 0
+        logger.info(f"Archived {self._archived} responses, {self._stored} new bodies of {self._raw_bytes} bytes "
+                    f"compressed {ratio:0.1f}x")
+
+    def _save_index(self, cursor):
+        if len(self._index_tuple_list) == 0:
+            return
+        cursor.executemany(RawArchive.SAVE_INDEX_QUERY, self._index_tuple_list)
+        self._index_tuple_list = []
+
+
+class _Content:
+    """the part of a requests Response the parsers read"""
+
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+class ArchiveParser:
+    """Parses archived detail pages with the current parser of a source into the values of the save queries of its
+    storage. Used by the worker processes of reparse.py
+    """
+
+    def __init__(self, source: str, store: BlobStore):
+        self._source = source
+        self._store = store
+        self._parser = IkmanParser() if source == "ikman" else RiyasewanaParser()
+
+    def parse(self, entries: list) -> tuple:
+        """
+        :param entries: list of tuples (ad_id, url, digest)
+        :return: tuple (ad tuples, phone tuples, properties tuples, ids of the ads that failed to parse)
+        """
+        ads, phones, properties, failed = [], [], [], []
+        for ad_id, url, digest in entries:
+            try:
+                content = self._store.get(digest)
+                if self._source == "ikman":
+                    ad, ad_phones, ad_properties = self._parser.parse_detail(_Content(content))
+                    ads.append(ad)
+                    # as in IkmanStorage.queue, number is NOT NULL
+                    phones.extend(phone for phone in ad_phones if phone[PHONE_NUMBER] is not None)
+                    properties.extend(ad_properties)
+                else:
+                    ads.append(self._parser.parse_detail_content(content, ad_id, url))
+            except Exception as ex:
+                logger.warning(f"Could not parse archived {self._source} ad {ad_id}. {type(ex).__name__}: {ex}")
+                failed.append(ad_id)
+        return ads, phones, properties, failed
+
+
+_worker_parser = None
+
+
+def init_worker(source: str, directory: str):
+    """initializer of a reparse worker process"""
+    global _worker_parser
+    _worker_parser = ArchiveParser(source, BlobStore(directory))
+
+
+def parse_in_worker(entries: list) -> tuple:
+    return _worker_parser.parse(entries)
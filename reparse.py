@@ -0,0 +1,117 @@
+import argparse
+import os
+
+from multiprocessing import Pool
+from time import perf_counter
+from mysql.connector import connect, Error
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="parse the archived detail pages again with the current parsers "
+                                                      "and update the saved ads, without downloading them")
+argument_parser.add_argument("-S", "--source", choices=["ikman", "riyasewana"], action="append",
+                             help="source to parse again, can be repeated. Default both")
+argument_parser.add_argument("-W", "--workers", metavar="integer", type=int, default=os.cpu_count(),
+                             help="parser processes, default one per cpu")
+argument_parser.add_argument("-B", "--batch", metavar="integer", type=int, default=500,
+                             help="number of ads parsed by a worker and saved per transaction")
+arguments = argument_parser.parse_args()
+if arguments.workers <= 0:
+    argument_parser.error("workers must be a positive number")
+if arguments.batch <= 0:
+    argument_parser.error("batch must be a positive number")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from raw_archive import RawArchive, init_worker, parse_in_worker
+from sources.ikman.ikman_records import IkmanAd, PHONE_FIELDS, PROPERTY_FIELDS
+from sources.riyasewana.riyasewana_records import RiyasewanaAd
+
+logger = logger.get_logger("Reparse")
+
+
+def get_upsert_query(table: str, columns: tuple, key_columns: tuple) -> str:
+    """INSERT of the columns, in the order of the record fields, that updates the other columns of a saved row with the
+    same unique key of migration 0001"""
+    return f"INSERT INTO {table}({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) " \
+           f"ON DUPLICATE KEY UPDATE " \
+           f"{', '.join(f'{column} = VALUES({column})' for column in columns if column not in key_columns)}"
+
+
+# the columns are the fields of the records, as in the save queries of the storages
+UPSERT_IKMAN_QUERY: str = get_upsert_query("ad", IkmanAd._fields, ("ad_id", "datetime"))
+UPSERT_PHONE_QUERY: str = get_upsert_query("phone", PHONE_FIELDS, ("ad_id", "number"))
+UPSERT_PROPERTIES_QUERY: str = get_upsert_query("properties", PROPERTY_FIELDS, ("ad_id", "prop_key"))
+UPSERT_RIYASEWANA_QUERY: str = get_upsert_query("riyasewana_ad", RiyasewanaAd._fields, ("ad_id", "datetime"))
+
+
+def get_latest_entries(_connection, source: str) -> list:
+    """(ad_id, url, digest) of the last archived fetch of every ad of the source"""
+    latest = {}
+    with _connection.cursor() as cursor:
+        cursor.execute(RawArchive.GET_LATEST_QUERY, (source,))
+        # ordered by fetch time, a later fetch replaces an earlier one
+        for ad_id, url, digest in cursor:
+            latest[ad_id] = (ad_id, url, digest)
+    return list(latest.values())
+
+
+def reparse(_connection, source: str, directory: str) -> tuple:
+    """parses the archived pages of a source in the worker processes and saves the results in this one
+
+    :return: tuple (number of saved ads, number of ads that failed to parse, number of ads of batches that failed to
+    save)
+    """
+    entries = get_latest_entries(_connection, source)
+    logger.info(f"{source}: {len(entries)} archived ads")
+    batches = [entries[i:i + arguments.batch] for i in range(0, len(entries), arguments.batch)]
+    saved = 0
+    failed = 0
+    unsaved = 0
+    with Pool(arguments.workers, initializer=init_worker, initargs=(source, directory)) as pool:
+        for ads, phones, properties, failed_ids in pool.imap_unordered(parse_in_worker, batches):
+            failed += len(failed_ids)
+            try:
+                with _connection.cursor() as cursor:
+                    if source == "ikman":
+                        cursor.executemany(UPSERT_IKMAN_QUERY, ads)
+                        cursor.executemany(UPSERT_PHONE_QUERY, phones)
+                        cursor.executemany(UPSERT_PROPERTIES_QUERY, properties)
+                    else:
+                        cursor.executemany(UPSERT_RIYASEWANA_QUERY, ads)
+                    _connection.commit()
+            except Error as ex:
+                # the other batches are still saved
+                _connection.rollback()
+                unsaved += len(ads)
+                logger.error(f"{source}: could not save a batch of {len(ads)} ads. {ex}")
+                continue
+            saved += len(ads)
+            logger.info(f"{source}: saved {saved} ads, {failed} failed to parse, {unsaved} failed to save")
+    return saved, failed, unsaved
+
+
+config = AppConfig()
+config.parse_config_file()
+db_config = config.get_db_config()
+archive_directory = config.get_archive_config()["directory"]
+
+try:
+    connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+except Error as err:
+    logger.critical(err)
+    exit(1)
+
+try:
+    for source_name in arguments.source or ["ikman", "riyasewana"]:
+        source_start = perf_counter()
+        saved_count, failed_count, unsaved_count = reparse(connection, source_name, archive_directory)
+        elapsed = perf_counter() - source_start
+        logger.info(f"{source_name}: saved {saved_count} ads in {elapsed:0.2f} seconds "
+                    f"({saved_count / elapsed if elapsed > 0 else 0:0.0f} ads/s), {failed_count} failed to parse, "
+                    f"{unsaved_count} failed to save")
+    logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
+except KeyboardInterrupt as exc:
+    logger.warning("User abort. Saved batches are kept")
+    exit(0)
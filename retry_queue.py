@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import random
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+
+import logger
+from storage_hook import StorageHook
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("retry.queue")
+
+
+class RetryQueue(StorageHook):
+    """Keeps ads whose detail fetch failed in the fetch_retry table and hands them back for another try later.
+
+    The delay between tries doubles every attempt with some jitter. After max_attempts the ad is marked as given up and
+    left in the table for inspection. Each run retries at most budget ads.
+
+    It is a storage hook of the storage of its source: an ad leaves the table once it is committed, so an ad fetched
+    but lost in a crash before its save is tried again.
+    """
+    GET_PENDING_QUERY: str = "SELECT ad_id, url, attempts, next_attempt_at FROM fetch_retry WHERE source = %s AND " \
+                             "gave_up = 0 ORDER BY next_attempt_at"
+    SAVE_RETRY_QUERY: str = "INSERT INTO fetch_retry(source, ad_id, url, error_class, attempts, next_attempt_at, " \
+                            "gave_up) VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE error_class = " \
+                            "VALUES(error_class), attempts = VALUES(attempts), next_attempt_at = " \
+                            "VALUES(next_attempt_at), gave_up = VALUES(gave_up)"
+    DELETE_RETRY_QUERY: str = "DELETE FROM fetch_retry WHERE source = %s AND ad_id = %s"
+
+    def __init__(self, connection: MySQLConnection, source: str, max_attempts: int, budget: int, base_delay: int,
+                 max_delay: int):
+        self._connection = connection
+        self._source = source
+        self._MAX_ATTEMPTS = max_attempts
+        self._BUDGET = budget
+        self._BASE_DELAY = base_delay
+        self._MAX_DELAY = max_delay
+        # ad id -> [url, attempts, next attempt at]
+        self._pending = {}
+        self._get_pending()
+
+    def get_due(self) -> list:
+        """ads due for another try, at most budget of them
+
+        :return: list of tuples (ad_id, url)
+        """
+        now = datetime.now()
+        due = [(ad_id, entry[0]) for ad_id, entry in self._pending.items() if entry[2] <= now]
+        if len(due) > self._BUDGET:
+            logger.info(f"{len(due)} ads due for retry, retrying {self._BUDGET} in this run")
+        return due[:self._BUDGET]
+
+    def defer(self, ad_id: str, url: str, ex: Exception):
+        """schedules another try of a failed ad or gives up after max_attempts"""
+        entry = self._pending.get(ad_id, [url, 0, None])
+        attempts = entry[1] + 1
+        gave_up = attempts >= self._MAX_ATTEMPTS
+        delay = min(self._MAX_DELAY, self._BASE_DELAY * 2 ** (attempts - 1)) * random.uniform(0.5, 1.5)
+        next_attempt_at = (datetime.now() + timedelta(seconds=delay)).replace(microsecond=0)
+        with self._connection.cursor() as cursor:
+            cursor.execute(RetryQueue.SAVE_RETRY_QUERY, (self._source, ad_id, url, type(ex).__name__, attempts,
+                                                         next_attempt_at, 1 if gave_up else 0))
+            self._connection.commit()
+        if gave_up:
+            self._pending.pop(ad_id, None)
+            logger.warning(f"Giving up on ad {ad_id} after {attempts} attempts ({type(ex).__name__})")
+        else:
+            self._pending[ad_id] = [url, attempts, next_attempt_at]
+            logger.info(f"Ad {ad_id} failed with {type(ex).__name__}, attempt {attempts}/{self._MAX_ATTEMPTS}. "
+                        f"Next try after {next_attempt_at}")
+
+    def on_commit(self, records: list):
+        self.resolve([record["ad_id"] for record in records if record["source"] == self._source])
+
+    def resolve(self, ad_ids: list):
+        """removes ads that are saved"""
+        ad_ids = [ad_id for ad_id in ad_ids if ad_id in self._pending]
+        if len(ad_ids) == 0:
+            return
+        with self._connection.cursor() as cursor:
+            cursor.executemany(RetryQueue.DELETE_RETRY_QUERY, [(self._source, ad_id) for ad_id in ad_ids])
+            self._connection.commit()
+        for ad_id in ad_ids:
+            del self._pending[ad_id]
+            logger.info(f"Ad {ad_id} saved, removed from retry queue")
+
+    def _get_pending(self):
+        with self._connection.cursor() as cursor:
+            cursor.execute(RetryQueue.GET_PENDING_QUERY, (self._source,))
+            for ad_id, url, attempts, next_attempt_at in cursor.fetchall():
+                self._pending[ad_id] = [url, attempts, next_attempt_at]
+        logger.info(f"{len(self._pending)} ads waiting for retry")
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+from typing import TYPE_CHECKING
+
+import logger
+
+if TYPE_CHECKING:
+    from scheduler import PollScheduler
+
+logger = logger.get_logger("run.planner")
+
+
+class RunPlanner:
+    """Estimates the requests and duration of a run and splits a request or time budget across the sources.
+
+    After every agent run the requests, duration, list pages, new ads and pagination totals of the source are blended
+    into its history: seconds per request (politeness wait and latency), detail requests per list page and new ads per
+    request. The history is written to a json file like the poll history.
+
+    A budget is shared out by water filling: every source gets a share of weight (yield floor + new ads per request),
+    sources that need less than their share get what they need and the rest is shared again among the others. The
+    requests a source gets, less a list page per details_per_page ads rounded up, become its fetch limit. Pages of
+    ads that are saved already cost requests too, so a run can still send a few more requests than its budget.
+    """
+    YIELD_FLOOR = 0.1
+    ALPHA = 0.3
+    DEFAULT_DETAILS_PER_PAGE = 20
+
+    def __init__(self, history_file: str, default_seconds_per_request: float):
+        self._HISTORY_FILE = history_file
+        self._DEFAULT_SECONDS_PER_REQUEST = default_seconds_per_request
+        self._history = {}
+        self._load()
+
+    def record_run(self, source: str, requests: int, seconds: float, run_stats: dict):
+        """blends a finished agent run into the history of the source
+
+        :param source: source name
+        :param requests: requests sent by the run, retries of deferred ads included
+        :param seconds: duration of the run
+        :param run_stats: feed totals of the run. See FeedScheduler.get_run_stats
+        """
+        entry = self._get_entry(source)
+        if requests > 0:
+            self._blend(entry, "seconds_per_request", seconds / requests)
+        pages = run_stats["pages"]
+        if pages > 0:
+            self._blend(entry, "details_per_page", (run_stats["requests"] - pages) / pages)
+        if run_stats["requests"] > 0:
+            self._blend(entry, "yield", run_stats["new_ads"] / run_stats["requests"])
+        if run_stats["total_pages"] > 0:
+            entry["total_pages"] = run_stats["total_pages"]
+        if run_stats["total_ads"] > 0:
+            entry["total_ads"] = run_stats["total_ads"]
+        self._save()
+
+    def estimate(self, source: dict, scheduler: PollScheduler) -> dict:
+        """ads, list pages, requests and seconds the next run of the source is expected to take with its limit
+
+        ads, requests and seconds are None when there is nothing to bound the run yet: fetching all ads without a limit
+        before the total of the source was seen once
+        """
+        name = source["NAME"]
+        entry = self._get_entry(name)
+        limit = source["FETCH_LIMIT"]
+        details_per_page = self._get_details_per_page(entry)
+        seconds_per_request = self._get_seconds_per_request(entry)
+        if source["FETCH_TYPE"] == "new":
+            expected = scheduler.get_fetch_limit(name)
+            if expected is None:
+                expected = limit if limit > 0 else math.ceil(details_per_page)
+            ads = min(limit, expected) if limit > 0 else expected
+        else:
+            ads = limit if limit > 0 else entry["total_ads"]
+            if limit > 0 and entry["total_ads"] is not None:
+                ads = min(limit, entry["total_ads"])
+        estimate = {"name": name, "fetch_type": source["FETCH_TYPE"], "limit": limit, "ads": ads, "pages": None,
+                    "requests": None, "seconds": None, "seconds_per_request": seconds_per_request,
+                    "details_per_page": details_per_page, "yield": entry["yield"]}
+        if ads is not None:
+            pages = max(1, math.ceil(ads / details_per_page))
+            if limit == 0 and source["FETCH_TYPE"] == "all" and entry["total_pages"] is not None:
+                pages = entry["total_pages"]
+            estimate["pages"] = pages
+            estimate["requests"] = ads + pages
+            estimate["seconds"] = estimate["requests"] * seconds_per_request
+        return estimate
+
+    def allocate(self, estimates: list, request_budget: int = None, time_budget: float = None) -> list:
+        """splits the budget across the estimated runs and sets the fetch limit each source can afford
+
+        :param estimates: estimates of the sources. Updated with the keys budget_requests, budget_seconds and plan_limit
+        :param request_budget: total requests of the run
+        :param time_budget: total seconds of the run, the sources run one after another
+        :return: the estimates
+        """
+        # cost of one request in budget units. Requests are free in a time budget without politeness wait or history,
+        # such sources take nothing from the budget and keep their own limit
+        costs = [1.0 if time_budget is None else estimate["seconds_per_request"] for estimate in estimates]
+        demands = [0.0 if cost <= 0 else estimate["requests"] * cost if estimate["requests"] is not None else math.inf
+                   for estimate, cost in zip(estimates, costs)]
+        weights = [RunPlanner.YIELD_FLOOR + (estimate["yield"] if estimate["yield"] is not None else 1.0)
+                   for estimate in estimates]
+        grants = [0.0] * len(estimates)
+        remaining = float(request_budget if time_budget is None else time_budget)
+        open_indexes = set(range(len(estimates)))
+        while len(open_indexes) > 0:
+            total_weight = sum(weights[i] for i in open_indexes)
+            satisfied = {i for i in open_indexes if demands[i] <= remaining * weights[i] / total_weight}
+            if len(satisfied) == 0:
+                for i in open_indexes:
+                    grants[i] = remaining * weights[i] / total_weight
+                break
+            for i in satisfied:
+                grants[i] = demands[i]
+                remaining -= demands[i]
+            open_indexes -= satisfied
+
+        for estimate, cost, grant in zip(estimates, costs, grants):
+            if cost <= 0:
+                estimate["budget_requests"] = estimate["requests"]
+                estimate["budget_seconds"] = 0.0
+                estimate["plan_limit"] = estimate["limit"]
+                continue
+            requests = grant / cost
+            estimate["budget_requests"] = math.floor(requests)
+            estimate["budget_seconds"] = requests * estimate["seconds_per_request"]
+            estimate["plan_limit"] = self._get_plan_limit(requests, estimate["details_per_page"])
+        return estimates
+
+    @staticmethod
+    def _get_plan_limit(requests: float, details_per_page: float) -> int:
+        """most ads whose detail requests and list pages, rounded up, fit in the requests. At least 1, 0 would mean no
+        limit"""
+        limit = math.floor(requests * details_per_page / (details_per_page + 1))
+        while limit > 1 and limit + math.ceil(limit / details_per_page) > requests:
+            limit -= 1
+        return max(1, limit)
+
+    @staticmethod
+    def log_plan(estimates: list):
+        for estimate in estimates:
+            fetch = "new ads" if estimate["fetch_type"] == "new" else "all ads"
+            rates = f"{estimate['seconds_per_request']:0.2f} s/request, {estimate['details_per_page']:0.1f} ads/page"
+            if estimate["yield"] is not None:
+                rates += f", {estimate['yield']:0.2f} new ads/request"
+            if estimate["requests"] is None:
+                logger.info(f"{estimate['name']}: {fetch}, limit {estimate['limit']}. Size unknown until the source "
+                            f"was fetched once ({rates})")
+            else:
+                logger.info(f"{estimate['name']}: {fetch}, limit {estimate['limit']}. About {estimate['ads']} ads, "
+                            f"{estimate['pages']} list pages, {estimate['requests']} requests in "
+                            f"{estimate['seconds']:0.0f} seconds ({rates})")
+            if "plan_limit" in estimate and estimate["budget_seconds"] == 0 and estimate["plan_limit"] == estimate["limit"]:
+                logger.info(f"{estimate['name']}: requests take no time by the history, limit {estimate['limit']} is "
+                            f"kept")
+            elif "plan_limit" in estimate:
+                logger.info(f"{estimate['name']}: budget of {estimate['budget_requests']} requests, "
+                            f"{estimate['budget_seconds']:0.0f} seconds. Limit {estimate['plan_limit']}")
+        known = [estimate for estimate in estimates if estimate["requests"] is not None]
+        logger.info(f"Estimated run: {sum(estimate['requests'] for estimate in known)} requests in "
+                    f"{sum(estimate['seconds'] for estimate in known):0.0f} seconds"
+                    f"{'' if len(known) == len(estimates) else ' and sources of unknown size'}")
+
+    def _blend(self, entry: dict, key: str, value: float):
+        if entry[key] is None:
+            entry[key] = value
+        else:
+            entry[key] += RunPlanner.ALPHA * (value - entry[key])
+
+    def _get_details_per_page(self, entry: dict) -> float:
+        if entry["details_per_page"] is None or entry["details_per_page"] <= 0:
+            return RunPlanner.DEFAULT_DETAILS_PER_PAGE
+        return entry["details_per_page"]
+
+    def _get_seconds_per_request(self, entry: dict) -> float:
+        if entry["seconds_per_request"] is None:
+            return self._DEFAULT_SECONDS_PER_REQUEST
+        return entry["seconds_per_request"]
+
+    def _get_entry(self, source: str) -> dict:
+        if source not in self._history:
+            self._history[source] = {"seconds_per_request": None, "details_per_page": None, "yield": None,
+                                     "total_pages": None, "total_ads": None}
+        return self._history[source]
+
+    def _load(self):
+        if not os.path.exists(self._HISTORY_FILE):
+            logger.info(f"No run history found at {self._HISTORY_FILE}")
+            return
+        try:
+            with open(self._HISTORY_FILE) as file:
+                self._history = json.load(file)
+            logger.info(f"Loaded run history for {list(self._history.keys())}")
+        except (ValueError, OSError) as ex:
+            logger.warning(f"Could not read run history, starting fresh. {ex}")
+            self._history = {}
+
+    def _save(self):
+        tmp_file = self._HISTORY_FILE + ".tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(self._history, file, indent=2)
+        os.replace(tmp_file, self._HISTORY_FILE)
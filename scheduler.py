@@ -0,0 +1,181 @@
+import json
+import math
+import os
+from datetime import datetime, timedelta
+
+import logger
+
+logger = logger.get_logger("scheduler")
+
+
+class PollScheduler:
+    """Learns the posting rate of each source by hour of day and suggests when to poll next and how many ads to fetch.
+
+    Every 'new' fetch cycle reports how many new ads a list page contained. At the end of a run the total is turned
+    into a rate (ads per hour) and blended into the hour of day buckets the run covered. The history is written to a
+    json file so the estimate survives restarts.
+    """
+    HOURS = 24
+
+    def __init__(self, history_file: str, min_interval: int, max_interval: int, default_interval: int):
+        self._HISTORY_FILE = history_file
+        self._MIN_INTERVAL = min_interval
+        self._MAX_INTERVAL = max_interval
+        self._DEFAULT_INTERVAL = default_interval
+        self._SMOOTHING = 0.3
+        self._LIMIT_HEADROOM = 1.5
+
+        self._history = {}
+        # new ads found per source in the current run
+        self._cycle_counts = {}
+        self._load()
+
+    def record_cycle(self, source: str, page_size: int, new_count: int):
+        """records the result of one filter_list_new cycle
+
+        :param source: source name
+        :param page_size: number of ads listed in the page
+        :param new_count: number of new ads found in the page
+        """
+        entry = self._get_entry(source)
+        if page_size > 0:
+            entry["page_size"] = page_size
+        self._cycle_counts[source] = self._cycle_counts.get(source, 0) + new_count
+        logger.info(f"{source}: {new_count} new ads in cycle, {self._cycle_counts[source]} in this run")
+
+    def finish_run(self, source: str, complete: bool, _now: datetime = None):
+        """fits the observed posting rate of the run and stores the next poll time
+
+        :param source: source name
+        :param complete: False when the run stopped before reaching the latest local ad. The observed count is then
+         only a lower bound of the real number of new ads
+        :param _now:
+        """
+        now = _now if _now is not None else datetime.now()
+        entry = self._get_entry(source)
+        new_count = self._cycle_counts.pop(source, 0)
+
+        if entry["last_poll"] is not None:
+            last_poll = datetime.fromisoformat(entry["last_poll"])
+            elapsed_hours = (now - last_poll).total_seconds() / 3600
+            if elapsed_hours > 0:
+                self._update_rates(entry, last_poll, now, new_count / elapsed_hours, complete)
+        else:
+            logger.info(f"{source}: first recorded poll, no posting rate to fit yet")
+
+        entry["last_poll"] = now.isoformat()
+        entry["next_poll"] = (now + timedelta(seconds=self._next_poll_delay(entry, now))).isoformat()
+        logger.info(f"{source}: next poll at {entry['next_poll']}")
+        self._save()
+
+    def is_due(self, source: str, _now: datetime = None) -> bool:
+        now = _now if _now is not None else datetime.now()
+        entry = self._get_entry(source)
+        if entry["next_poll"] is None:
+            return True
+        return now >= datetime.fromisoformat(entry["next_poll"])
+
+    def get_seconds_until_due(self, source: str, _now: datetime = None) -> float:
+        now = _now if _now is not None else datetime.now()
+        entry = self._get_entry(source)
+        if entry["next_poll"] is None:
+            return 0
+        return max(0.0, (datetime.fromisoformat(entry["next_poll"]) - now).total_seconds())
+
+    def get_fetch_limit(self, source: str, _now: datetime = None):
+        """expected number of new ads since the last poll with some headroom. Never less than one page
+
+        :return: fetch limit or None when the posting rate of the source is not known yet
+        """
+        now = _now if _now is not None else datetime.now()
+        entry = self._get_entry(source)
+        page_size = entry["page_size"]
+        if entry["last_poll"] is None or not self._has_rates(entry):
+            return None
+        expected = self._expected_ads(entry, datetime.fromisoformat(entry["last_poll"]), now)
+        return max(page_size, math.ceil(expected * self._LIMIT_HEADROOM))
+
+    def _update_rates(self, entry: dict, start: datetime, end: datetime, rate: float, complete: bool):
+        # blend the rate into every hour bucket the interval overlaps, weighted by the overlap
+        rates = entry["rates"]
+        total_seconds = (end - start).total_seconds()
+        for hour, seconds in self._hour_overlaps(start, end):
+            weight = self._SMOOTHING * seconds / min(total_seconds, 3600)
+            weight = min(weight, 1.0)
+            if rates[hour] is None:
+                rates[hour] = rate
+            elif complete:
+                rates[hour] += weight * (rate - rates[hour])
+            elif rate > rates[hour]:
+                # lower bound only. never lowers the estimate
+                rates[hour] += weight * (rate - rates[hour])
+        logger.info(f"Observed posting rate {rate:0.2f} ads/hour ({'complete' if complete else 'lower bound'})")
+
+    def _next_poll_delay(self, entry: dict, now: datetime) -> float:
+        """seconds until about one page of new ads is expected"""
+        if not self._has_rates(entry):
+            return self._DEFAULT_INTERVAL
+        target = entry["page_size"]
+        expected = 0.0
+        cursor = now
+        limit = now + timedelta(seconds=self._MAX_INTERVAL)
+        while cursor < limit:
+            hour_end = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            step_end = min(hour_end, limit)
+            rate = self._get_rate(entry, cursor.hour)
+            step_hours = (step_end - cursor).total_seconds() / 3600
+            if rate > 0 and expected + rate * step_hours >= target:
+                delay = (cursor - now).total_seconds() + (target - expected) / rate * 3600
+                return min(max(delay, self._MIN_INTERVAL), self._MAX_INTERVAL)
+            expected += rate * step_hours
+            cursor = step_end
+        return self._MAX_INTERVAL
+
+    def _expected_ads(self, entry: dict, start: datetime, end: datetime) -> float:
+        expected = 0.0
+        for hour, seconds in self._hour_overlaps(start, end):
+            expected += self._get_rate(entry, hour) * seconds / 3600
+        return expected
+
+    def _get_rate(self, entry: dict, hour: int) -> float:
+        rate = entry["rates"][hour]
+        if rate is None:
+            # unknown hour. use the average of the known hours
+            known = [r for r in entry["rates"] if r is not None]
+            return sum(known) / len(known) if len(known) > 0 else 0.0
+        return rate
+
+    def _has_rates(self, entry: dict) -> bool:
+        return any(rate is not None for rate in entry["rates"])
+
+    def _hour_overlaps(self, start: datetime, end: datetime):
+        cursor = start
+        while cursor < end:
+            hour_end = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            step_end = min(hour_end, end)
+            yield cursor.hour, (step_end - cursor).total_seconds()
+            cursor = step_end
+
+    def _get_entry(self, source: str) -> dict:
+        if source not in self._history:
+            self._history[source] = {"last_poll": None, "next_poll": None, "page_size": 1,
+                                     "rates": [None] * PollScheduler.HOURS}
+        return self._history[source]
+
+    def _load(self):
+        if not os.path.exists(self._HISTORY_FILE):
+            logger.info(f"No poll history found at {self._HISTORY_FILE}")
+            return
+        try:
+            with open(self._HISTORY_FILE) as file:
+                self._history = json.load(file)
+            logger.info(f"Loaded poll history for {list(self._history.keys())}")
+        except (ValueError, OSError) as ex:
+            logger.warning(f"Could not read poll history, starting fresh. {ex}")
+            self._history = {}
+
+    def _save(self):
+        tmp_file = self._HISTORY_FILE + ".tmp"
+        with open(tmp_file, "w") as file:
+            json.dump(self._history, file, indent=2)
+        os.replace(tmp_file, self._HISTORY_FILE)
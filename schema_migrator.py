@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import os
+import re
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+import logger
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("schema.migrator")
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+class Migration:
+    def __init__(self, version: int, name: str, path: str):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def get_checksum(self) -> str:
+        with open(self.path, "rb") as file:
+            return hashlib.sha256(file.read()).hexdigest()
+
+
+class SchemaMigrator:
+    """Applies the files of the migrations directory that are not applied yet, in version order, and records each in
+    the schema_migrations table.
+
+    Files are named <version>_<name>.sql or <version>_<name>.py. A .sql file is a list of statements that end with ';'
+    at the end of a line. A .py file has a function upgrade(connection) for changes that depend on the data. A
+    database imported from motorcycle_db.sql has no migration applied, version 0 is the first one.
+
+    MySQL commits every DDL statement on its own, so a migration that fails halfway is not rolled back and is not
+    recorded. The statements that did run have to be undone by hand before it is run again.
+    """
+    CREATE_TABLE_QUERY: str = "CREATE TABLE IF NOT EXISTS `schema_migrations` (" \
+                              "`version` int(10) UNSIGNED NOT NULL PRIMARY KEY, " \
+                              "`name` varchar(255) COLLATE utf8mb4_unicode_520_ci NOT NULL, " \
+                              "`checksum` char(64) COLLATE utf8mb4_unicode_520_ci NOT NULL, " \
+                              "`duration_ms` int(10) UNSIGNED NOT NULL, " \
+                              "`applied_at` datetime NOT NULL DEFAULT CURRENT_TIMESTAMP" \
+                              ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_520_ci"
+    HAS_TABLE_QUERY: str = "SHOW TABLES LIKE 'schema_migrations'"
+    GET_APPLIED_QUERY: str = "SELECT version, checksum FROM schema_migrations ORDER BY version"
+    RECORD_QUERY: str = "INSERT INTO schema_migrations(version, name, checksum, duration_ms) VALUES (%s, %s, %s, %s)"
+
+    _FILE_PATTERN = re.compile("^(\\d+)_(\\w+)\\.(sql|py)$")
+
+    def __init__(self, connection: MySQLConnection, directory: str = MIGRATIONS_DIR):
+        self._connection = connection
+        self._DIRECTORY = directory
+
+    def get_migrations(self) -> list:
+        """migrations found in the directory, lowest version first"""
+        migrations = {}
+        for file_name in os.listdir(self._DIRECTORY):
+            match = SchemaMigrator._FILE_PATTERN.match(file_name)
+            if match is None:
+                continue
+            version = int(match.group(1))
+            if version in migrations:
+                raise ValueError(f"Two migrations with version {version}: {migrations[version].path}, {file_name}")
+            migrations[version] = Migration(version, match.group(2), os.path.join(self._DIRECTORY, file_name))
+        return [migrations[version] for version in sorted(migrations)]
+
+    def get_applied(self) -> dict:
+        """version -> checksum of the applied migrations. Empty when schema_migrations does not exist yet"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(SchemaMigrator.HAS_TABLE_QUERY)
+            if len(cursor.fetchall()) == 0:
+                return {}
+            cursor.execute(SchemaMigrator.GET_APPLIED_QUERY)
+            return {version: checksum for version, checksum in cursor.fetchall()}
+
+    def get_pending(self) -> list:
+        applied = self.get_applied()
+        migrations = self.get_migrations()
+        for migration in migrations:
+            if migration.version in applied and applied[migration.version] != migration.get_checksum():
+                logger.warning(f"Migration {migration.version} {migration.name} changed after it was applied")
+        return [migration for migration in migrations if migration.version not in applied]
+
+    def migrate(self, target: int = None) -> int:
+        """applies the pending migrations up to and including version target, all when target is None
+
+        :return: number of applied migrations
+        """
+        with self._connection.cursor() as cursor:
+            cursor.execute(SchemaMigrator.CREATE_TABLE_QUERY)
+        count = 0
+        for migration in self.get_pending():
+            if target is not None and migration.version > target:
+                break
+            self._apply(migration)
+            count += 1
+        return count
+
+    def _apply(self, migration: Migration):
+        logger.info(f"Applying migration {migration.version} {migration.name}")
+        start = perf_counter()
+        if migration.path.endswith(".py"):
+            spec = importlib.util.spec_from_file_location(f"migration_{migration.version}", migration.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            module.upgrade(self._connection)
+        else:
+            with self._connection.cursor() as cursor:
+                for statement in self._read_statements(migration.path):
+                    cursor.execute(statement)
+        duration_ms = int((perf_counter() - start) * 1000)
+        with self._connection.cursor() as cursor:
+            cursor.execute(SchemaMigrator.RECORD_QUERY,
+                           (migration.version, migration.name, migration.get_checksum(), duration_ms))
+        self._connection.commit()
+        logger.info(f"Applied migration {migration.version} {migration.name} in {duration_ms / 1000:0.1f} seconds")
+
+    @staticmethod
+    def _read_statements(path: str) -> list:
+        """statements of a .sql migration without the '--' comment lines"""
+        statements = []
+        lines = []
+        with open(path) as file:
+            for line in file:
+                stripped = line.strip()
+                if stripped == "" or stripped.startswith("--"):
+                    continue
+                lines.append(line.rstrip())
+                if stripped.endswith(";"):
+                    statements.append("\n".join(lines)[:-1])
+                    lines = []
+        if len(lines) > 0:
+            statements.append("\n".join(lines))
+        return statements
@@ -0,0 +1,67 @@
+import argparse
+
+from time import perf_counter
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="search the titles, descriptions, makes, models and locations of "
+                                                      "the saved ads of both sources")
+argument_parser.add_argument("words", metavar="word", nargs="*", help="words that must all be in an ad")
+argument_parser.add_argument("-S", "--source", choices=["ikman", "riyasewana"], help="search the ads of one source")
+argument_parser.add_argument("-L", "--limit", metavar="integer", type=int, default=20,
+                             help="number of ads to log, default 20")
+argument_parser.add_argument("--max-price", metavar="integer", type=int, help="leave out ads priced higher")
+argument_parser.add_argument("--min-yom", metavar="year", type=int, help="leave out ads of older bikes")
+argument_parser.add_argument("--sync", action="store_true",
+                             help="add the ads that are not indexed yet first, the ads saved while SEARCH.ENABLED "
+                                  "was off")
+argument_parser.add_argument("-B", "--batch", metavar="integer", type=int, default=1000,
+                             help="number of ads read per query by --sync, default 1000")
+arguments = argument_parser.parse_args()
+if len(arguments.words) == 0 and not arguments.sync:
+    argument_parser.error("give the words to search for, or --sync")
+if arguments.limit <= 0:
+    argument_parser.error("limit must be a positive number")
+if arguments.batch <= 0:
+    argument_parser.error("batch must be a positive number")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from search_index import SearchIndex
+
+logger = logger.get_logger("Search")
+
+config = AppConfig()
+config.parse_config_file()
+search_config = config.get_search_config()
+
+index = SearchIndex(search_config["path"], search_config["synonyms"])
+try:
+    if arguments.sync:
+        from mysql.connector import connect, Error
+
+        db_config = config.get_db_config()
+        try:
+            connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+        except Error as err:
+            logger.critical(err)
+            exit(1)
+        for source_name in [arguments.source] if arguments.source is not None else ["ikman", "riyasewana"]:
+            index.sync(connection, source_name, arguments.batch)
+    if len(arguments.words) > 0:
+        text = " ".join(arguments.words)
+        query_start = perf_counter()
+        ads = index.search(text, arguments.limit, arguments.source, arguments.max_price, arguments.min_yom)
+        query_seconds = perf_counter() - query_start
+        for ad in ads:
+            price = f"{ad['price']:,}" if ad["price"] is not None else "-"
+            logger.info(f"{ad['source']} ad {ad['ad_id']}: {ad['make']} {ad['model']} {ad['yom']}, price {price}, "
+                        f"posted {ad['posted']}: {ad['snippet']}")
+        logger.info(f"{len(ads)} ads for '{text}' ({index.build_query(text)}) in {query_seconds * 1000:0.1f} ms")
+    logger.info(f"{len(index)} ads indexed. Finished in {perf_counter() - start:0.2f} seconds")
+except KeyboardInterrupt as exc:
+    logger.warning("User abort. Exiting...")
+    exit(0)
+finally:
+    index.close()
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+from typing import TYPE_CHECKING
+
+import logger
+from storage_hook import StorageHook
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("search")
+
+# words that mean the same in an ad. A query for any of them finds ads with any of them
+SYNONYMS = [["motorcycle", "motorbike", "bike", "motorcycles", "motorbikes", "bikes"],
+            ["scooter", "scooty", "scooters"],
+            ["pulsar", "pulser"],
+            ["discover", "discovery"],
+            ["hornet", "honet"],
+            ["km", "kms", "kilometers", "kilometres"],
+            ["new", "brandnew"],
+            ["recondition", "reconditioned", "recon"]]
+
+_TOKEN_PATTERN = re.compile("[^\\W_]+")
+
+
+def get_tokens(text) -> list:
+    """lower case words and numbers of a text, about the tokens of the fts5 unicode61 tokenizer"""
+    if text is None:
+        return []
+    return _TOKEN_PATTERN.findall(str(text).lower())
+
+
+def compact_tokens(tokens: list) -> list:
+    """joins a word and the number after it, so 'CD 125' and 'CD125' both give 'cd125'"""
+    compacted = []
+    for token in tokens:
+        if len(compacted) > 0 and token.isdigit() and compacted[-1].isalpha():
+            compacted[-1] += token
+        else:
+            compacted.append(token)
+    return compacted
+
+
+class SearchIndex(StorageHook):
+    """Full-text index of the titles, descriptions, makes, models and locations of the ads of both sources in a SQLite
+    FTS5 database next to MySQL, which has no FULLTEXT indexes on the partitioned ad tables.
+
+    Ads are added after every committed save and ranked by BM25 with the title, make and model weighed above the
+    description. The sync watermark of a source moves along with the saves as long as every stored ad before them is
+    indexed, so sync only adds the ads stored while the index was off. Model names are also indexed with their number joined to the word before it, and query words are
+    expanded with their SYNONYMS, so 'cd 125 bike' finds 'Honda CD125 motorcycle'.
+    """
+    # bm25 weights of the ad_text columns title, description, make_model, location, terms
+    RANK = "bm25(10.0, 1.0, 5.0, 2.0, 10.0)"
+
+    CREATE_QUERIES: tuple = (
+        "CREATE TABLE IF NOT EXISTS ad_doc(rowid INTEGER PRIMARY KEY, source TEXT NOT NULL, ad_id TEXT NOT NULL, "
+        "make TEXT, model TEXT, yom INTEGER, price INTEGER, posted TEXT, UNIQUE(source, ad_id))",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS ad_text USING fts5(title, description, make_model, location, terms, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '3')",
+        "CREATE TABLE IF NOT EXISTS sync_watermark(source TEXT PRIMARY KEY, primary_id INTEGER NOT NULL)")
+    SET_RANK_QUERY: str = "INSERT INTO ad_text(ad_text, rank) VALUES ('rank', ?)"
+    SAVE_DOC_QUERY: str = "INSERT INTO ad_doc(source, ad_id, make, model, yom, price, posted) " \
+                          "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(source, ad_id) DO UPDATE SET make = excluded.make, " \
+                          "model = excluded.model, yom = excluded.yom, price = excluded.price, posted = excluded.posted"
+    GET_ROWID_QUERY: str = "SELECT rowid FROM ad_doc WHERE source = ? AND ad_id = ?"
+    DELETE_TEXT_QUERY: str = "DELETE FROM ad_text WHERE rowid = ?"
+    SAVE_TEXT_QUERY: str = "INSERT INTO ad_text(rowid, title, description, make_model, location, terms) " \
+                           "VALUES (?, ?, ?, ?, ?, ?)"
+    SEARCH_QUERY: str = "SELECT d.source, d.ad_id, d.make, d.model, d.yom, d.price, d.posted, " \
+                        "snippet(ad_text, -1, '[', ']', '...', 10), rank FROM ad_text JOIN ad_doc d " \
+                        "ON d.rowid = ad_text.rowid WHERE ad_text MATCH ?{} ORDER BY rank LIMIT ?"
+    COUNT_QUERY: str = "SELECT COUNT(*) FROM ad_doc"
+    GET_WATERMARK_QUERY: str = "SELECT primary_id FROM sync_watermark WHERE source = ?"
+    SAVE_WATERMARK_QUERY: str = "INSERT INTO sync_watermark(source, primary_id) VALUES (?, ?) " \
+                                "ON CONFLICT(source) DO UPDATE SET primary_id = excluded.primary_id"
+    SYNC_QUERIES: dict = {
+        "ikman": "SELECT primary_id, ad_id, title, description, make, model, yom, price_value, location, datetime "
+                 "FROM ad WHERE primary_id > %s ORDER BY primary_id LIMIT %s",
+        "riyasewana": "SELECT primary_id, ad_id, title, details, make, model, yom, price_value, location, datetime "
+                      "FROM riyasewana_ad WHERE primary_id > %s ORDER BY primary_id LIMIT %s"}
+    TABLES: dict = {"ikman": "ad", "riyasewana": "riyasewana_ad"}
+    GET_ID_RANGE_QUERY: str = "SELECT MIN(primary_id), MAX(primary_id) FROM {} WHERE ad_id IN ({})"
+    COUNT_BETWEEN_QUERY: str = "SELECT COUNT(*) FROM {} WHERE primary_id > %s AND primary_id < %s"
+
+    def __init__(self, path: str, synonyms: list = None):
+        """
+        :param path: sqlite database file, created when it does not exist
+        :param synonyms: groups of words that mean the same, in addition to SYNONYMS
+        """
+        directory = os.path.dirname(path)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        # readers such as search_ads.py do not block the aggregator and the other way round
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        for query in SearchIndex.CREATE_QUERIES:
+            self._connection.execute(query)
+        self._connection.execute(SearchIndex.SET_RANK_QUERY, (SearchIndex.RANK,))
+        self._connection.commit()
+        # word -> words it stands for, itself included
+        self._synonyms = {}
+        for group in SYNONYMS + (synonyms or []):
+            words = [word for term in group for word in compact_tokens(get_tokens(term))]
+            for word in words:
+                variants = self._synonyms.setdefault(word, [word])
+                for other in words:
+                    if other not in variants:
+                        variants.append(other)
+        self._indexed = 0
+        # source -> highest primary id of the save being committed, when no ad before it is missing from the index
+        self._pending_watermarks = {}
+
+    def __len__(self):
+        return self._connection.execute(SearchIndex.COUNT_QUERY).fetchone()[0]
+
+    def on_save(self, cursor, records: list):
+        self._pending_watermarks = {}
+        ad_ids = {}
+        for record in records:
+            ad_ids.setdefault(record["source"], []).append(str(record["ad_id"]))
+        for source, ids in ad_ids.items():
+            if source not in SearchIndex.TABLES:
+                continue
+            table = SearchIndex.TABLES[source]
+            cursor.execute(SearchIndex.GET_ID_RANGE_QUERY.format(table, ", ".join(["%s"] * len(ids))), ids)
+            first, last = cursor.fetchall()[0]
+            watermark = self._get_watermark(source)
+            if last is None or last <= watermark:
+                continue
+            # ads stored between the watermark and this save, e.g. while the index was off, are left to sync
+            cursor.execute(SearchIndex.COUNT_BETWEEN_QUERY.format(table), (watermark, first))
+            if cursor.fetchall()[0][0] == 0:
+                self._pending_watermarks[source] = last
+
+    def on_commit(self, records: list):
+        self.add(records)
+        for source, last in self._pending_watermarks.items():
+            self._connection.execute(SearchIndex.SAVE_WATERMARK_QUERY, (source, last))
+        self._connection.commit()
+        self._pending_watermarks = {}
+        logger.info(f"Indexed {self._indexed} ads for search")
+
+    def close(self):
+        self._connection.close()
+
+    def add(self, records: list):
+        """adds or replaces the ads of storage hook records and commits"""
+        cursor = self._connection.cursor()
+        for record in records:
+            cursor.execute(SearchIndex.SAVE_DOC_QUERY,
+                           (record["source"], str(record["ad_id"]), record.get("make"), record.get("model"),
+                            record.get("yom"), record.get("price"),
+                            None if record.get("datetime") is None else str(record["datetime"])))
+            # lastrowid is not set when the ad was indexed before
+            rowid = cursor.execute(SearchIndex.GET_ROWID_QUERY, (record["source"], str(record["ad_id"]))).fetchone()[0]
+            cursor.execute(SearchIndex.DELETE_TEXT_QUERY, (rowid,))
+            make_model = " ".join(str(record[key]) for key in ("make", "model") if record.get(key) is not None)
+            cursor.execute(SearchIndex.SAVE_TEXT_QUERY,
+                           (rowid, record.get("title"), record.get("description"), make_model, record.get("location"),
+                            self._get_terms(record.get("title"), make_model)))
+            self._indexed += 1
+        self._connection.commit()
+
+    def search(self, text: str, limit: int = 20, source: str = None, max_price: int = None,
+               min_yom: int = None) -> list:
+        """best matching ads of a keyword query, best first
+
+        :param text: words that must all be in an ad, each or one of its synonyms. The last word of 3 or more letters
+            may also be the start of a word
+        :return: list of dicts with source, ad_id, make, model, yom, price, posted, snippet and score (lower is better)
+        """
+        query = self.build_query(text)
+        if query is None:
+            return []
+        conditions = ""
+        params = [query]
+        for condition, value in ((" AND d.source = ?", source), (" AND d.price <= ?", max_price),
+                                 (" AND d.yom >= ?", min_yom)):
+            if value is not None:
+                conditions += condition
+                params.append(value)
+        params.append(limit)
+        rows = self._connection.execute(SearchIndex.SEARCH_QUERY.format(conditions), params).fetchall()
+        return [dict(zip(("source", "ad_id", "make", "model", "yom", "price", "posted", "snippet", "score"), row))
+                for row in rows]
+
+    def build_query(self, text: str):
+        """fts5 match expression of a keyword query, None when it has no words. Words are quoted, so the query syntax
+        of fts5 cannot be used by accident
+        """
+        words = compact_tokens(get_tokens(text))
+        if len(words) == 0:
+            return None
+        groups = []
+        for position, word in enumerate(words):
+            # the last word may be unfinished. A prefix query also finds the whole word
+            prefix = position == len(words) - 1 and len(word) >= 3
+            variants = [f'"{variant}"*' if prefix and variant == word else f'"{variant}"'
+                        for variant in self._synonyms.get(word, [word])]
+            groups.append(f"({' OR '.join(variants)})")
+        return " AND ".join(groups)
+
+    def sync(self, connection: MySQLConnection, source: str, batch_size: int) -> int:
+        """adds the ads of the source stored after the last synced one, e.g. ads saved while the index was disabled
+
+        :return: number of ads added
+        """
+        last_id = self._get_watermark(source)
+        total = 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(SearchIndex.SYNC_QUERIES[source], (last_id, batch_size))
+                rows = cursor.fetchall()
+            if len(rows) == 0:
+                break
+            self.add([{"source": source, "ad_id": ad_id, "title": title, "description": description, "make": make,
+                       "model": model, "yom": yom, "price": price, "location": location, "datetime": posted}
+                      for _, ad_id, title, description, make, model, yom, price, location, posted in rows])
+            last_id = rows[-1][0]
+            self._connection.execute(SearchIndex.SAVE_WATERMARK_QUERY, (source, last_id))
+            self._connection.commit()
+            total += len(rows)
+            logger.info(f"{source}: synced {total} ads, up to primary id {last_id}")
+        return total
+
+    def _get_watermark(self, source: str) -> int:
+        """primary id of the source up to which every stored ad is indexed"""
+        row = self._connection.execute(SearchIndex.GET_WATERMARK_QUERY, (source,)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _get_terms(self, *texts) -> str:
+        """the joined model names of the texts that are not in them already, e.g. 'cd125' for 'CD 125'"""
+        terms = []
+        for text in texts:
+            tokens = get_tokens(text)
+            terms.extend(term for term in compact_tokens(tokens) if term not in tokens and term not in terms)
+        return " ".join(terms)
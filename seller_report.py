@@ -0,0 +1,75 @@
+import argparse
+
+from time import perf_counter
+from mysql.connector import connect, Error
+
+argument_parser = argparse.ArgumentParser(allow_abbrev=False,
+                                          description="look sellers up in the seller index by phone number, list the "
+                                                      "dealers or index the ads saved before the index existed")
+group = argument_parser.add_mutually_exclusive_group(required=True)
+group.add_argument("-P", "--phone", metavar="number", help="log the seller of the phone number and its ads")
+group.add_argument("-D", "--dealers", metavar="integer", type=int, nargs="?", const=20,
+                   help="log the dealers with the most ads, default 20")
+group.add_argument("--backfill", action="store_true", help="index the stored ads of both sources")
+argument_parser.add_argument("-B", "--batch", metavar="integer", type=int, default=1000,
+                             help="number of ads indexed per transaction by --backfill, default 1000")
+arguments = argument_parser.parse_args()
+if arguments.dealers is not None and arguments.dealers <= 0:
+    argument_parser.error("dealers must be a positive number")
+if arguments.batch <= 0:
+    argument_parser.error("batch must be a positive number")
+
+start = perf_counter()
+
+import logger
+from configuration import AppConfig
+from sellers import SellerIndex, SellerStore
+
+logger = logger.get_logger("Sellers")
+
+
+def describe(seller: dict) -> str:
+    average = f"{seller['price_sum'] / seller['priced_ads']:,.0f}" if seller["priced_ads"] > 0 else "-"
+    return f"seller {seller['seller_id']} {seller['name'] or '(no name)'}{' dealer' if seller['dealer'] else ''}: " \
+           f"{seller['ads']} ads, average price {average}, first seen {seller['first_seen']}, " \
+           f"last seen {seller['last_seen']}"
+
+
+config = AppConfig()
+config.parse_config_file()
+db_config = config.get_db_config()
+sellers_config = config.get_sellers_config()
+
+try:
+    connection = connect(user=db_config["user"], password=db_config["pass"], host=db_config["host"], database=db_config["database"])
+except Error as err:
+    logger.critical(err)
+    exit(1)
+
+store = SellerStore(connection)
+try:
+    if arguments.backfill:
+        index = SellerIndex(sellers_config["dealer_ads"])
+        for source_name in ("ikman", "riyasewana"):
+            store.backfill(index, source_name, arguments.batch)
+    elif arguments.dealers is not None:
+        for dealer in store.get_dealers(arguments.dealers):
+            logger.info(describe(dealer))
+    else:
+        try:
+            seller = store.find_seller(arguments.phone)
+        except ValueError as err:
+            logger.error(err)
+            exit(1)
+        if seller is None:
+            logger.info(f"No seller with the number {arguments.phone}")
+        else:
+            logger.info(describe(seller))
+            counts = store.get_source_counts(seller["seller_id"])
+            logger.info(", ".join(f"{source}: {count} ads" for source, count in counts.items()))
+            for source, ad_id in store.get_ads(seller["seller_id"]):
+                logger.info(f"{source} ad {ad_id}")
+    logger.info(f"Finished in {perf_counter() - start:0.2f} seconds")
+except KeyboardInterrupt as exc:
+    logger.warning("User abort. Exiting...")
+    exit(0)
@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import re
+from hashlib import blake2b
+from typing import TYPE_CHECKING
+
+import logger
+from storage_hook import StorageHook
+
+if TYPE_CHECKING:
+    from mysql.connector import MySQLConnection
+
+logger = logger.get_logger("sellers")
+
+# first two digits of the 9 digit national number: mobile operators and landline area codes
+_PREFIXES = {"70", "71", "72", "74", "75", "76", "77", "78",
+             "11", "21", "23", "24", "25", "26", "27", "31", "32", "33", "34", "35", "36", "37", "38", "41", "45", "47",
+             "51", "52", "54", "55", "57", "63", "65", "66", "67", "81", "91"}
+# country code and trunk prefixes a national number can be written with, longest first
+_TRUNKS = ("0094", "94", "0", "")
+_SEPARATOR_PATTERN = re.compile("[^0-9+\\s().\\-]+")
+_DIGIT_PATTERN = re.compile("\\d+")
+
+
+def normalise_phone(number) -> str | None:
+    """a Sri Lankan phone number in E.164 form, e.g. '077 123 4567' -> '+94771234567'. None when it is not one"""
+    numbers = extract_phones(number)
+    return numbers[0] if len(numbers) == 1 else None
+
+
+def extract_phones(text) -> list:
+    """the Sri Lankan phone numbers of a contact text in E.164 form, in order and without repeats.
+
+    Numbers are separated by anything but digits, spaces, brackets, dots, dashes and '+', or simply follow each other,
+    e.g. '0771234567 / 011-2345678' and '0771234567 0712345678' both give two numbers.
+    """
+    if text is None:
+        return []
+    numbers = []
+    for part in _SEPARATOR_PATTERN.split(str(text)):
+        digits = "".join(_DIGIT_PATTERN.findall(part))
+        start = 0
+        while len(digits) - start >= 9:
+            for trunk in _TRUNKS:
+                national = digits[start + len(trunk):start + len(trunk) + 9]
+                if digits.startswith(trunk, start) and len(national) == 9 and national[:2] in _PREFIXES:
+                    number = "+94" + national
+                    if number not in numbers:
+                        numbers.append(number)
+                    start += len(trunk) + 9
+                    break
+            else:
+                # not a number at this digit, e.g. a stray digit before the number
+                start += 1
+    return numbers
+
+
+def hash_phone(number: str) -> int:
+    """63 bit hash of a normalised phone number, the key of the number in seller_phone"""
+    return int.from_bytes(blake2b(number.encode("utf-8"), digest_size=8).digest(), "big") >> 1
+
+
+class SellerIndex(StorageHook):
+    """Resolves the seller of every saved ad from its phone numbers.
+
+    Numbers are normalised to E.164 and stored as hashes in seller_phone, which maps each number to a seller. An ad
+    with a known number gets the seller of that number, an ad with numbers of two sellers merges them into the older
+    seller. The ad -> seller mapping is kept in ad_seller and the seller row keeps its number of ads, the sum of their
+    prices and whether it is a dealer, a seller with dealer_ads ads or more. All of it is written in the transaction of
+    the save, so a failed save leaves no seller behind.
+    """
+    BATCH_SIZE = 1000
+
+    GET_SELLERS_QUERY: str = "SELECT phone_hash, seller_id FROM seller_phone WHERE phone_hash IN ({})"
+    NEW_SELLER_QUERY: str = "INSERT INTO seller(name) VALUES (%s)"
+    SAVE_PHONE_QUERY: str = "INSERT INTO seller_phone(phone_hash, seller_id) VALUES (%s, %s) " \
+                            "ON DUPLICATE KEY UPDATE seller_id = VALUES(seller_id)"
+    SAVE_AD_QUERY: str = "INSERT IGNORE INTO ad_seller(source, ad_id, seller_id) VALUES (%s, %s, %s)"
+    # assignments are applied left to right, dealer is set from the new number of ads
+    COUNT_AD_QUERY: str = "UPDATE seller SET ads = ads + 1, priced_ads = priced_ads + %s, price_sum = price_sum + %s, " \
+                          "name = COALESCE(%s, name), last_seen = NOW(), dealer = ads >= %s WHERE seller_id = %s"
+    MERGE_QUERIES: tuple = ("UPDATE seller_phone SET seller_id = %s WHERE seller_id = %s",
+                            "UPDATE ad_seller SET seller_id = %s WHERE seller_id = %s")
+    MERGE_SELLER_QUERY: str = "UPDATE seller s JOIN seller m ON m.seller_id = %s SET s.ads = s.ads + m.ads, " \
+                              "s.priced_ads = s.priced_ads + m.priced_ads, s.price_sum = s.price_sum + m.price_sum, " \
+                              "s.first_seen = LEAST(s.first_seen, m.first_seen), " \
+                              "s.last_seen = GREATEST(s.last_seen, m.last_seen) WHERE s.seller_id = %s"
+    # the order of the assignments of a multiple table update is not defined, dealer is set afterwards
+    SET_DEALER_QUERY: str = "UPDATE seller SET dealer = ads >= %s WHERE seller_id = %s"
+    DELETE_SELLER_QUERY: str = "DELETE FROM seller WHERE seller_id = %s"
+
+    def __init__(self, dealer_ads: int):
+        self._DEALER_ADS = dealer_ads
+        # phone hash -> seller id of the committed saves
+        self._sellers = {}
+        # merged seller id -> seller id it was merged into
+        self._merged = {}
+        # the same for the save in progress, applied when it is committed
+        self._pending = {}
+        self._pending_merged = {}
+        self._indexed = 0
+        self._new_sellers = 0
+
+    def on_save(self, cursor, records: list):
+        self._pending = {}
+        self._pending_merged = {}
+        phones = [[hash_phone(number) for number in self._get_numbers(record)] for record in records]
+        self._load(cursor, {phone for numbers in phones for phone in numbers if phone not in self._sellers})
+        for record, numbers in zip(records, phones):
+            if len(numbers) == 0:
+                continue
+            seller_ids = {self._get_seller(phone) for phone in numbers} - {None}
+            if len(seller_ids) == 0:
+                cursor.execute(SellerIndex.NEW_SELLER_QUERY, (record.get("seller_name"),))
+                seller_id = cursor.lastrowid
+                self._new_sellers += 1
+            else:
+                seller_id = min(seller_ids)
+                for other in seller_ids - {seller_id}:
+                    self._merge(cursor, seller_id, other)
+            new_numbers = [phone for phone in numbers if self._get_seller(phone) != seller_id]
+            if len(new_numbers) > 0:
+                cursor.executemany(SellerIndex.SAVE_PHONE_QUERY, [(phone, seller_id) for phone in new_numbers])
+                self._pending.update((phone, seller_id) for phone in new_numbers)
+            cursor.execute(SellerIndex.SAVE_AD_QUERY, (record["source"], record["ad_id"], seller_id))
+            # an ad saved again is already counted
+            if cursor.rowcount == 1:
+                price = record.get("price")
+                cursor.execute(SellerIndex.COUNT_AD_QUERY,
+                               (0 if price is None else 1, price or 0, record.get("seller_name"), self._DEALER_ADS,
+                                seller_id))
+                self._indexed += 1
+        logger.info(f"Indexed {self._indexed} ads, {self._new_sellers} new sellers")
+
+    def on_commit(self, records: list):
+        self._sellers.update(self._pending)
+        self._merged.update(self._pending_merged)
+        self._pending = {}
+        self._pending_merged = {}
+
+    def _get_numbers(self, record: dict) -> list:
+        numbers = []
+        for text in record.get("phones") or []:
+            for number in extract_phones(text):
+                if number not in numbers:
+                    numbers.append(number)
+        return numbers
+
+    def _load(self, cursor, phones: set):
+        """reads the sellers of numbers seen for the first time in this session"""
+        phones = list(phones)
+        for i in range(0, len(phones), SellerIndex.BATCH_SIZE):
+            batch = phones[i:i + SellerIndex.BATCH_SIZE]
+            cursor.execute(SellerIndex.GET_SELLERS_QUERY.format(", ".join(["%s"] * len(batch))), batch)
+            self._pending.update((phone, seller_id) for phone, seller_id in cursor.fetchall())
+
+    def _get_seller(self, phone: int):
+        seller_id = self._pending.get(phone, self._sellers.get(phone))
+        while seller_id in self._pending_merged or seller_id in self._merged:
+            seller_id = self._pending_merged.get(seller_id, self._merged.get(seller_id))
+        return seller_id
+
+    def _merge(self, cursor, seller_id: int, other: int):
+        """moves the numbers, ads and counts of other to seller_id. Both sellers turned out to share a number"""
+        for query in SellerIndex.MERGE_QUERIES:
+            cursor.execute(query, (seller_id, other))
+        cursor.execute(SellerIndex.MERGE_SELLER_QUERY, (other, seller_id))
+        cursor.execute(SellerIndex.SET_DEALER_QUERY, (self._DEALER_ADS, seller_id))
+        cursor.execute(SellerIndex.DELETE_SELLER_QUERY, (other,))
+        self._pending_merged[other] = seller_id
+        logger.info(f"Merged seller {other} into seller {seller_id}")
+
+
+class SellerStore:
+    """Lookups of the seller index and the backfill of the ads saved before it existed"""
+    GET_SELLER_QUERY: str = "SELECT seller_id FROM seller_phone WHERE phone_hash = %s"
+    GET_SELLER_ROW_QUERY: str = "SELECT seller_id, name, ads, priced_ads, price_sum, dealer, first_seen, last_seen " \
+                                "FROM seller WHERE seller_id = %s"
+    GET_DEALERS_QUERY: str = "SELECT seller_id, name, ads, priced_ads, price_sum, dealer, first_seen, last_seen " \
+                             "FROM seller WHERE dealer = 1 ORDER BY ads DESC LIMIT %s"
+    GET_ADS_QUERY: str = "SELECT source, ad_id FROM ad_seller WHERE seller_id = %s ORDER BY source, ad_id"
+    GET_SOURCE_COUNTS_QUERY: str = "SELECT source, COUNT(*) FROM ad_seller WHERE seller_id = %s GROUP BY source"
+    GET_IKMAN_ADS_QUERY: str = "SELECT primary_id, ad_id, price_value FROM ad WHERE primary_id > %s " \
+                               "ORDER BY primary_id LIMIT %s"
+    GET_IKMAN_PHONES_QUERY: str = "SELECT ad_id, name, number FROM phone WHERE ad_id IN ({})"
+    GET_RIYASEWANA_ADS_QUERY: str = "SELECT primary_id, ad_id, price_value, name, number FROM riyasewana_ad " \
+                                    "WHERE primary_id > %s ORDER BY primary_id LIMIT %s"
+    ROW_FIELDS = ("seller_id", "name", "ads", "priced_ads", "price_sum", "dealer", "first_seen", "last_seen")
+
+    def __init__(self, connection: MySQLConnection):
+        self._connection = connection
+
+    def find_seller(self, number: str):
+        """the seller row of a phone number as a dict, None when the number is not indexed"""
+        normalised = normalise_phone(number)
+        if normalised is None:
+            raise ValueError(f"'{number}' is not a Sri Lankan phone number")
+        with self._connection.cursor() as cursor:
+            cursor.execute(SellerStore.GET_SELLER_QUERY, (hash_phone(normalised),))
+            rows = cursor.fetchall()
+            if len(rows) == 0:
+                return None
+            cursor.execute(SellerStore.GET_SELLER_ROW_QUERY, (rows[0][0],))
+            rows = cursor.fetchall()
+        return dict(zip(SellerStore.ROW_FIELDS, rows[0])) if len(rows) > 0 else None
+
+    def get_dealers(self, limit: int) -> list:
+        """seller rows of the dealers with the most ads"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(SellerStore.GET_DEALERS_QUERY, (limit,))
+            return [dict(zip(SellerStore.ROW_FIELDS, row)) for row in cursor.fetchall()]
+
+    def get_ads(self, seller_id: int) -> list:
+        """tuples (source, ad_id) of the ads of a seller"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(SellerStore.GET_ADS_QUERY, (seller_id,))
+            return cursor.fetchall()
+
+    def get_source_counts(self, seller_id: int) -> dict:
+        """source -> number of ads of a seller"""
+        with self._connection.cursor() as cursor:
+            cursor.execute(SellerStore.GET_SOURCE_COUNTS_QUERY, (seller_id,))
+            return {source: count for source, count in cursor.fetchall()}
+
+    def backfill(self, index: SellerIndex, source: str, batch_size: int) -> int:
+        """indexes the stored ads of the source in batches of batch_size ads, one transaction each. Ads that are
+        already indexed are skipped, so an interrupted backfill can be run again
+
+        :return: number of ads read
+        """
+        last_id = 0
+        total = 0
+        while True:
+            with self._connection.cursor() as cursor:
+                if source == "ikman":
+                    last_id, records = self._get_ikman_records(cursor, last_id, batch_size)
+                else:
+                    last_id, records = self._get_riyasewana_records(cursor, last_id, batch_size)
+                if len(records) == 0:
+                    break
+                index.on_save(cursor, records)
+                self._connection.commit()
+            index.on_commit(records)
+            total += len(records)
+            logger.info(f"{source}: read {total} ads, up to primary id {last_id}")
+        return total
+
+    def _get_ikman_records(self, cursor, last_id: int, batch_size: int) -> tuple:
+        cursor.execute(SellerStore.GET_IKMAN_ADS_QUERY, (last_id, batch_size))
+        ads = cursor.fetchall()
+        if len(ads) == 0:
+            return last_id, []
+        records = {ad_id: {"source": "ikman", "ad_id": ad_id, "price": price, "phones": [], "seller_name": None}
+                   for _, ad_id, price in ads}
+        cursor.execute(SellerStore.GET_IKMAN_PHONES_QUERY.format(", ".join(["%s"] * len(records))), list(records))
+        for ad_id, name, number in cursor.fetchall():
+            records[ad_id]["phones"].append(number)
+            records[ad_id]["seller_name"] = records[ad_id]["seller_name"] or name or None
+        return ads[-1][0], list(records.values())
+
+    def _get_riyasewana_records(self, cursor, last_id: int, batch_size: int) -> tuple:
+        cursor.execute(SellerStore.GET_RIYASEWANA_ADS_QUERY, (last_id, batch_size))
+        ads = cursor.fetchall()
+        if len(ads) == 0:
+            return last_id, []
+        return ads[-1][0], [{"source": "riyasewana", "ad_id": ad_id, "price": price,
+                             "phones": [number] if number else [], "seller_name": name or None}
+                            for _, ad_id, price, name, number in ads]
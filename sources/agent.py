@@ -1,3 +1,10 @@
 class Agent:
+    # a feed of a source with several feeds is up to date once a list page has this many stored ads
+    FEED_KNOWN_ADS = 3
+
     def run(self):
         pass
+
+    def get_run_stats(self) -> dict:
+        """requests, list pages and new ads of the last run, and the totals listed by the source"""
+        return self._feeds.get_run_stats()
@@ -1,3 +1,7 @@
+from ad_history import AdHistory
+from feed_scheduler import Feed, FeedScheduler
+from profiler import Profiler
+from retry_queue import RetryQueue
 from sources.ikman.ikman_agent import IkmanAgent
 from sources.ikman.ikman_parser import IkmanParser
 from sources.ikman.ikman_storage import IkmanStorage
@@ -7,19 +11,58 @@ from sources.riyasewana.riyasewana_storage import RiyasewanaStorage
 
 
 class AgentFactory():
-    def __init__(self, connection, fetcher):
+    def __init__(self, connection, fetcher, scheduler, hooks, config, profiler=None, archive=None,
+                 feed_yield_file=None):
         self._connection = connection
         self._fetcher = fetcher
+        self._scheduler = scheduler
+        self._hooks = hooks
+        self._config = config
+        self._profiler = profiler if profiler is not None else Profiler()
+        self._archive = archive
+        # json file of the learnt yields of the feeds, None to keep them in memory only
+        self._feed_yield_file = feed_yield_file
+        # source name -> FeedScheduler. Kept between runs so the yield file is read once
+        self._feeds = {}
 
     def make_agent(self, props):
         name = props["NAME"]
+        retry_queue = self._make_retry_queue(name)
+        # the retry queue removes the ads of its source once they are committed
+        hooks = self._hooks + [retry_queue] if retry_queue is not None else self._hooks
         if name == "ikman":
-            ikmanStorage = IkmanStorage(self._connection)
+            ikmanStorage = IkmanStorage(self._connection, hooks, self._make_history(name, IkmanStorage.GET_STATE_QUERY))
             ikmanParser = IkmanParser()
-            ikmanAgent = IkmanAgent(self._fetcher, ikmanParser, ikmanStorage, props)
+            ikmanAgent = IkmanAgent(self._fetcher, ikmanParser, ikmanStorage, self._scheduler, retry_queue,
+                                    self._profiler, self._get_feeds(props), self._archive, props)
             return ikmanAgent
         elif name == "riyasewana":
-            riyasewanaStorage = RiyasewanaStorage(self._connection)
+            riyasewanaStorage = RiyasewanaStorage(self._connection, hooks,
+                                                  self._make_history(name, RiyasewanaStorage.GET_STATE_QUERY))
             riyasewanaParser = RiyasewanaParser()
-            riyasewanaAgent = RiyasewanaAgent(self._fetcher, riyasewanaParser, riyasewanaStorage, props)
+            riyasewanaAgent = RiyasewanaAgent(self._fetcher, riyasewanaParser, riyasewanaStorage, self._scheduler,
+                                              retry_queue, self._profiler, self._get_feeds(props), self._archive,
+                                              props)
             return riyasewanaAgent
+
+    def _get_feeds(self, props):
+        name = props["NAME"]
+        if name not in self._feeds:
+            if "FEEDS" in props:
+                feeds = [Feed(feed["NAME"], feed["LIST_URL"], feed["WEIGHT"]) for feed in props["FEEDS"]]
+            else:
+                feeds = [Feed(name, props["LIST_URL"], 1)]
+            self._feeds[name] = FeedScheduler(feeds, name, self._feed_yield_file)
+        return self._feeds[name]
+
+    def _make_history(self, name, state_query):
+        if not self._config.is_history_enabled():
+            return None
+        return AdHistory(self._connection, name, state_query)
+
+    def _make_retry_queue(self, name):
+        retry_config = self._config.get_retry_config()
+        if not retry_config["enabled"]:
+            return None
+        return RetryQueue(self._connection, name, retry_config["max_attempts"], retry_config["budget"],
+                          retry_config["base_delay"], retry_config["max_delay"])
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING
 
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, ConnectionError
 from app_exceptions import IkmanNoPaginationData, IkmanListNotFound
 
 import logger
@@ -13,18 +13,31 @@ from sources.agent import Agent
 if TYPE_CHECKING:
     from ikman_storage import IkmanStorage
     from ikman_parser import IkmanParser
+    from sources.ikman.ikman_records import IkmanDetail
     from fetcher import Fetcher
+    from scheduler import PollScheduler
+    from retry_queue import RetryQueue
+    from profiler import Profiler
+    from feed_scheduler import FeedScheduler
+    from raw_archive import RawArchive
 
 logger = logger.get_logger("ikman.agent")
 
 
 class IkmanAgent(Agent):
-    def __init__(self, fetcher: Fetcher, parser: IkmanParser, storage: IkmanStorage, source_props: dict):
+    def __init__(self, fetcher: Fetcher, parser: IkmanParser, storage: IkmanStorage,
+                 scheduler: PollScheduler, retry_queue: RetryQueue, profiler: Profiler, feeds: FeedScheduler,
+                 archive: RawArchive, source_props: dict):
         self._fetcher = fetcher
         self._parser = parser
         self._storage = storage
+        self._scheduler = scheduler
+        self._retry_queue = retry_queue
+        self._profiler = profiler
+        self._feeds = feeds
+        self._archive = archive
+        self._NAME = source_props["NAME"]
         self._options = source_props
-        self._LIST_BASE_URL = source_props["LIST_URL"]
         self._DET_BASE_URL = source_props["DET_URL"]
         self._FETCH_LIMIT = source_props["FETCH_LIMIT"]
         self._FETCH_TYPE = source_props["FETCH_TYPE"]
@@ -32,9 +45,13 @@ class IkmanAgent(Agent):
 
         self._fetch_queue = []
 
-        # used to generate page url. Different from whatever data the page itself provides e.g. activePage
-        self._page_count = 1
-        self._total_pages = 1
+        # feed of the current page. Its page count is used to generate the page url. Different from whatever data the
+        # page itself provides e.g. activePage
+        self._feed = None
+        self._new_count = 0
+        self._detail_count = 0
+        # retried ads are fetched within the retry budget, not FETCH_LIMIT
+        self._retried_count = 0
 
         self._failure_count = 0
 
@@ -43,12 +60,17 @@ class IkmanAgent(Agent):
     def run(self):
         logger.info(f"Running Ikman agent")
         logger.info(f"Fetch type: {'New ads' if self._IS_FETCH_TYPE_NEW else 'All ads'} - Limit={self._FETCH_LIMIT}")
+        self._retry_deferred()
+        self._feeds.start()
         while self._has_next():
+            self._next_feed()
             logger.info(f"Fetch limit: {self._FETCH_LIMIT}")
             try:
-                response = self._fetcher.get(self._gen_page_url())
-                response.raise_for_status()
-                self._set_id_list(self._parser.parse(response, DocType.LIST))
+                with self._profiler.phase("list fetch"):
+                    response = self._fetcher.get(self._gen_page_url())
+                    response.raise_for_status()
+                with self._profiler.phase("list parse"):
+                    self._set_id_list(self._parser.parse(response, DocType.LIST))
             except HTTPError as hte:
                 logger.warning(hte)
                 self._handle_failure()
@@ -62,20 +84,35 @@ class IkmanAgent(Agent):
             except IkmanNoPaginationData as ex:
                 logger.warning(ex)
                 self._handle_failure()
-                logger.critical("Stopping agent")
-                break
+                logger.critical(f"Stopping feed {self._feed.name}")
+                self._feed.total_pages = 0
+                continue
 
-            self._filter_list()
+            with self._profiler.phase("filter"):
+                self._storage.observe(self._parser.get_list_observations())
+                self._filter_list()
             self._get_details()
             self._inc_page_count()
 
         # save any leftover fetched ads in queue
-        self._storage.save()
+        with self._profiler.phase("save"):
+            self._storage.save()
+        self._feeds.finish_run()
+        if self._IS_FETCH_TYPE_NEW:
+            self._scheduler.finish_run(self._NAME, self._is_up_to_date())
         logger.info(f"Finished running agent on source Ikman")
 
+    def _next_feed(self):
+        self._feed = self._feeds.next_feed()
+        if len(self._feeds) > 1:
+            logger.info(f"Feed {self._feed.name}, page {self._feed.page_count}")
+        if self._feed.page_count == 1:
+            # the parser keeps the pagination data of the first page it parsed
+            self._parser.reset_pagination()
+
     def _gen_page_url(self) -> str:
         # get next page
-        return self._LIST_BASE_URL + str(self._page_count)
+        return self._feed.list_url + str(self._feed.page_count)
 
     def _handle_failure(self):
         self._failure_count += 1
@@ -88,9 +125,13 @@ class IkmanAgent(Agent):
 
     def _inc_page_count(self):
         # should be called after the first list parse
-        if self._page_count == 1:
-            self._total_pages = self._get_total_pages()
-        self._page_count += 1
+        if self._feed.page_count == 1:
+            self._feed.total_pages = self._get_total_pages()
+            self._feed.total_ads = self._parser.get_total_ads()
+        self._feed.page_count += 1
+        self._feeds.record_page(self._feed, 1 + self._detail_count, self._new_count)
+        self._new_count = 0
+        self._detail_count = 0
 
     def _get_total_pages(self) -> int:
         _pages = self._parser.get_total_pages()
@@ -109,45 +150,98 @@ class IkmanAgent(Agent):
             if not self._is_below_limit():
                 logger.info("Fetch limit reached")
                 break
+            self._detail_count += 1
             try:
-                response = self._fetcher.get(self._DET_BASE_URL + __id)
-                response.raise_for_status()
-                self._storage.queue(self._parser.parse(response, DocType.DETAIL))
+                self._queue(self._fetch_detail(__id))
             except HTTPError as hte:
                 logger.warning(hte)
                 self._handle_failure()
+                self._defer(__id, hte)
+                continue
+            except ConnectionError as ex:
+                logger.warning(ex)
+                self._handle_failure()
+                self._defer(__id, ex)
                 continue
             except IkmanNoPaginationData as ex:
                 logger.warning(ex)
                 self._handle_failure()
+                self._defer(__id, ex)
                 continue
             except KeyError as ex:
                 logger.exception(ex)
                 self._handle_failure()
+                self._defer(__id, ex)
                 continue
         logger.info("Clearing fetch queue list")
         self._fetch_queue.clear()
 
+    def _fetch_detail(self, __id: str) -> list:
+        with self._profiler.phase("detail fetch"):
+            response = self._fetcher.get(self._DET_BASE_URL + __id)
+            response.raise_for_status()
+        if self._archive is not None:
+            with self._profiler.phase("archive"):
+                self._archive.put(self._NAME, __id, self._DET_BASE_URL + __id, response.content)
+        with self._profiler.phase("detail parse"):
+            return self._parser.parse(response, DocType.DETAIL)
+
+    def _queue(self, ad_detail: IkmanDetail):
+        with self._profiler.phase("save"):
+            self._storage.queue(ad_detail)
+
+    def _defer(self, __id: str, ex: Exception):
+        if self._retry_queue is not None:
+            self._retry_queue.defer(__id, self._DET_BASE_URL + __id, ex)
+
+    def _retry_deferred(self):
+        """fetches ads that failed in earlier runs. Failures here do not count against MAX_FAILS"""
+        if self._retry_queue is None:
+            return
+        for __id, url in self._retry_queue.get_due():
+            if self._storage.is_stored(__id):
+                # saved in an earlier run, nothing is queued before the retries
+                self._retry_queue.resolve([__id])
+                continue
+            try:
+                self._queue(self._fetch_detail(__id))
+            except (HTTPError, ConnectionError, IkmanNoPaginationData, KeyError) as ex:
+                logger.warning(f"Retry of ad {__id} failed. {ex}")
+                self._retry_queue.defer(__id, url, ex)
+                continue
+            self._retried_count += 1
+
     def _set_id_list(self, _page_ids: list):
         self._fetch_queue = _page_ids
 
     def _filter_list(self):
+        # ads of other feeds fetched in this run are removed too, before any detail fetch
         if self._IS_FETCH_TYPE_NEW:
-            self._fetch_queue = self._storage.filter_list_new(self._fetch_queue)
+            page_size = len(self._fetch_queue)
+            if len(self._feeds) == 1:
+                self._fetch_queue = self._storage.filter_list_new(self._fetch_queue)
+                self._feed.up_to_date = self._storage.is_up_to_date()
+            else:
+                # the latest local ads may belong to another feed
+                known = self._storage.count_local(self._fetch_queue)
+                self._fetch_queue = self._storage.filter_list(self._fetch_queue)
+                self._feed.up_to_date = known >= Agent.FEED_KNOWN_ADS
+            self._scheduler.record_cycle(self._NAME, page_size, len(self._fetch_queue))
         else:
             self._fetch_queue = self._storage.filter_list(self._fetch_queue)
+        self._new_count = len(self._fetch_queue)
 
     def _is_up_to_date(self) -> bool:
         if self._IS_FETCH_TYPE_NEW:
-            return self._storage.is_up_to_date()
+            return self._feeds.is_up_to_date()
 
     def _is_below_limit(self) -> bool:
         if self._FETCH_LIMIT == 0:
             return True
-        return self._storage.get_fetch_count() < self._FETCH_LIMIT
+        return self._storage.get_fetch_count() - self._retried_count < self._FETCH_LIMIT
 
     def _has_next_page(self) -> bool:
-        return self._total_pages >= self._page_count
+        return self._feeds.has_active()
 
     def _has_next(self) -> bool:
         if self._IS_FETCH_TYPE_NEW:
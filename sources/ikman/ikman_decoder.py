@@ -0,0 +1,148 @@
+import json
+from typing import Any, List, Optional, TypedDict
+
+import logger
+
+logger = logger.get_logger("ikman.decoder")
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Projections of the serp and ad responses: only the fields read by IkmanParser. A TypedDict decodes to a plain dict,
+# total=False leaves missing keys out so the parser sees the same dicts as with a full decode
+class _ListAd(TypedDict, total=False):
+    id: Any
+    price: Any
+
+
+class _PaginationData(TypedDict, total=False):
+    total: Any
+    pageSize: Any
+    activePage: Any
+
+
+class _ListResponse(TypedDict, total=False):
+    ads: List[_ListAd]
+    paginationData: _PaginationData
+
+
+class _Named(TypedDict, total=False):
+    name: Any
+
+
+class _Money(TypedDict, total=False):
+    amount: Any
+
+
+class _PhoneNumber(TypedDict, total=False):
+    number: Any
+    verified: Any
+
+
+class _ContactCard(TypedDict, total=False):
+    name: Any
+    phone_numbers: List[_PhoneNumber]
+
+
+class _Property(TypedDict, total=False):
+    key: Any
+    value: Any
+
+
+class _Ad(TypedDict, total=False):
+    id: Any
+    status: Any
+    description: Any
+    date: Any
+    url: Any
+    title: Any
+    money: Optional[_Money]
+    deactivates: Any
+    contact_card: Optional[_ContactCard]
+    item_condition: Any
+    slug: Any
+    area: Optional[_Named]
+    location: Optional[_Named]
+    type: Any
+    info: Any
+    properties: List[_Property]
+
+
+class _DetailResponse(TypedDict, total=False):
+    ad: _Ad
+
+
+class IkmanDecoder:
+    """Decodes Ikman json responses with the standard json module"""
+    NAME = "json"
+
+    def decode_list(self, content: bytes) -> dict:
+        return json.loads(content)
+
+    def decode_detail(self, content: bytes) -> dict:
+        return json.loads(content)
+
+
+class OrjsonDecoder(IkmanDecoder):
+    """full decode with orjson, about twice as fast as json"""
+    NAME = "orjson"
+
+    def decode_list(self, content: bytes) -> dict:
+        return orjson.loads(content)
+
+    def decode_detail(self, content: bytes) -> dict:
+        return orjson.loads(content)
+
+
+class MsgspecDecoder(IkmanDecoder):
+    """Decodes only the projected fields with msgspec, other fields are skipped without creating objects for them.
+
+    A response that does not fit the projection, e.g. a list where an object is expected, is decoded again in full so
+    the parser fails on it the same way as with json.
+    """
+    NAME = "msgspec"
+
+    def __init__(self):
+        self._list_decoder = msgspec.json.Decoder(_ListResponse)
+        self._detail_decoder = msgspec.json.Decoder(_DetailResponse)
+        self._fallbacks = 0
+
+    def decode_list(self, content: bytes) -> dict:
+        try:
+            return self._list_decoder.decode(content)
+        except msgspec.DecodeError as ex:
+            return self._decode_full(content, ex)
+
+    def decode_detail(self, content: bytes) -> dict:
+        try:
+            return self._detail_decoder.decode(content)
+        except msgspec.DecodeError as ex:
+            return self._decode_full(content, ex)
+
+    def _decode_full(self, content: bytes, ex: Exception) -> dict:
+        self._fallbacks += 1
+        if self._fallbacks == 1:
+            logger.warning(f"Response does not match the projected schema, decoding it in full. {ex}")
+        return json.loads(content)
+
+
+def make_decoder(name: str = None) -> IkmanDecoder:
+    """the named decoder, or the fastest installed one of msgspec, orjson and json when name is None"""
+    if name is None:
+        name = "msgspec" if msgspec is not None else "orjson" if orjson is not None else "json"
+    if name == "msgspec":
+        if msgspec is None:
+            raise ImportError("The msgspec decoder needs the msgspec package. pip install msgspec")
+        return MsgspecDecoder()
+    if name == "orjson":
+        if orjson is None:
+            raise ImportError("The orjson decoder needs the orjson package. pip install orjson")
+        return OrjsonDecoder()
+    return IkmanDecoder()
@@ -5,25 +5,36 @@ from app_exceptions import IkmanListNotFound, IkmanNoPaginationData
 
 import logger
 from document_type import DocType
+from normaliser import Normaliser
+from sources.ikman.ikman_decoder import IkmanDecoder, make_decoder
+from sources.ikman.ikman_records import IkmanAd, IkmanDetail, get_typed_values
 
 logger = logger.get_logger("ikman.parser")
 
 
 class IkmanParser:
 
-    def __init__(self):
+    def __init__(self, decoder: IkmanDecoder = None):
+        # only the fields read below are decoded when msgspec is installed
+        self._decoder = decoder if decoder is not None else make_decoder()
+        self._normaliser = Normaliser()
         self._current_page_no = 0
         self._total_ads = 0
         self._ads_per_page = 0
 
         self._total_pages_approx = 0
 
+        # fields of every ad in the last list page. ad id -> dict
+        self._list_observations = {}
+
         self._KEY_LIST = ["id", "status", "description", "date", "url", "title", "money", "deactivates", "contact_card",
                           "item_condition", "slug", "area", "location", "type", "info", "properties"]
+        # keys of the phone and properties rows, not columns of the ad
+        self._ROW_KEYS = ("contact_card", "properties")
 
     def parse(self, _response: Response, _type):
-        _response_json = _response.json()
         if _type == DocType.LIST:
+            _response_json = self._decoder.decode_list(_response.content)
             if "ads" not in _response_json:
                 raise IkmanListNotFound("No ad list found in response. Cannot parse further")
             self._set_pagination_data(_response_json)
@@ -31,10 +42,10 @@ class IkmanParser:
             return id_list
 
         if _type == DocType.DETAIL:
-            return self._get_ad_details(_response_json)
+            return self._get_ad_details(self._decoder.decode_detail(_response.content))
 
     def parse_list(self, _response):
-        _response_json = _response.json()
+        _response_json = self._decoder.decode_list(_response.content)
         if "ads" not in _response_json:
             raise IkmanListNotFound("No ad list found in response. Cannot parse further")
         self._set_pagination_data(_response_json)
@@ -42,16 +53,32 @@ class IkmanParser:
         return id_list
 
     def parse_detail(self, _response):
-        _response_json = _response.json()
+        _response_json = self._decoder.decode_detail(_response.content)
         return self._get_ad_details(_response_json)
 
     def get_total_pages(self):
         return self._total_pages_approx
 
+    def get_total_ads(self):
+        return self._total_ads
+
+    def reset_pagination(self):
+        """forgets the pagination data so the next list page parsed is taken as the first page of a list"""
+        self._current_page_no = 0
+        self._total_ads = 0
+        self._ads_per_page = 0
+        self._total_pages_approx = 0
+
+    def get_list_observations(self) -> dict:
+        """fields of the ads seen in the last parsed list page. ad id -> dict with price text"""
+        return self._list_observations
+
     def _get_ad_id_list(self, _list: list) -> list:
         id_list = []
+        self._list_observations = {}
         for element in _list:
             id_list.append(element["id"])
+            self._list_observations[element["id"]] = {"price": element.get("price")}
         return id_list
 
 
@@ -68,29 +95,29 @@ class IkmanParser:
         self._current_page_no = pagination_data["activePage"]
         logger.info(f"total ads: {self._total_ads}, total pages: {self._total_pages_approx}, active page: {self._current_page_no}")
 
-    def _get_ad_details(self, _response_json: dict) -> list:
-        """get ad details in a list from response dict (json)
+    def _get_ad_details(self, _response_json: dict) -> IkmanDetail:
+        """get ad details from response dict (json)
 
         Depends on expected KEY_LIST constant. KEY_LIST contains all expected properties
 
         :param _response_json: dict
-        :return: ad details
+        :return: ad details with the typed column values of the ad
         """
         _ad = []
-        _phones = []
-        _properties = []
-        """
-            get details [ad list, phone tuple list, properties tuple list]
-        """
+        _phones = ()
+        _properties = ()
         ad_json = _response_json["ad"]
         _ad_id = ad_json["id"]
         for key in self._KEY_LIST:
             if key not in ad_json:
-                logger.info(f"Key - {key} not found in ad - {_ad_id}, substituting with None")
-                _ad.append(None)
+                if key in self._ROW_KEYS:
+                    logger.info(f"Key - {key} not found in ad - {_ad_id}, saving no rows of it")
+                else:
+                    logger.info(f"Key - {key} not found in ad - {_ad_id}, substituting with None")
+                    _ad.append(None)
                 continue
             if key == "properties":
-                _properties.extend(self._get_properties_tuple(ad_json[key], ad_json["id"]))
+                _properties = self._get_properties_tuple(ad_json[key], ad_json["id"])
             elif key == "money":  # money.amount
                 _ad.append(ad_json[key]["amount"])
             elif key == "location":  # location.name
@@ -98,12 +125,16 @@ class IkmanParser:
             elif key == "area":  # area.name
                 _ad.append((ad_json[key]["name"]))
             elif key == "contact_card":
-                _phones.extend(self._get_phone_tuple(ad_json[key], ad_json["id"]))
+                _phones = self._get_phone_tuple(ad_json[key], ad_json["id"])
             else:
                 _ad.append(ad_json[key])
-        # [(), [()], [()]]
-        # [tuple, list of tuples, list of tuples]
-        return [tuple(_ad), _phones, _properties]
+        # money is the 7th column of the ad
+        _ad.extend(get_typed_values(self._normaliser, _ad[6], _properties))
+        # the values are in field order, tuple.__new__ skips the python level constructor of the named tuple but also
+        # its check of the number of values
+        if len(_ad) != len(IkmanAd._fields):
+            raise ValueError(f"{len(_ad)} values for the {len(IkmanAd._fields)} columns of ad {_ad_id}")
+        return tuple.__new__(IkmanAd, _ad), _phones, _properties
 
     def _get_properties_tuple(self, properties: list, _ad_id: str) -> tuple:
         prop_list = []
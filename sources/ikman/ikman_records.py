@@ -0,0 +1,62 @@
+from typing import Any, NamedTuple, Optional, Tuple
+
+from normaliser import Normaliser
+
+# property keys of the values that are also stored in typed columns of the ad table
+MAKE_KEY = "brand"
+MODEL_KEY = "model"
+YOM_KEY = "model_year"
+MILEAGE_KEY = "mileage"
+ENGINE_CC_KEY = "engine_capacity"
+
+
+# A row of the ad table as built by IkmanParser. Field names are the column names and the save query of IkmanStorage is
+# built from them, so a row is passed to executemany as it is. A named tuple has no __dict__ and takes the memory of a
+# plain tuple of its values
+class IkmanAd(NamedTuple):
+    ad_id: Any
+    status: Any
+    description: Any
+    datetime: Any
+    url: Any
+    title: Any
+    money: Any
+    deactivates: Any
+    item_condition: Any
+    slug: Any
+    area: Any
+    location: Any
+    type: Any
+    info: Any
+    make: Any
+    model: Any
+    yom: Optional[int]
+    price_value: Optional[int]
+    mileage_km: Optional[int]
+    engine_cc_value: Optional[int]
+
+
+# Columns of the phone and properties rows. An ad has many of them, so they are plain tuples in this order: a named
+# tuple is built by a python function and takes ten times as long as a tuple
+PHONE_FIELDS = ("ad_id", "name", "number", "verified")
+PROPERTY_FIELDS = ("ad_id", "prop_key", "prop_value")
+PHONE_NAME = PHONE_FIELDS.index("name")
+PHONE_NUMBER = PHONE_FIELDS.index("number")
+
+# an ad with its phone and property rows as parsed, a plain tuple (ad, phones, properties) for the same reason
+IkmanDetail = Tuple[IkmanAd, Tuple[tuple, ...], Tuple[tuple, ...]]
+
+
+def get_typed_values(normaliser: Normaliser, money, properties) -> tuple:
+    """typed column values of an ad
+
+    :param normaliser:
+    :param money: money amount of the ad
+    :param properties: iterable of property tuples (ad_id, key, value)
+    :return: tuple (make, model, yom, price_value, mileage_km, engine_cc_value)
+    """
+    props = {prop[1]: prop[2] for prop in properties}
+    return (props.get(MAKE_KEY), props.get(MODEL_KEY), normaliser.parse_yom(props.get(YOM_KEY)),
+            normaliser.parse_price(money), normaliser.parse_mileage(props.get(MILEAGE_KEY)),
+            normaliser.parse_engine_cc(props.get(ENGINE_CC_KEY)))
+
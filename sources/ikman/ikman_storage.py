@@ -3,9 +3,12 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import logger
+from normaliser import Normaliser
+from sources.ikman.ikman_records import IkmanAd, IkmanDetail, PHONE_FIELDS, PHONE_NAME, PHONE_NUMBER, PROPERTY_FIELDS
 
 if TYPE_CHECKING:
     from mysql.connector import MySQLConnection
+    from ad_history import AdHistory
 
 logger = logger.get_logger("ikman.storage")
 
@@ -15,15 +18,24 @@ class IkmanStorage:
     FROM_LOCAL = 0
 
     GET_LOCAL_ADS_QUERY: str = f"SELECT ad_id FROM ad ORDER BY datetime DESC"
-    SAVE_AD_QUERY: str = "INSERT INTO ad(ad_id, status, description, datetime, url, title, money, deactivates, " \
-                         "item_condition, slug, area, location, type, info) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, " \
-                         "%s, %s, %s, %s, %s, %s) "
-    SAVE_PHONE_QUERY: str = "INSERT INTO phone(ad_id, name, number, verified) VALUES(%s, %s, %s, %s)"
-    SAVE_PROPERTIES_QUERY: str = "INSERT INTO properties(ad_id, prop_key, prop_value) VALUES(%s, %s, %s)"
-
-    def __init__(self, connection: MySQLConnection):
+    GET_STATE_QUERY: str = "SELECT ad_id, price_value, status, deactivates, description FROM ad WHERE ad_id IN ({})"
+    # the columns are the fields of the records, which are saved as they are. Rows hitting a unique key are skipped,
+    # other errors such as a NULL in a NOT NULL column still fail the save
+    SAVE_AD_QUERY: str = f"INSERT INTO ad({', '.join(IkmanAd._fields)}) " \
+                         f"VALUES ({', '.join(['%s'] * len(IkmanAd._fields))}) ON DUPLICATE KEY UPDATE ad_id = ad_id"
+    SAVE_PHONE_QUERY: str = f"INSERT INTO phone({', '.join(PHONE_FIELDS)}) " \
+                            f"VALUES ({', '.join(['%s'] * len(PHONE_FIELDS))}) " \
+                            f"ON DUPLICATE KEY UPDATE ad_id = ad_id"
+    SAVE_PROPERTIES_QUERY: str = f"INSERT INTO properties({', '.join(PROPERTY_FIELDS)}) " \
+                                 f"VALUES ({', '.join(['%s'] * len(PROPERTY_FIELDS))}) " \
+                                 f"ON DUPLICATE KEY UPDATE ad_id = ad_id"
+
+    def __init__(self, connection: MySQLConnection, hooks: list, history: AdHistory = None):
         self._QUEUE_LIMIT = 10
         self._connection = connection
+        self._hooks = hooks
+        self._history = history
+        self._normaliser = Normaliser()
         self._local = {}
         self._latest = []
         self._get_all_local()
@@ -35,10 +47,13 @@ class IkmanStorage:
         self._ad_tuple_list = []
         self._phone_tuple_list = []
         self._properties_tuple_list = []
+        self._records = []
 
         self._fetched_all_latest = False
 
     def save(self):
+        if self._history is not None:
+            self._history.flush()
         if self._queue_count == 0:
             logger.info("No ads in save queue")
             return
@@ -53,7 +68,11 @@ class IkmanStorage:
             cursor.executemany(IkmanStorage.SAVE_PROPERTIES_QUERY, self._properties_tuple_list)
             if cursor.rowcount != len(self._properties_tuple_list):
                 logger.warning("some properties were not saved!")
+            for hook in self._hooks:
+                hook.on_save(cursor, self._records)
             self._connection.commit()
+        for hook in self._hooks:
+            hook.on_commit(self._records)
         self._total_saved += self._queue_count
         logger.info(f"Ads fetched: {len(self._fetched)}, Discarded: {self._discarded_count}")
         logger.info(f"Saved {self._queue_count} ads. Total saved: {self._total_saved}")
@@ -65,25 +84,62 @@ class IkmanStorage:
         self._ad_tuple_list.clear()
         self._phone_tuple_list.clear()
         self._properties_tuple_list.clear()
+        self._records = []
         self._queue_count = 0
 
-    def queue(self, __fetched):
+    def queue(self, __fetched: IkmanDetail):
         """Place fetched ad in queue.
         The ad will be saved later when queue reaches a specific size or when Agent finishes running
 
-        :param __fetched: a list of three items [ad info tuple, [list of phone tuples], [list of properties tuples]]
+        :param __fetched: the ad, phones and properties as parsed, with the typed column values
         :return:
         """
-        self._ad_tuple_list.append(__fetched[0])
-        self._phone_tuple_list.extend(__fetched[1])
-        self._properties_tuple_list.extend(__fetched[2])
-        self._fetched[__fetched[0][0]] = IkmanStorage.FROM_SERVER
+        ad, phones, properties = __fetched
+        self._ad_tuple_list.append(ad)
+        # an ad without a listed number has a phone with only the seller name, number is NOT NULL
+        self._phone_tuple_list.extend(phone for phone in phones if phone[PHONE_NUMBER] is not None)
+        self._properties_tuple_list.extend(properties)
+        if len(self._hooks) > 0:
+            record = self._get_record(__fetched)
+            for hook in self._hooks:
+                hook.on_queue(record)
+            self._records.append(record)
+        self._fetched[ad.ad_id] = IkmanStorage.FROM_SERVER
         self._queue_count += 1
-        logger.info(f"queueing ad {__fetched[0][0]},save queue size: {self._queue_count}/{self._QUEUE_LIMIT}")
+        logger.info(f"queueing ad {ad.ad_id},save queue size: {self._queue_count}/{self._QUEUE_LIMIT}")
 
         if self._queue_count == self._QUEUE_LIMIT:
             self.save()
 
+    def _get_record(self, __fetched: IkmanDetail) -> dict:
+        """storage hook record of a fetched ad. See StorageHook"""
+        ad, phones, _ = __fetched
+        return {"source": "ikman", "ad_id": ad.ad_id, "title": ad.title, "description": ad.description,
+                "make": ad.make, "model": ad.model, "yom": ad.yom, "price": ad.price_value, "mileage": ad.mileage_km,
+                "engine_cc": ad.engine_cc_value, "location": ad.location, "datetime": ad.datetime,
+                "phones": [phone[PHONE_NUMBER] for phone in phones if phone[PHONE_NUMBER] is not None],
+                "seller_name": next((phone[PHONE_NAME] for phone in phones if phone[PHONE_NAME]), None)}
+
+    def observe(self, observations: dict):
+        """records changes of already saved ads seen again in a list page
+
+        :param observations: dict of ad id -> dict of observed fields (raw price text)
+        """
+        if self._history is None:
+            return
+        known = {}
+        for _id, observed in observations.items():
+            if _id in self._local:
+                fields = dict(observed)
+                if "price" in fields:
+                    fields["price"] = self._normaliser.parse_price(fields["price"])
+                known[_id] = fields
+        self._history.observe(known)
+
+    def is_stored(self, _id: str) -> bool:
+        """True when the ad is in local storage or fetched in this session"""
+        return _id in self._local or _id in self._fetched
+
     def get_fetch_count(self) -> int:
         return len(self._fetched)
 
@@ -107,6 +163,14 @@ class IkmanStorage:
         logger.info(f"Ads available in this page: {len(_filtered)}")
         return _filtered
 
+    def count_local(self, _list) -> int:
+        """number of ads of the list in local storage
+
+        :param _list: a list of strings - ad ids
+        :return:
+        """
+        return sum(1 for _id in _list if _id in self._local)
+
     def filter_list_new(self, _list) -> list:
         """removes fetched ads and older ads than the latest ad and returns list
 
@@ -155,17 +219,16 @@ class IkmanStorage:
     def _get_all_local(self):
         with self._connection.cursor() as cursor:
             cursor.execute(IkmanStorage.GET_LOCAL_ADS_QUERY)
-            # local ads is list of tuples. Each tuple contains a single element i.e ad_id
-            local_ads: list = cursor.fetchall()
+            # each row is a tuple with a single element i.e ad_id. Rows are read one by one instead of with fetchall
+            # so that a list of all rows is not kept next to the dict
 
             count = 0
-            # convert list into dict
-            for local_ad in local_ads:
+            for local_ad in cursor:
                 if count < 3:
                     self._latest.append(local_ad[0])
                     count += 1
                 self._local[local_ad[0]] = IkmanStorage.FROM_LOCAL
-            logger.info(f"Queried latest {len(local_ads)} ads from local storage")
+            logger.info(f"Queried latest {len(self._local)} ads from local storage")
 
             if len(self._local) == 0:
                 logger.info("No local ads")
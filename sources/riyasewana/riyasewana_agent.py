@@ -4,29 +4,47 @@ from typing import TYPE_CHECKING
 
 import logger
 from sources.agent import Agent
-from requests.exceptions import HTTPError
+from requests.exceptions import HTTPError, ConnectionError
 from app_exceptions import RiyasewanaContentNotFound
 
 if TYPE_CHECKING:
     from fetcher import Fetcher
+    from scheduler import PollScheduler
+    from retry_queue import RetryQueue
+    from profiler import Profiler
+    from feed_scheduler import FeedScheduler
+    from raw_archive import RawArchive
     from riyasewana_parser import RiyasewanaParser
     from riyasewana_storage import RiyasewanaStorage
+    from sources.riyasewana.riyasewana_records import RiyasewanaAd
 
 logger = logger.get_logger("riyasewana.agent")
 
 
 class RiyasewanaAgent(Agent):
-    def __init__(self, fetcher: Fetcher, parser: RiyasewanaParser, storage: RiyasewanaStorage, source_props: dict):
+    def __init__(self, fetcher: Fetcher, parser: RiyasewanaParser, storage: RiyasewanaStorage,
+                 scheduler: PollScheduler, retry_queue: RetryQueue, profiler: Profiler, feeds: FeedScheduler,
+                 archive: RawArchive, source_props: dict):
         self._fetcher = fetcher
         self._parser = parser
         self._storage = storage
-        self._LIST_BASE_URL = source_props["LIST_URL"]
+        self._scheduler = scheduler
+        self._retry_queue = retry_queue
+        self._profiler = profiler
+        self._feeds = feeds
+        self._archive = archive
+        self._NAME = source_props["NAME"]
         self._FETCH_LIMIT = source_props["FETCH_LIMIT"]
         self._FETCH_TYPE = source_props["FETCH_TYPE"]
         self._MAX_FAILS = source_props["MAX_FAILS"]
+        self._STREAM_DETAILS = source_props["STREAM_DETAILS"]
 
-        self._total_pages = 1
-        self._page_count = 1
+        # feed of the current page
+        self._feed = None
+        self._new_count = 0
+        self._detail_count = 0
+        # retried ads are fetched within the retry budget, not FETCH_LIMIT
+        self._retried_count = 0
 
         self._fetch_queue = []
 
@@ -37,12 +55,17 @@ class RiyasewanaAgent(Agent):
     def run(self):
         logger.info("Running Riyasewana agent")
         logger.info(f"Fetch type: {'New ads' if self._IS_FETCH_TYPE_NEW else 'All ads'} - Limit={self._FETCH_LIMIT}")
+        self._retry_deferred()
+        self._feeds.start()
         while self._has_next():
+            self._next_feed()
             logger.info(f"Fetch limit: {self._FETCH_LIMIT}")
             try:
-                response = self._fetcher.get(self._gen_list_url())
-                response.raise_for_status()
-                self._fetch_queue = self._parser.parse_list(response)
+                with self._profiler.phase("list fetch"):
+                    response = self._fetcher.get(self._gen_list_url())
+                    response.raise_for_status()
+                with self._profiler.phase("list parse"):
+                    self._fetch_queue = self._parser.parse_list(response)
             except HTTPError as hte:
                 logger.warning(hte)
                 self._handle_failure()
@@ -58,11 +81,17 @@ class RiyasewanaAgent(Agent):
                 self._handle_failure()
                 self._inc_page_count()
                 continue
-            self._filter_list()
+            with self._profiler.phase("filter"):
+                self._storage.observe(self._parser.get_list_observations())
+                self._filter_list()
             self._get_details()
             self._inc_page_count()
         # save any leftover fetched ads in queue
-        self._storage.save()
+        with self._profiler.phase("save"):
+            self._storage.save()
+        self._feeds.finish_run()
+        if self._IS_FETCH_TYPE_NEW:
+            self._scheduler.finish_run(self._NAME, self._is_up_to_date())
         logger.info(f"Finished running agent on source Riyasewana")
 
     def _handle_failure(self):
@@ -74,16 +103,29 @@ class RiyasewanaAgent(Agent):
         """returns false as a stop condition for the agent"""
         return self._failure_count <= self._MAX_FAILS
 
+    def _next_feed(self):
+        self._feed = self._feeds.next_feed()
+        if len(self._feeds) > 1:
+            logger.info(f"Feed {self._feed.name}, page {self._feed.page_count}")
+        if self._feed.page_count == 1:
+            self._parser.reset_pagination()
+
     def _gen_list_url(self) -> str:
-        if self._page_count == 1:
-            return self._LIST_BASE_URL
-        return self._LIST_BASE_URL + "?page=" + str(self._page_count)
+        list_url = self._feed.list_url
+        if self._feed.page_count == 1:
+            return list_url
+        # search feeds already have a query string
+        return list_url + ("&" if "?" in list_url else "?") + "page=" + str(self._feed.page_count)
 
     def _inc_page_count(self):
         # should be called after the first list parse
-        if self._page_count == 1:
-            self._total_pages = self._get_total_pages()
-        self._page_count += 1
+        if self._feed.page_count == 1:
+            self._feed.total_pages = self._get_total_pages()
+            self._feed.total_ads = self._parser.get_total_ads()
+        self._feed.page_count += 1
+        self._feeds.record_page(self._feed, 1 + self._detail_count, self._new_count)
+        self._new_count = 0
+        self._detail_count = 0
 
     def _get_total_pages(self) -> int:
         _pages = self._parser.get_total_pages()
@@ -107,45 +149,102 @@ class RiyasewanaAgent(Agent):
             # el is a tuple (url, id)
             detail_url = el[0]
             ad_id = el[1]
+            self._detail_count += 1
             try:
-                response = self._fetcher.get(detail_url)
-                response.raise_for_status()
-                ad_detail = self._parser.parse_detail(response)
+                ad_detail = self._fetch_detail(ad_id, detail_url)
             except HTTPError as hte:
                 logger.warning(hte)
                 self._handle_failure()
+                self._defer(ad_id, detail_url, hte)
+                continue
+            except ConnectionError as ex:
+                logger.warning(ex)
+                self._handle_failure()
+                self._defer(ad_id, detail_url, ex)
                 continue
             except RiyasewanaContentNotFound as ex:
                 logger.warning(ex)
                 self._handle_failure()
+                self._defer(ad_id, detail_url, ex)
                 continue
             except AttributeError as ex:
                 logger.exception(ex)
                 self._handle_failure()
+                self._defer(ad_id, detail_url, ex)
                 continue
-            ad_detail["ad_id"] = ad_id
-            ad_detail["url"] = detail_url
-            self._storage.queue(ad_detail)
+            self._queue(ad_detail)
         logger.info("Clearing fetch queue")
         self._fetch_queue.clear()
 
+    def _queue(self, ad_detail: RiyasewanaAd):
+        with self._profiler.phase("save"):
+            self._storage.queue(ad_detail)
+
+    def _defer(self, ad_id: str, detail_url: str, ex: Exception):
+        if self._retry_queue is not None:
+            self._retry_queue.defer(ad_id, detail_url, ex)
+
+    def _retry_deferred(self):
+        """fetches ads that failed in earlier runs. Failures here do not count against MAX_FAILS"""
+        if self._retry_queue is None:
+            return
+        for ad_id, detail_url in self._retry_queue.get_due():
+            if self._storage.is_stored(ad_id):
+                # saved in an earlier run, nothing is queued before the retries
+                self._retry_queue.resolve([ad_id])
+                continue
+            try:
+                ad_detail = self._fetch_detail(ad_id, detail_url)
+            except (HTTPError, ConnectionError, RiyasewanaContentNotFound, AttributeError) as ex:
+                logger.warning(f"Retry of ad {ad_id} failed. {ex}")
+                self._retry_queue.defer(ad_id, detail_url, ex)
+                continue
+            self._queue(ad_detail)
+            self._retried_count += 1
+
+    def _fetch_detail(self, ad_id: str, detail_url: str) -> RiyasewanaAd:
+        with self._profiler.phase("detail fetch"):
+            if self._STREAM_DETAILS:
+                # only the start of the page up to the spec table is read
+                content = self._fetcher.stream(detail_url, self._parser.read_detail_stream)
+            else:
+                response = self._fetcher.get(detail_url)
+                response.raise_for_status()
+                content = response.content
+        if self._archive is not None:
+            with self._profiler.phase("archive"):
+                self._archive.put(self._NAME, ad_id, detail_url, content)
+        with self._profiler.phase("detail parse"):
+            return self._parser.parse_detail_content(content, ad_id, detail_url)
+
     def _filter_list(self):
+        # ads of other feeds fetched in this run are removed too, before any detail fetch
         if self._IS_FETCH_TYPE_NEW:
-            self._fetch_queue = self._storage.filter_list_new(self._fetch_queue)
+            page_size = len(self._fetch_queue)
+            if len(self._feeds) == 1:
+                self._fetch_queue = self._storage.filter_list_new(self._fetch_queue)
+                self._feed.up_to_date = self._storage.is_up_to_date()
+            else:
+                # the latest local ads may belong to another feed
+                known = self._storage.count_local(self._fetch_queue)
+                self._fetch_queue = self._storage.filter_list(self._fetch_queue)
+                self._feed.up_to_date = known >= Agent.FEED_KNOWN_ADS
+            self._scheduler.record_cycle(self._NAME, page_size, len(self._fetch_queue))
         else:
             self._fetch_queue = self._storage.filter_list(self._fetch_queue)
+        self._new_count = len(self._fetch_queue)
 
     def _is_up_to_date(self) -> bool:
         if self._IS_FETCH_TYPE_NEW:
-            return self._storage.is_up_to_date()
+            return self._feeds.is_up_to_date()
 
     def _is_below_limit(self) -> bool:
         if self._FETCH_LIMIT == 0:
             return True
-        return self._storage.get_fetch_count() < self._FETCH_LIMIT
+        return self._storage.get_fetch_count() - self._retried_count < self._FETCH_LIMIT
 
     def _has_next_page(self) -> bool:
-        return self._total_pages >= self._page_count
+        return self._feeds.has_active()
 
     def _has_next(self) -> bool:
         if self._IS_FETCH_TYPE_NEW:
@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import codecs
 import re
 from datetime import datetime
+from html.parser import HTMLParser
 from typing import TYPE_CHECKING
 
 from bs4 import BeautifulSoup, SoupStrainer
 
 import logger
 from app_exceptions import RiyasewanaContentNotFound
+from normaliser import Normaliser
+from sources.riyasewana.riyasewana_records import RiyasewanaAd
 
 if TYPE_CHECKING:
     from requests import Response
@@ -24,11 +28,20 @@ class RiyasewanaParser():
         self._LOCATION_PATTERN = re.compile("[^, ]+$")
         self._TOTAL_PAGES_PATTERN = re.compile("(?=...)\\d{3}(?=\\sNext)")
         self._TOTAL_ADS_PATTENS = re.compile("(?<=\\sof\\s)\\d+(?=\sSearch\\s)")
+        self._STREAM_CHUNK_SIZE = 4096
+        # label of a row of the spec table -> field of the ad
+        self._TABLE_FIELDS = {"contact": "number", "price": "price", "make": "make", "model": "model", "yom": "yom",
+                              "mileage (km)": "mileage", "engine (cc)": "engine_cc", "start type": "start_type",
+                              "details": "details"}
+        self._normaliser = Normaliser()
 
         self._active_page = 0
         self._total_pages = 0
         self._total_ads = 0
 
+        # fields of every ad in the last list page. ad id -> dict
+        self._list_observations = {}
+
     def parse_list(self, _response: Response) -> list:
         """
 
@@ -52,6 +65,7 @@ class RiyasewanaParser():
         self._total_ads = int(self._TOTAL_ADS_PATTENS.search(result_summary).group())
         result_list = soup.find("ul").contents
         href_list = []
+        self._list_observations = {}
         for a in result_list:
             try:
                 url = a.contents[0].a.get("href")
@@ -60,42 +74,109 @@ class RiyasewanaParser():
                 continue
             ad_id = self._ID_PATTERN.search(url).group()
             href_list.append((url, ad_id))
+            price = a.select_one(".boxintxt.b")
+            self._list_observations[ad_id] = {"price": price.text if price is not None else None}
         # return [href_list[0]]
         return href_list
 
-    def parse_detail(self, _response: Response) -> dict:
-        ad_details = {}
-        content = _response.content
+    def parse_detail(self, _response: Response, ad_id: str, url: str) -> RiyasewanaAd:
+        return self.parse_detail_content(_response.content, ad_id, url)
+
+    def parse_detail_stream(self, _response: Response, ad_id: str, url: str) -> RiyasewanaAd:
+        """parses ad details from a streamed response and stops reading once the spec table has closed
+
+        The response should be requested with stream=True. Everything after the spec table (footer, scripts, related
+        ads) is never downloaded when the connection is closed by the caller.
+        """
+        return self.parse_detail_content(self.read_detail_stream(_response), ad_id, url)
+
+    def read_detail_stream(self, _response: Response) -> bytes:
+        """the start of a streamed detail page up to the end of the spec table. See parse_detail_stream"""
+        detector = _ContentEndDetector()
+        decoder = codecs.getincrementaldecoder(_response.encoding or "utf-8")(errors="replace")
+        chunks = []
+        for chunk in _response.iter_content(chunk_size=self._STREAM_CHUNK_SIZE):
+            chunks.append(chunk)
+            detector.feed(decoder.decode(chunk))
+            if detector.is_done():
+                logger.info(f"Spec table closed after {sum(len(c) for c in chunks)} bytes. Stopped reading")
+                break
+        return b"".join(chunks)
+
+    def parse_detail_content(self, content: bytes, ad_id: str, url: str) -> RiyasewanaAd:
+        """the ad of a detail page with the typed values of its price, mileage and engine capacity. Rows missing from
+        the spec table are empty strings
+        """
         strainer = SoupStrainer(id="content")
         soup = BeautifulSoup(content, "html.parser", parse_only=strainer)
 
         if len(soup.contents) == 0:
             raise RiyasewanaContentNotFound("Ad details not found. ID 'content' not found")
 
-        ad_details["title"] = soup.h1.text
+        title = soup.h1.text
         subheading = soup.h2.text
-        ad_details["name"] = self._NAME_PATTERN.search(subheading).group()
-        ad_details["location"] = self._LOCATION_PATTERN.search(subheading).group()
+        name = self._NAME_PATTERN.search(subheading).group()
+        location = self._LOCATION_PATTERN.search(subheading).group()
         datetime_str = self._DATE_PATTERN.search(subheading).group()
-        ad_details["date"] = self._get_iso_datetime_str(datetime_str)
         table = soup.table.contents
 
-        KEY_LIST = ["contact", "price", "make", "model", "yom", "mileage (km)", "engine (cc)", "start type", "details"]
-
-        for key in KEY_LIST:
-            ad_details[key] = ""
-
+        fields = dict.fromkeys(self._TABLE_FIELDS.values(), "")
         for tr in table:
             if tr.name == "tr" and len(tr.contents) > 0:
                 count = 0
                 for td in tr.contents:
-                    if td.text.lower() in ad_details:
-                        ad_details[td.text.lower()] = tr.contents[count + 1].text
+                    label = td.text.lower()
+                    if label in self._TABLE_FIELDS:
+                        fields[self._TABLE_FIELDS[label]] = tr.contents[count + 1].text
                     count += 1
-        return ad_details
+        # the yom column is int(4) NOT NULL, 0 when the year is missing or not a year
+        fields["yom"] = self._normaliser.parse_yom(fields["yom"]) or 0
+        return RiyasewanaAd(ad_id=ad_id, name=name, location=location, url=url, title=title,
+                            datetime=self._get_iso_datetime_str(datetime_str), **fields,
+                            price_value=self._normaliser.parse_price(fields["price"]),
+                            mileage_km=self._normaliser.parse_mileage(fields["mileage"]),
+                            engine_cc_value=self._normaliser.parse_engine_cc(fields["engine_cc"]))
 
     def get_total_pages(self):
         return self._total_pages
 
+    def get_total_ads(self):
+        return self._total_ads
+
+    def reset_pagination(self):
+        """forgets the pagination data so the next list page parsed is taken as the first page of a list"""
+        self._active_page = 0
+        self._total_pages = 0
+        self._total_ads = 0
+
+    def get_list_observations(self) -> dict:
+        """fields of the ads seen in the last parsed list page. ad id -> dict with price text"""
+        return self._list_observations
+
     def _get_iso_datetime_str(self, _datetime_str) -> str:
         return datetime.strptime(_datetime_str, "%Y-%m-%d %I:%M %p").isoformat()
+
+
+class _ContentEndDetector(HTMLParser):
+    """Incremental html parser that only tracks when the first table inside the element with id 'content' is closed"""
+
+    def __init__(self):
+        super(_ContentEndDetector, self).__init__(convert_charrefs=False)
+        self._in_content = False
+        self._table_depth = 0
+        self._done = False
+
+    def handle_starttag(self, tag, attrs):
+        if not self._in_content:
+            self._in_content = ("id", "content") in attrs
+        elif tag == "table":
+            self._table_depth += 1
+
+    def handle_endtag(self, tag):
+        if self._in_content and tag == "table" and self._table_depth > 0:
+            self._table_depth -= 1
+            if self._table_depth == 0:
+                self._done = True
+
+    def is_done(self) -> bool:
+        return self._done
@@ -0,0 +1,25 @@
+from typing import NamedTuple, Optional
+
+
+# A row of the riyasewana_ad table as built by RiyasewanaParser. Field names are the column names and the save query of
+# RiyasewanaStorage is built from them, so a row is passed to executemany as it is. A named tuple has no __dict__ and
+# takes the memory of a plain tuple of its values
+class RiyasewanaAd(NamedTuple):
+    ad_id: str
+    name: str
+    number: str
+    location: str
+    url: str
+    title: str
+    price: str
+    datetime: str
+    make: str
+    model: str
+    yom: int
+    mileage: str
+    engine_cc: str
+    start_type: str
+    details: str
+    price_value: Optional[int]
+    mileage_km: Optional[int]
+    engine_cc_value: Optional[int]
@@ -3,9 +3,12 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 import logger
+from normaliser import Normaliser
+from sources.riyasewana.riyasewana_records import RiyasewanaAd
 
 if TYPE_CHECKING:
     from mysql.connector import MySQLConnection
+    from ad_history import AdHistory
 
 logger = logger.get_logger("riyasewana.storage")
 
@@ -15,13 +18,19 @@ class RiyasewanaStorage:
     FROM_LOCAL = 0
 
     GET_LOCAL_ADS_QUERY: str = f"SELECT ad_id FROM riyasewana_ad ORDER BY datetime DESC"
-    SAVE_AD_QUERY: str = "INSERT INTO riyasewana_ad(ad_id, name, number, location, url, title, price, datetime, make, " \
-                         "model, yom, mileage, engine_cc, start_type, details) VALUES (%s, %s, %s, %s, %s, %s, %s, " \
-                         "%s, %s, %s, %s, %s, %s, %s, %s) "
-
-    def __init__(self, connection: MySQLConnection):
+    GET_STATE_QUERY: str = "SELECT ad_id, price_value, NULL, NULL, details FROM riyasewana_ad WHERE ad_id IN ({})"
+    # the columns are the fields of the record, which is saved as it is. Rows hitting a unique key are skipped, other
+    # errors such as a NULL in a NOT NULL column still fail the save
+    SAVE_AD_QUERY: str = f"INSERT INTO riyasewana_ad({', '.join(RiyasewanaAd._fields)}) " \
+                         f"VALUES ({', '.join(['%s'] * len(RiyasewanaAd._fields))}) " \
+                         f"ON DUPLICATE KEY UPDATE ad_id = ad_id"
+
+    def __init__(self, connection: MySQLConnection, hooks: list, history: AdHistory = None):
         self._QUEUE_LIMIT = 10
         self._connection = connection
+        self._hooks = hooks
+        self._history = history
+        self._normaliser = Normaliser()
         self._local = {}
         self._latest = []
         self._get_all_local()
@@ -32,10 +41,13 @@ class RiyasewanaStorage:
         self._total_saved = 0
         self._discarded_count = 0
         self._ad_tuple_list = []
+        self._records = []
 
         self._fetched_all_latest = False
 
     def save(self):
+        if self._history is not None:
+            self._history.flush()
         if self._queue_count == 0:
             logger.info("No ads in save queue")
             return
@@ -44,7 +56,11 @@ class RiyasewanaStorage:
             cursor.executemany(RiyasewanaStorage.SAVE_AD_QUERY, self._ad_tuple_list)
             if cursor.rowcount != len(self._ad_tuple_list):
                 logger.warning("some ads were not saved!")
+            for hook in self._hooks:
+                hook.on_save(cursor, self._records)
             self._connection.commit()
+        for hook in self._hooks:
+            hook.on_commit(self._records)
         self._total_saved += self._queue_count
         logger.info(f"Ads fetched: {len(self._fetched)}, Discarded: {self._discarded_count}")
         logger.info(f"Saved {self._queue_count} ads. Total saved: {self._total_saved}")
@@ -54,21 +70,52 @@ class RiyasewanaStorage:
     def _clear_queue(self):
         logger.info("Clearing save queue")
         self._ad_tuple_list.clear()
+        self._records = []
         self._queue_count = 0
 
-    def queue(self, _ad: dict):
-        ad = (_ad["ad_id"], _ad["name"], _ad["contact"], _ad["location"], _ad["url"], _ad["title"], _ad["price"],
-              _ad["date"], _ad["make"], _ad["model"], _ad["yom"], _ad["mileage (km)"], _ad["engine (cc)"],
-              _ad["start type"],
-              _ad["details"])
+    def queue(self, ad: RiyasewanaAd):
         self._ad_tuple_list.append(ad)
-        self._fetched[ad[0]] = RiyasewanaStorage.FROM_SERVER
+        if len(self._hooks) > 0:
+            record = self._get_record(ad)
+            for hook in self._hooks:
+                hook.on_queue(record)
+            self._records.append(record)
+        self._fetched[ad.ad_id] = RiyasewanaStorage.FROM_SERVER
         self._queue_count += 1
-        logger.info(f"queueing ad {ad[0]}, save queue size: {self._queue_count}/{self._QUEUE_LIMIT}")
+        logger.info(f"queueing ad {ad.ad_id}, save queue size: {self._queue_count}/{self._QUEUE_LIMIT}")
 
         if self._queue_count == self._QUEUE_LIMIT:
             self.save()
 
+    def _get_record(self, ad: RiyasewanaAd) -> dict:
+        """storage hook record of a fetched ad. See StorageHook"""
+        # the yom column is 0 when the year is unknown
+        return {"source": "riyasewana", "ad_id": ad.ad_id, "title": ad.title, "description": ad.details,
+                "make": ad.make, "model": ad.model, "yom": ad.yom or None, "price": ad.price_value,
+                "mileage": ad.mileage_km, "engine_cc": ad.engine_cc_value, "location": ad.location,
+                "datetime": ad.datetime, "phones": [ad.number] if ad.number != "" else [],
+                "seller_name": ad.name or None}
+
+    def observe(self, observations: dict):
+        """records changes of already saved ads seen again in a list page
+
+        :param observations: dict of ad id -> dict of observed fields (raw price text)
+        """
+        if self._history is None:
+            return
+        known = {}
+        for _id, observed in observations.items():
+            if _id in self._local:
+                fields = dict(observed)
+                if "price" in fields:
+                    fields["price"] = self._normaliser.parse_price(fields["price"])
+                known[_id] = fields
+        self._history.observe(known)
+
+    def is_stored(self, _id: str) -> bool:
+        """True when the ad is in local storage or fetched in this session"""
+        return _id in self._local or _id in self._fetched
+
     def get_fetch_count(self) -> int:
         return len(self._fetched)
 
@@ -93,6 +140,14 @@ class RiyasewanaStorage:
         logger.info(f"Ads available in this page: {len(_filtered)}")
         return _filtered
 
+    def count_local(self, _list) -> int:
+        """number of ads of the list in local storage
+
+        :param _list: a list of tuples. Each tuple has two elements (url: str, ad_id: str)
+        :return:
+        """
+        return sum(1 for tp in _list if tp[1] in self._local)
+
     def filter_list_new(self, _list) -> list:
         """removes fetched ads and older ads than the latest ad and returns list
 
@@ -142,17 +197,16 @@ class RiyasewanaStorage:
     def _get_all_local(self):
         with self._connection.cursor() as cursor:
             cursor.execute(RiyasewanaStorage.GET_LOCAL_ADS_QUERY)
-            # local ads is list of tuples. Each tuple contains a single element i.e ad_id
-            local_ads: list = cursor.fetchall()
+            # each row is a tuple with a single element i.e ad_id. Rows are read one by one instead of with fetchall
+            # so that a list of all rows is not kept next to the dict
 
             count = 0
-            # convert list into dict
-            for local_ad in local_ads:
+            for local_ad in cursor:
                 if count < 3:
                     self._latest.append(local_ad[0])
                     count += 1
                 self._local[local_ad[0]] = RiyasewanaStorage.FROM_LOCAL
-            logger.info(f"Queried latest {len(local_ads)} ads from local storage")
+            logger.info(f"Queried latest {len(self._local)} ads from local storage")
 
             if len(self._local) == 0:
                 logger.info("No local ads")
@@ -0,0 +1,23 @@
+class StorageHook:
+    """Receives the ads a storage saves.
+
+    Each ad is passed as a record dict with the keys source, ad_id, title, description, make, model, yom, price,
+    mileage, engine_cc, location, datetime, phones (list of numbers as written in the ad) and seller_name. Values are
+    None when a source does not provide them.
+    """
+
+    def on_queue(self, record: dict):
+        """called when an ad is queued for saving, before the on_save of its save"""
+        pass
+
+    def on_save(self, cursor, records: list):
+        """called with the cursor of the save, before the transaction is committed"""
+        pass
+
+    def on_commit(self, records: list):
+        """called after the saved ads are committed"""
+        pass
+
+    def close(self):
+        """called once when the aggregator stops"""
+        pass